@@ -1,24 +1,71 @@
 # lexy/admin.py
 from django.contrib import admin
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.urls import path, reverse
+from django.forms.models import BaseInlineFormSet
 from django.utils.html import format_html, mark_safe
 from django.utils import timezone
-from django.db.models import Count, Avg
-from .models import EmergencyRequest, Lawyer, LawyerChat, ChatMessage, Consultation, LawyerReview
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+from django.db.models.functions import Left
+from .models import (
+    EmergencyRequest, Lawyer, LawyerChat, ChatMessage, ArchivedChatMessage, Consultation, LawyerReview
+)
+from .pagination import KeysetPaginationMixin
+from .search import FullTextSearchMixin
+from .status import cache_request_status
+from .exports import (
+    EXPORT_BACKGROUND_THRESHOLD,
+    EXPORT_FILENAME_RE,
+    EXPORT_FORMATS,
+    get_export_path,
+    iter_export,
+    start_background_export,
+)
+
+# Статистика юристов кэшируется ненадолго, чтобы список в админке оставался дешевым
+LAWYER_STATS_CACHE_KEY = 'lexy_admin_lawyer_stats'
+LAWYER_STATS_CACHE_TIMEOUT = 60
+
+LAWYER_STATS_AGGREGATES = {
+    'active_chats': Count('chats', filter=Q(chats__status='active'), distinct=True),
+    'completed_chats': Count('chats', filter=Q(chats__status='completed'), distinct=True),
+    'reviews_total': Count('reviews', distinct=True),
+}
+
+
+def get_lawyer_stats():
+    """Статистика по всем юристам одним запросом: {id юриста: {показатель: значение}}"""
+    stats = cache.get(LAWYER_STATS_CACHE_KEY)
+    if stats is None:
+        rows = Lawyer.objects.order_by().annotate(**LAWYER_STATS_AGGREGATES).values(
+            'id', *LAWYER_STATS_AGGREGATES
+        )
+        stats = {row.pop('id'): row for row in rows}
+        cache.set(LAWYER_STATS_CACHE_KEY, stats, timeout=LAWYER_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def get_stats_for_lawyer(lawyer):
+    """Статистика одного юриста из общего кэша"""
+    empty = dict.fromkeys(LAWYER_STATS_AGGREGATES, 0)
+    return get_lawyer_stats().get(lawyer.pk, empty)
 
 
 @admin.register(EmergencyRequest)
-class EmergencyRequestAdmin(admin.ModelAdmin):
+class EmergencyRequestAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = 'created_at'
     list_display = ('id', 'short_problem', 'status', 'urgency', 'category', 'created_at', 'chat_link')
-    list_filter = ('status', 'urgency', 'category', 'created_at')
+    list_filter = ('status', 'urgency', 'category', ('reused_from', admin.EmptyFieldListFilter), 'created_at')
     search_fields = ('problem_text', 'summary', 'error_message')
-    readonly_fields = ('created_at', 'analyzed_at', 'get_analysis_duration', 'chats_count')
+    readonly_fields = ('created_at', 'analyzed_at', 'get_analysis_duration', 'chats_count', 'reused_from')
 
     fieldsets = (
         ('Основная информация', {
             'fields': ('problem_text', 'status', 'category', 'urgency', 'confidence')
         }),
         ('Ответ ИИ', {
-            'fields': ('ai_response', 'response_format', 'summary')
+            'fields': ('ai_response', 'response_format', 'summary', 'reused_from')
         }),
         ('Связанные чаты', {
             'fields': ('chats_count',),
@@ -36,6 +83,17 @@ class EmergencyRequestAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        """Агрегаты по строкам считаются одним запросом вместо COUNT на каждую строку"""
+        return super().get_queryset(request).annotate(
+            chats_total=Count('chats', distinct=True),
+        )
+
+    def save_model(self, request, obj, form, change):
+        """Статус, измененный вручную, сразу виден странице ожидания"""
+        super().save_model(request, obj, form, change)
+        cache_request_status(obj)
+
     def short_problem(self, obj):
         """Краткое описание проблемы для списка"""
         if len(obj.problem_text) > 100:
@@ -61,13 +119,19 @@ class EmergencyRequestAdmin(admin.ModelAdmin):
 
     def chats_count(self, obj):
         """Количество связанных чатов"""
-        return obj.chats.count()
+        if obj.pk is None:
+            return 0
+        count = getattr(obj, 'chats_total', None)
+        if count is None:
+            count = obj.chats.count()
+        return count
 
     chats_count.short_description = 'Количество чатов'
+    chats_count.admin_order_field = 'chats_total'
 
     def chat_link(self, obj):
         """Ссылка на чаты"""
-        count = obj.chats.count()
+        count = obj.chats_total
         if count > 0:
             return format_html(
                 '<a href="{}?request__id__exact={}">{} чат(ов)</a>',
@@ -78,12 +142,14 @@ class EmergencyRequestAdmin(admin.ModelAdmin):
         return '-'
 
     chat_link.short_description = 'Чаты'
+    chat_link.admin_order_field = 'chats_total'
 
 
 @admin.register(Lawyer)
 class LawyerAdmin(admin.ModelAdmin):
     list_display = ('name', 'specialization_display', 'experience_years', 'rating_display',
-                    'cases_completed', 'is_available', 'response_time', 'photo_preview')
+                    'cases_completed', 'active_chats', 'completed_chats', 'reviews_total',
+                    'is_available', 'response_time', 'photo_preview')
     list_filter = ('specialization', 'is_available', 'is_verified', 'is_premium', 'created_at')
     search_fields = ('name', 'bio', 'education', 'certifications', 'personality')
     list_editable = ('is_available', 'response_time')
@@ -119,6 +185,13 @@ class LawyerAdmin(admin.ModelAdmin):
 
     actions = ['make_available', 'make_unavailable', 'verify_lawyers']
 
+    def get_queryset(self, request):
+        # Колонки списка считаются в том же запросе, что и страница, чтобы сортировка
+        # шла по настоящим агрегатам; кэш нужен только сводке на странице юриста
+        return super().get_queryset(request).annotate(**{
+            f'stats_{name}': aggregate for name, aggregate in LAWYER_STATS_AGGREGATES.items()
+        })
+
     def specialization_display(self, obj):
         """Отображаемое название специализации"""
         return obj.get_specialization_display()
@@ -153,11 +226,33 @@ class LawyerAdmin(admin.ModelAdmin):
 
     photo_preview_large.short_description = 'Превью фото'
 
+    def active_chats(self, obj):
+        """Количество активных чатов"""
+        return obj.stats_active_chats
+
+    active_chats.short_description = 'Активных чатов'
+    active_chats.admin_order_field = 'stats_active_chats'
+
+    def completed_chats(self, obj):
+        """Количество завершенных чатов"""
+        return obj.stats_completed_chats
+
+    completed_chats.short_description = 'Завершенных чатов'
+    completed_chats.admin_order_field = 'stats_completed_chats'
+
+    def reviews_total(self, obj):
+        """Количество отзывов"""
+        return obj.stats_reviews_total
+
+    reviews_total.short_description = 'Отзывов'
+    reviews_total.admin_order_field = 'stats_reviews_total'
+
     def stats_summary(self, obj):
         """Сводка статистики"""
-        active_chats = obj.chats.filter(status='active').count()
-        completed_chats = obj.chats.filter(status='completed').count()
-        reviews = obj.reviews.count()
+        stats = get_stats_for_lawyer(obj)
+        active_chats = stats['active_chats']
+        completed_chats = stats['completed_chats']
+        reviews = stats['reviews_total']
 
         return format_html(
             '''
@@ -198,14 +293,64 @@ class LawyerAdmin(admin.ModelAdmin):
     verify_lawyers.short_description = "Верифицировать"
 
 
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Формсет, отображающий только одну страницу связанных объектов"""
+    per_page = 50
+    page = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_paginated_queryset'):
+            offset = (self.page - 1) * self.per_page
+            self._paginated_queryset = super().get_queryset()[offset:offset + self.per_page]
+        return self._paginated_queryset
+
+
 class ChatMessageInline(admin.TabularInline):
     """Inline для сообщений в админке чатов"""
     model = ChatMessage
+    formset = PaginatedInlineFormSet
+    per_page = 50
+    page_param = 'messages_page'
     extra = 0
     readonly_fields = ('timestamp', 'sender', 'short_message', 'is_read')
     fields = ('timestamp', 'sender', 'short_message', 'is_read')
     ordering = ('-timestamp',)
 
+    def get_formset(self, request, obj=None, **kwargs):
+        """Страница сообщений выбирается параметром messages_page"""
+        formset = super().get_formset(request, obj, **kwargs)
+        total = obj.message_count if obj else 0
+        pages = max((total + self.per_page - 1) // self.per_page, 1)
+        try:
+            page = int(request.GET.get(self.page_param, 1))
+        except ValueError:
+            page = 1
+        page = min(max(page, 1), pages)
+
+        formset.per_page = self.per_page
+        formset.page = page
+
+        # Инлайны создаются на каждый запрос, поэтому заголовок можно менять
+        # Остальные параметры (_changelist_filters и т.п.) сохраняются в ссылках
+        def page_url(number):
+            params = request.GET.copy()
+            params[self.page_param] = number
+            return f'?{params.urlencode()}'
+
+        links = []
+        if page > 1:
+            links.append(format_html('<a href="{}">← новее</a>', page_url(page - 1)))
+        if page < pages:
+            links.append(format_html('<a href="{}">старее →</a>', page_url(page + 1)))
+        self.verbose_name_plural = format_html(
+            '{} (страница {} из {}) {}',
+            ChatMessage._meta.verbose_name_plural,
+            page,
+            pages,
+            mark_safe(' '.join(links))
+        )
+        return formset
+
     def short_message(self, obj):
         """Краткое сообщение"""
         if len(obj.message) > 50:
@@ -223,7 +368,10 @@ class LawyerChatAdmin(admin.ModelAdmin):
     list_display = ('id', 'get_client', 'lawyer_link', 'status', 'message_count',
                     'last_message_at', 'duration_display', 'created_at')
     list_filter = ('status', 'lawyer', 'created_at', 'is_anonymous')
+    list_select_related = ('request', 'lawyer')
     search_fields = ('request__problem_text', 'lawyer__name', 'client_name', 'client_email')
+    raw_id_fields = ('request',)
+    show_full_result_count = False
     readonly_fields = ('created_at', 'updated_at', 'archived_at', 'duration_display',
                        'messages_preview', 'get_client_full')
     inlines = [ChatMessageInline]
@@ -248,7 +396,17 @@ class LawyerChatAdmin(admin.ModelAdmin):
         }),
     )
 
-    actions = ['mark_as_completed', 'mark_as_archived', 'export_chats']
+    actions = ['mark_as_completed', 'mark_as_archived', 'export_chats', 'export_chats_csv']
+
+    def get_urls(self):
+        urls = [
+            path(
+                'exports/<str:filename>/',
+                self.admin_site.admin_view(self.download_export),
+                name='lexy_lawyerchat_export',
+            ),
+        ]
+        return urls + super().get_urls()
 
     def get_client(self, obj):
         """Клиент для отображения в списке"""
@@ -271,7 +429,7 @@ class LawyerChatAdmin(admin.ModelAdmin):
             ''',
             obj.request.id,
             obj.request.problem_text[:100] + '...' if len(obj.request.problem_text) > 100 else obj.request.problem_text,
-            obj.request.get_category_display() if obj.request.category else 'Не указана',
+            obj.request.category or 'Не указана',
             obj.request.created_at.strftime('%d.%m.%Y %H:%M')
         )
 
@@ -295,13 +453,16 @@ class LawyerChatAdmin(admin.ModelAdmin):
 
     def messages_preview(self, obj):
         """Превью последних сообщений"""
-        messages = obj.messages.order_by('-timestamp')[:5]
+        # Из базы читаем только начало текста, без данных ИИ
+        messages = obj.messages.order_by('-timestamp').annotate(
+            preview=Left('message', 101)
+        ).values('sender', 'preview', 'timestamp')[:5]
         html = '<div style="max-height: 300px; overflow-y: auto; background: #f8f9fa; padding: 10px; border-radius: 5px;">'
 
         for msg in messages:
-            bg_color = '#e3f2fd' if msg.sender == 'lawyer' else '#f5f5f5'
-            align = 'left' if msg.sender == 'lawyer' else 'right'
-            sender_display = 'Юрист' if msg.sender == 'lawyer' else 'Клиент'
+            bg_color = '#e3f2fd' if msg['sender'] == 'lawyer' else '#f5f5f5'
+            align = 'left' if msg['sender'] == 'lawyer' else 'right'
+            sender_display = 'Юрист' if msg['sender'] == 'lawyer' else 'Клиент'
 
             html += format_html(
                 '''
@@ -311,8 +472,8 @@ class LawyerChatAdmin(admin.ModelAdmin):
                 </div>
                 ''',
                 bg_color, align, sender_display,
-                msg.message[:100] + '...' if len(msg.message) > 100 else msg.message,
-                msg.timestamp.strftime('%H:%M %d.%m.%Y')
+                msg['preview'][:100] + '...' if len(msg['preview']) > 100 else msg['preview'],
+                msg['timestamp'].strftime('%H:%M %d.%m.%Y')
             )
 
         html += '</div>'
@@ -334,20 +495,60 @@ class LawyerChatAdmin(admin.ModelAdmin):
 
     mark_as_archived.short_description = "Архивировать чаты"
 
+    def export(self, request, queryset, export_format):
+        """Потоковая выгрузка переписки; большие выборки выгружаются в фоне"""
+        count = queryset.count()
+        if count > EXPORT_BACKGROUND_THRESHOLD:
+            filename = start_background_export(queryset, export_format)
+            url = reverse('admin:lexy_lawyerchat_export', args=[filename])
+            self.message_user(request, format_html(
+                'Экспорт {} чатов запущен в фоне. Файл будет доступен по <a href="{}">ссылке</a>.',
+                count, url
+            ))
+            return None
+
+        response = StreamingHttpResponse(
+            iter_export(queryset, export_format),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        filename = f"chats-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     def export_chats(self, request, queryset):
-        """Экспорт чатов (заглушка)"""
-        self.message_user(request, f"Экспорт {queryset.count()} чатов начат")
+        """Экспорт чатов в JSON Lines"""
+        return self.export(request, queryset, 'jsonl')
+
+    export_chats.short_description = "Экспортировать чаты (JSONL)"
+
+    def export_chats_csv(self, request, queryset):
+        """Экспорт чатов в CSV"""
+        return self.export(request, queryset, 'csv')
 
-    export_chats.short_description = "Экспортировать чаты"
+    export_chats_csv.short_description = "Экспортировать чаты (CSV)"
+
+    def download_export(self, request, filename):
+        """Скачать файл фоновой выгрузки"""
+        if not self.has_view_permission(request) or not EXPORT_FILENAME_RE.fullmatch(filename):
+            raise Http404
+        export_path = get_export_path(filename)
+        if not export_path.exists():
+            raise Http404("Выгрузка еще не готова")
+        return FileResponse(open(export_path, 'rb'), as_attachment=True, filename=filename)
 
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = 'timestamp'
+    ordering = ('-timestamp',)
     list_display = ('id', 'get_chat_info', 'sender_display', 'short_message',
                     'timestamp', 'is_read', 'message_type')
-    list_filter = ('sender', 'message_type', 'timestamp', 'is_read')
-    search_fields = ('message', 'chat__lawyer__name', 'chat__request__problem_text')
-    readonly_fields = ('timestamp', 'edited_at', 'full_message_preview')
+    list_filter = ('sender', 'message_type', 'chat__lawyer', 'timestamp', 'is_read')
+    list_select_related = ('chat__lawyer',)
+    # Только колонки полнотекстового индекса; юрист выбирается фильтром
+    search_fields = ('message',)
+    raw_id_fields = ('chat',)
+    readonly_fields = ('timestamp', 'edited_at', 'full_message_preview', 'ai_response_data')
 
     fieldsets = (
         ('Основная информация', {
@@ -406,6 +607,30 @@ class ChatMessageAdmin(admin.ModelAdmin):
     full_message_preview.short_description = 'Превью сообщения'
 
 
+@admin.register(ArchivedChatMessage)
+class ArchivedChatMessageAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = 'timestamp'
+    ordering = ('-timestamp',)
+    list_display = ('id', 'chat', 'sender', 'short_message', 'timestamp', 'moved_at')
+    list_filter = ('sender', 'timestamp')
+    list_select_related = ('chat__lawyer', 'chat__request')
+    raw_id_fields = ('chat',)
+
+    def short_message(self, obj):
+        """Краткое сообщение"""
+        if len(obj.message) > 50:
+            return obj.message[:50] + '...'
+        return obj.message
+
+    short_message.short_description = 'Сообщение'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Consultation)
 class ConsultationAdmin(admin.ModelAdmin):
     list_display = ('id', 'lawyer', 'consultation_type', 'status', 'scheduled_at',
@@ -0,0 +1,71 @@
+# lexy/admission.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import EmergencyRequest
+
+# Контроль приема заявок на анализ. Ожидание новой заявки оценивается как
+# (заявок в очереди / параллельных вызовов ИИ) * среднее время ответа ИИ.
+# Очередь общая для всех процессов (из базы), а вызовы ИИ выполняет пул
+# каждого процесса, поэтому параллельных вызовов - concurrency * processes.
+#   ожидание <= ADMISSION['slo_seconds']           - обычный анализ через ИИ;
+#   ожидание <= ADMISSION['reject_after_seconds']  - быстрый локальный разбор (lexy/triage.py);
+#   дольше                                         - заявка не принимается, клиенту предлагается
+#                                                    повторить позже.
+# Ответ юриста в чате ждет web-воркер, поэтому чат не ставится в очередь, если
+# по оценке ответ не успеет за LLM_SCHEDULER['chat_timeout_seconds'].
+
+LATENCY_CACHE_KEY = 'lexy_llm_latency'
+
+# Вес нового замера в скользящем среднем времени ответа
+LATENCY_SMOOTHING = 0.2
+
+ACCEPT = 'accept'
+FAST_PATH = 'fast_path'
+REJECT = 'reject'
+
+
+def record_llm_latency(seconds):
+    """Учесть время ответа ИИ в экспоненциальном скользящем среднем"""
+    previous = cache.get(LATENCY_CACHE_KEY)
+    value = seconds if previous is None else previous + LATENCY_SMOOTHING * (seconds - previous)
+    cache.set(LATENCY_CACHE_KEY, value, None)
+
+
+def get_llm_latency():
+    return cache.get(LATENCY_CACHE_KEY, settings.ADMISSION['default_latency_seconds'])
+
+
+def get_backlog():
+    """Заявки, ожидающие анализа; зависшие дольше stale_after_seconds не считаются"""
+    since = timezone.now() - timedelta(seconds=settings.ADMISSION['stale_after_seconds'])
+    return EmergencyRequest.objects.filter(status='analyzing', created_at__gte=since).count()
+
+
+def estimate_wait():
+    """Оценка в секундах, сколько новая заявка будет ждать ответа ИИ"""
+    options = settings.ADMISSION
+    rounds = get_backlog() // (options['concurrency'] * options['processes']) + 1
+    return rounds * get_llm_latency()
+
+
+def estimate_chat_wait(queue_depth):
+    """Оценка в секундах, сколько ответ юриста будет ждать за queue_depth задачами очереди процесса"""
+    rounds = queue_depth // settings.LLM_SCHEDULER['workers'] + 1
+    return rounds * get_llm_latency()
+
+
+def admit():
+    """Решение по новой заявке и оценка ожидания: (ACCEPT | FAST_PATH | REJECT, секунд)"""
+    options = settings.ADMISSION
+    if not options['enabled']:
+        return ACCEPT, 0
+    wait = estimate_wait()
+    if wait <= options['slo_seconds']:
+        return ACCEPT, wait
+    if wait <= options['reject_after_seconds']:
+        return FAST_PATH, wait
+    return REJECT, wait
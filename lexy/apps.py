@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class LexyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "lexy"
+
+    def ready(self):
+        from .db import configure_sqlite_connection
+        from .metrics import check_metrics_settings
+        from .search import repair_search_indexes
+        from .tracing import install_query_tracing
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='lexy_configure_sqlite')
+        connection_created.connect(install_query_tracing, dispatch_uid='lexy_install_query_tracing')
+        post_migrate.connect(repair_search_indexes, sender=self, dispatch_uid='lexy_repair_search_indexes')
+        checks.register(check_metrics_settings, checks.Tags.caches, deploy=True)
@@ -0,0 +1,104 @@
+# lexy/compression.py
+import json
+import re
+import zlib
+from collections import Counter
+
+# Сжатое значение: первый байт - номер словаря (0 - без словаря), дальше поток zlib.
+# Несжатый JSON, записанный до появления сжатия, начинается с печатного символа
+# и читается как есть, поэтому номера словарей должны оставаться меньше 32.
+#
+# Словари не меняются после выпуска: старые строки распаковываются своим словарем.
+# Новый словарь (manage.py bench_compression --train) добавляется со следующим номером
+# и становится CURRENT_DICTIONARY_ID; manage.py recompress_ai_responses пережимает старые строки.
+
+COMPRESSION_LEVEL = 6
+
+# Типичные фрагменты ответов анализатора и AI-юристов. zlib лучше всего
+# использует строки из конца словаря, поэтому самые частые - в конце.
+ANALYZER_DICTIONARY_V1 = (
+    'Рекомендуется обратиться к юристу. Информация носит справочный характер '
+    'и не является юридической консультацией. '
+    'Гражданский кодекс РФ, Трудовой кодекс РФ, Семейный кодекс РФ, '
+    'Кодекс об административных правонарушениях, Уголовный кодекс РФ, '
+    'Жилищный кодекс РФ, Закон о защите прав потребителей, ОСАГО, '
+    'статья ст. ч. п. работодатель, заработной платы, увольнение, ДТП, '
+    'страховая компания, суд, исковое заявление, претензия, документы, '
+    'Можете рассказать подробнее о ситуации? Давайте разберем вашу ситуацию по пунктам '
+    'Все имеющиеся документы по делу готов ответить сейчас '
+    '{"lawyer_name":"","specialization":"","message":"","questions_to_client":["'
+    '"],"action_plan":["","documents_needed":["","next_contact":"'
+    '{"analysis":{"category":"","confidence":0.,"summary":"","urgency":"medium",'
+    '"recommendations":{"immediate_actions":["","documents":["","next_steps":["'
+    '"legal_references":{"laws":["","articles":["'
+    '"lawyer_match":{"specialization":"","reason":"'
+    '"disclaimer":"'
+).encode('utf-8')
+
+DICTIONARIES = {
+    1: ANALYZER_DICTIONARY_V1,
+}
+
+CURRENT_DICTIONARY_ID = 1
+
+
+def dumps(value):
+    """Компактная сериализация JSON, одинаковая для сжатия и замеров"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def compress_json(value, dictionary_id=CURRENT_DICTIONARY_ID):
+    """Сериализовать и сжать значение"""
+    if dictionary_id:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=DICTIONARIES[dictionary_id])
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    return bytes([dictionary_id]) + compressor.compress(dumps(value)) + compressor.flush()
+
+
+def get_dictionary_id(data):
+    """Номер словаря, которым сжато значение; None для несжатого JSON"""
+    data = bytes(data)
+    if data and (data[0] == 0 or data[0] in DICTIONARIES):
+        return data[0]
+    return None
+
+
+def decompress_json(data):
+    """Распаковать значение, сохраненное compress_json (или несжатый JSON)"""
+    data = bytes(data)
+    dictionary_id = get_dictionary_id(data)
+    if dictionary_id is None:
+        return json.loads(data.decode('utf-8'))
+
+    if dictionary_id:
+        decompressor = zlib.decompressobj(zdict=DICTIONARIES[dictionary_id])
+    else:
+        decompressor = zlib.decompressobj()
+    raw = decompressor.decompress(data[1:]) + decompressor.flush()
+    return json.loads(raw.decode('utf-8'))
+
+
+TOKEN_RE = re.compile(r'"[^"]{1,40}":|[^\s"{}\[\],:]{3,40}[\s,.:]*')
+
+
+def train_dictionary(values, size=16 * 1024):
+    """
+    Построить словарь zlib по образцам значений: частые ключи JSON и слова,
+    отсортированные по выигрышу (частота * длина), самые выгодные - в конце.
+    """
+    counts = Counter()
+    for value in values:
+        counts.update(TOKEN_RE.findall(dumps(value).decode('utf-8')))
+
+    ranked = sorted(
+        (token for token, count in counts.items() if count > 1),
+        key=lambda token: counts[token] * len(token.encode('utf-8'))
+    )
+    dictionary = b''
+    for token in reversed(ranked):
+        encoded = token.encode('utf-8')
+        if len(dictionary) + len(encoded) > size:
+            break
+        dictionary = encoded + dictionary
+    return dictionary
@@ -0,0 +1,40 @@
+# lexy/db.py
+from django.conf import settings
+
+# Прагмы, которые разрешено задавать через SQLITE_PRAGMAS: только действующие
+# в пределах соединения. journal_mode сохраняется в файле базы и задается
+# миграцией (set_journal_mode), иначе любая команда manage.py меняла бы файл
+SQLITE_ALLOWED_PRAGMAS = ('busy_timeout', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+
+SQLITE_JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal')
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Настройка каждого нового соединения с SQLite (сигнал connection_created).
+    busy_timeout заставляет писателя подождать освобождения блокировки
+    вместо ошибки "database is locked".
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if name not in SQLITE_ALLOWED_PRAGMAS:
+                raise ValueError(f"Недопустимая прагма SQLite: {name}")
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def set_journal_mode(connection, mode):
+    """
+    Сменить режим журнала базы SQLite. Режим сохраняется в файле базы,
+    поэтому задается один раз (миграция lexy 0011), а не на каждом соединении.
+    Вне транзакции: внутри нее SQLite не переключает журнал в WAL.
+    """
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    if mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Недопустимый режим журнала SQLite: {mode}")
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {mode}")
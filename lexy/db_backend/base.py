@@ -0,0 +1,34 @@
+# lexy/db_backend/base.py
+from django.db.backends.sqlite3 import base
+
+# SQLite с выбором режима начала транзакции, как OPTIONS['transaction_mode']
+# в Django 5.1. Транзакция по умолчанию (DEFERRED) берет блокировку записи
+# только на первой записи, и если другой писатель успел изменить базу после ее
+# первого чтения, SQLite сразу возвращает "database is locked", не дожидаясь
+# busy_timeout. BEGIN IMMEDIATE берет блокировку записи в начале транзакции,
+# и ожидание busy_timeout работает.
+
+TRANSACTION_MODES = ('DEFERRED', 'EXCLUSIVE', 'IMMEDIATE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            return None
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ValueError(f"Недопустимый режим транзакций SQLite: {mode}")
+        return mode.upper()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
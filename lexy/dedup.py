@@ -0,0 +1,128 @@
+# lexy/dedup.py
+import hashlib
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import EmergencyRequest
+from .search import stem_russian
+
+# Поиск почти одинаковых заявок, чтобы не отправлять повторно тот же текст в анализ.
+# Текст нормализуется (регистр, ё, окончания слов), разбивается на пары слов, и по ним
+# считается 64-битный SimHash. Кандидаты - недавние завершенные заявки с близким
+# SimHash; окончательно похожесть проверяется мерой Жаккара по парам слов.
+
+WORD_RE = re.compile(r'\w+')
+
+SIMHASH_BITS = 64
+
+# Кандидаты с SimHash дальше этого числа бит даже не сравниваются по тексту
+MAX_SIMHASH_DISTANCE = 12
+
+
+def normalize_words(text):
+    text = text.lower().replace('ё', 'е')
+    return [stem_russian(word) for word in WORD_RE.findall(text) if len(word) > 2 or word.isdigit()]
+
+
+def shingles(text):
+    """Пары соседних слов нормализованного текста (для короткого текста - сами слова)"""
+    words = normalize_words(text)
+    if len(words) < 2:
+        return set(words)
+    return {f'{first} {second}' for first, second in zip(words, words[1:])}
+
+
+def simhash(text):
+    """64-битный SimHash как знаковое число (помещается в BigIntegerField); None для пустого текста"""
+    features = shingles(text)
+    if not features:
+        return None
+
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    value = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def hamming_distance(first, second):
+    return bin((first ^ second) & ((1 << SIMHASH_BITS) - 1)).count('1')
+
+
+def similarity(first_text, second_text):
+    """Мера Жаккара по парам слов, от 0 до 1"""
+    first, second = shingles(first_text), shingles(second_text)
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def find_duplicate(problem_text, text_hash, exclude_id=None):
+    """
+    Недавняя завершенная заявка с почти таким же текстом, чей ответ можно переиспользовать.
+    Возвращает (заявка, похожесть) или (None, 0.0).
+    """
+    options = settings.ANALYSIS_REUSE
+    if not options['enabled'] or text_hash is None:
+        return None, 0.0
+
+    since = timezone.now() - timedelta(days=options['window_days'])
+    candidates = (
+        EmergencyRequest.objects
+        .filter(status='completed', created_at__gte=since, simhash__isnull=False, ai_response__isnull=False)
+        .exclude(category__in=options['excluded_categories'])
+        .exclude(pk=exclude_id)
+        .order_by('-created_at')
+        .values_list('pk', 'simhash')[:options['max_candidates']]
+    )
+    close = []
+    for pk, candidate_hash in candidates:
+        distance = hamming_distance(text_hash, candidate_hash)
+        if distance <= MAX_SIMHASH_DISTANCE:
+            close.append((distance, pk))
+    close.sort()
+
+    for distance, pk in close[:5]:
+        candidate = EmergencyRequest.objects.get(pk=pk)
+        score = similarity(problem_text, candidate.problem_text)
+        if score < options['min_similarity']:
+            continue
+        # Ответы с ошибкой анализа и предварительные ответы без ИИ не переиспользуются
+        response = candidate.ai_response
+        if not isinstance(response, dict) or 'error' in response or response.get('fast_path'):
+            continue
+        return candidate, score
+    return None, 0.0
+
+
+def reuse_analysis(request_obj, source):
+    """Скопировать результат анализа из похожей заявки"""
+    request_obj.reused_from = source.reused_from or source
+    request_obj.ai_response = source.ai_response
+    request_obj.response_format = source.response_format
+    request_obj.category = source.category
+    request_obj.urgency = source.urgency
+    request_obj.confidence = source.confidence
+    request_obj.summary = source.summary
+    request_obj.status = 'completed'
+    request_obj.analyzed_at = timezone.now()
+
+
+def get_reuse_stats(days=7):
+    """Доля заявок за последние days дней, получивших готовый ответ без вызова ИИ"""
+    stats = EmergencyRequest.objects.filter(
+        created_at__gte=timezone.now() - timedelta(days=days),
+        status='completed'
+    ).aggregate(
+        total=Count('pk'),
+        reused=Count('pk', filter=Q(reused_from__isnull=False))
+    )
+    stats['hit_rate'] = stats['reused'] / stats['total'] if stats['total'] else 0.0
+    return stats
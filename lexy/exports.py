@@ -0,0 +1,122 @@
+# lexy/exports.py
+import csv
+import json
+import re
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+from .models import ArchivedChatMessage, ChatMessage
+
+# Размер пачки строк, читаемых из курсора (на PostgreSQL - серверный курсор)
+EXPORT_CHUNK_SIZE = 2000
+
+# Выборки больше этого числа чатов выгружаются в файл в фоновом потоке
+EXPORT_BACKGROUND_THRESHOLD = 1000
+
+EXPORT_FILENAME_RE = re.compile(r'chats-[0-9a-f]{32}\.(jsonl|csv)')
+
+EXPORT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Поля одной строки выгрузки: сообщение вместе с данными его чата
+EXPORT_FIELDS = {
+    'chat_id': 'chat_id',
+    'request_id': 'chat__request_id',
+    'chat_status': 'chat__status',
+    'lawyer': 'chat__lawyer__name',
+    'message_id': 'id',
+    'sender': 'sender',
+    'message_type': 'message_type',
+    'timestamp': 'timestamp',
+    'message': 'message',
+}
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(chats):
+    """Сообщения выбранных чатов в порядке переписки, без загрузки всей выборки в память"""
+    chat_ids = chats.order_by().values('pk')
+    fields = EXPORT_FIELDS.values()
+    # Сообщения чатов, перенесенных в архив, читаются из архивной таблицы
+    messages = ChatMessage.objects.filter(chat__in=chat_ids).order_by().values_list(*fields)
+    archived = ArchivedChatMessage.objects.filter(chat__in=chat_ids).order_by().values_list(*fields)
+    messages = messages.union(archived, all=True).order_by('chat_id', 'timestamp', 'id')
+
+    for values in messages.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = dict(zip(EXPORT_FIELDS, values))
+        row['timestamp'] = row['timestamp'].isoformat()
+        yield row
+
+
+def iter_jsonl(rows):
+    """Строки выгрузки в формате JSON Lines"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def iter_csv(rows):
+    """Строки выгрузки в формате CSV с заголовком"""
+    writer = csv.DictWriter(Echo(), fieldnames=list(EXPORT_FIELDS))
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_export(chats, export_format):
+    """Фрагменты файла выгрузки в нужном формате"""
+    rows = iter_export_rows(chats)
+    if export_format == 'csv':
+        return iter_csv(rows)
+    return iter_jsonl(rows)
+
+
+def get_export_path(filename):
+    """Путь к файлу фоновой выгрузки"""
+    return settings.EXPORTS_ROOT / filename
+
+
+def write_export(chats, export_format, filename):
+    """Записать выгрузку в файл; пишется во временный файл и переименовывается по готовности"""
+    path = get_export_path(filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.part')
+
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in iter_export(chats, export_format):
+                f.write(chunk)
+        tmp_path.rename(path)
+    except Exception as e:
+        print(f"Ошибка экспорта чатов в {filename}: {e}")
+        tmp_path.unlink(missing_ok=True)
+
+
+def run_background_export(chats, export_format, filename):
+    """Выгрузка в фоновом потоке; соединение с БД потока закрывается по окончании"""
+    try:
+        write_export(chats, export_format, filename)
+    finally:
+        connection.close()
+
+
+def start_background_export(chats, export_format):
+    """Запустить выгрузку в отдельном потоке, вернуть имя будущего файла"""
+    filename = f"chats-{uuid.uuid4().hex}.{export_format}"
+    thread = threading.Thread(
+        target=run_background_export,
+        args=(chats, export_format, filename)
+    )
+    thread.daemon = True
+    thread.start()
+    return filename
@@ -0,0 +1,62 @@
+# lexy/fields.py
+from django import forms
+from django.db import models
+
+from .compression import compress_json, decompress_json
+
+
+class CompressedJSONField(models.BinaryField):
+    """
+    JSON, который хранится в базе сжатым (lexy/compression.py).
+    Сжимается при сохранении и распаковывается при чтении из базы,
+    в коде значение выглядит как обычный JSONField.
+    Поиск по содержимому в базе для такого поля невозможен.
+    """
+
+    description = "Сжатый JSON"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.editable:
+            del kwargs['editable']
+        else:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decompress_json(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_json(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return compress_json(value)
+
+    def value_to_string(self, obj):
+        # Как у JSONField: сериализатор (dumpdata) выводит значение как JSON-объект,
+        # а не строку, и loaddata получает обратно тот же словарь
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.JSONField, **kwargs})
+
+
+def get_compressed_json_fields():
+    """Все поля CompressedJSONField проекта: [(модель, поле)]"""
+    from django.apps import apps
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, CompressedJSONField)
+    ]
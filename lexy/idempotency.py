@@ -0,0 +1,117 @@
+# lexy/idempotency.py
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+# Повтор запроса (двойной клик, повторная отправка клиентом) возвращает сохраненный
+# ответ первого запроса без новых записей в базу и вызовов ИИ.
+#   Idempotency-Key - ключ, выбранный клиентом, хранится IDEMPOTENCY['key_ttl'] секунд;
+#   без заголовка ключом служит хэш адреса и тела запроса, но только
+#   IDEMPOTENCY['content_ttl'] секунд, чтобы намеренный повтор того же текста прошел.
+# Ключи привязаны к клиенту (IP и User-Agent) и хранятся в общем кэше (CACHES).
+
+# Запас к наибольшему времени работы view поверх ожидания ответа ИИ
+PENDING_MARGIN_SECONDS = 30
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+PENDING = 'pending'
+
+
+def get_idempotency_key(request, view_name):
+    """Ключ кэша запроса и срок его хранения"""
+    # Сессии у нового посетителя до первой заявки нет, а повтор придет уже с ней,
+    # поэтому клиент определяется по IP и User-Agent
+    owner = f"{request.META.get('REMOTE_ADDR', '')}:{request.META.get('HTTP_USER_AGENT', '')}"
+    client_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+    if client_key:
+        digest = hashlib.sha256(f'{owner}:{client_key}'.encode('utf-8')).hexdigest()
+        return f'lexy_idem_{view_name}_{digest}', settings.IDEMPOTENCY['key_ttl']
+
+    digest = hashlib.sha256(f'{owner}:{request.path}:'.encode('utf-8') + request.body).hexdigest()
+    return f'lexy_idem_{view_name}_body_{digest}', settings.IDEMPOTENCY['content_ttl']
+
+
+def is_replayable(response):
+    """Сохраняются только успешные ответы: после ошибки повтор должен выполниться заново"""
+    if not 200 <= response.status_code < 300 or response.streaming:
+        return False
+    if response.get('Content-Type', '').startswith('application/json'):
+        try:
+            return json.loads(response.content).get('success', True) is not False
+        except (ValueError, AttributeError):
+            return False
+    return True
+
+
+def get_pending_timeout():
+    """
+    Сколько живет метка "выполняется": не меньше, чем view может ждать ответа ИИ
+    из очереди, иначе повтор во время долгого вызова запустил бы ИИ еще раз
+    """
+    return max(
+        settings.LLM_SCHEDULER['chat_timeout_seconds'] + PENDING_MARGIN_SECONDS,
+        settings.IDEMPOTENCY['wait_seconds'],
+    )
+
+
+def replay(saved):
+    response = HttpResponse(saved['content'], status=saved['status'], content_type=saved['content_type'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def wait_for_result(key):
+    """Ждать, пока первый запрос с тем же ключом закончится; None - не дождались"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY['wait_seconds']
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        saved = cache.get(key)
+        if saved is None:
+            return None
+        if saved != PENDING:
+            return saved
+    return None
+
+
+def idempotent(view_func):
+    """Делает POST-view идемпотентным по Idempotency-Key или по содержимому запроса"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key, ttl = get_idempotency_key(request, view_func.__name__)
+
+        # cache.add атомарен: только первый из одновременных запросов займет ключ
+        if not cache.add(key, PENDING, max(ttl, get_pending_timeout())):
+            saved = cache.get(key)
+            if saved == PENDING:
+                saved = wait_for_result(key)
+            if saved is not None and saved != PENDING:
+                return replay(saved)
+            return JsonResponse({
+                'success': False,
+                'error': 'Такой запрос уже обрабатывается, повторите позже'
+            }, status=409)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            cache.delete(key)
+            raise
+
+        if is_replayable(response):
+            cache.set(key, {
+                'status': response.status_code,
+                'content': response.content,
+                'content_type': response['Content-Type'],
+            }, ttl)
+        else:
+            cache.delete(key)
+        return response
+
+    return wrapper
@@ -0,0 +1,226 @@
+# lexy/llm_fake.py
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from .triage import guess_category, guess_urgency
+
+# Локальная замена Yandex AI для разработки и нагрузочных тестов без сети.
+# Поддерживается то подмножество API, которым пользуется yandex_utils:
+#   responses.create(prompt={"id": агент} | model=..., input=..., conversation=...)
+#   conversations.create()
+# FakeLLMClient работает внутри процесса (LLM_BACKEND['backend'] = 'fake'),
+# FakeLLMServer отвечает по HTTP в формате OpenAI Responses API
+# (manage.py run_fake_llm, клиент - LLM_BACKEND['backend'] = 'yandex' с base_url на него).
+# Ответы собираются из шаблонов в форматах анализатора и AI-юристов.
+
+ANALYZER_TEMPLATE = {
+    'recommendations': {
+        'immediate_actions': ['Соберите документы по ситуации', 'Зафиксируйте хронологию событий'],
+        'documents': ['Паспорт', 'Договоры и переписка'],
+        'next_steps': ['Направьте письменную претензию', 'При отказе обратитесь в суд'],
+    },
+    'legal_references': {'laws': ['Гражданский кодекс РФ'], 'articles': ['ст. 15', 'ст. 309']},
+    'disclaimer': 'Информация носит справочный характер и не является юридической консультацией.',
+}
+
+LAWYER_TEMPLATE = {
+    'questions_to_client': ['Можете рассказать подробнее о ситуации?', 'Какие документы у вас есть?'],
+    'action_plan': ['Разберем ситуацию по пунктам', 'Подготовим претензию'],
+    'documents_needed': ['Все имеющиеся документы по делу'],
+    'next_contact': 'готов ответить сейчас',
+}
+
+# Текст проблемы в промпте determine_lawyer_specialization
+PROBLEM_IN_PROMPT = re.compile(r'Проблема:(.*?)Доступные специализации', re.S)
+
+CATEGORY_SPECIALIZATIONS = {
+    'dtp': 'auto',
+    'labor': 'labor',
+    'family': 'family',
+}
+
+
+class FakeLLMError(Exception):
+    """Искусственная ошибка, которую выдает заглушка с вероятностью error_rate"""
+
+
+class FakeLLM:
+    """
+    Генератор ответов: задержка по логнормальному распределению с медианой
+    latency_ms и разбросом latency_sigma, ошибки с вероятностью error_rate.
+    """
+
+    def __init__(self, latency_ms=0, latency_sigma=0.5, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self, prefix):
+        with self._lock:
+            return f'{prefix}_{next(self._ids):06d}'
+
+    def delay(self):
+        """Задержка очередного ответа в секундах"""
+        if not self.latency_ms:
+            return 0.0
+        with self._lock:
+            return self.random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def should_fail(self):
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+    def respond(self, prompt=None, model=None, input='', **kwargs):
+        """Текст ответа на вызов responses.create; FakeLLMError - искусственная ошибка"""
+        time.sleep(self.delay())
+        if self.should_fail():
+            raise FakeLLMError('Искусственная ошибка заглушки LLM')
+
+        from .yandex_utils import AGENTS
+
+        agent_id = (prompt or {}).get('id')
+        if agent_id is None:
+            # Прямой запрос к модели - определение специализации юриста
+            match = PROBLEM_IN_PROMPT.search(input)
+            problem_text = match.group(1) if match else input
+            return CATEGORY_SPECIALIZATIONS.get(guess_category(problem_text), 'civil')
+
+        if agent_id == AGENTS['general']['id']:
+            return json.dumps(self.analysis(input), ensure_ascii=False)
+
+        lawyer = next(
+            (lawyer for lawyer in AGENTS['lawyers'].values() if lawyer['id'] == agent_id),
+            {'name': 'Юрист', 'specialization': 'Правовая помощь'}
+        )
+        return json.dumps({
+            'lawyer_name': lawyer['name'],
+            'specialization': lawyer['specialization'],
+            'message': f"Здравствуйте! Я {lawyer['name']}. Понимаю вашу ситуацию: {input[:100]}",
+            **LAWYER_TEMPLATE,
+        }, ensure_ascii=False)
+
+    def analysis(self, problem_text):
+        category = guess_category(problem_text)
+        return {
+            'analysis': {
+                'category': category,
+                'confidence': 0.85,
+                'summary': problem_text[:200],
+                'urgency': guess_urgency(problem_text),
+            },
+            **ANALYZER_TEMPLATE,
+            'lawyer_match': {
+                'specialization': CATEGORY_SPECIALIZATIONS.get(category, 'civil'),
+                'reason': 'Подбор по категории дела',
+            },
+        }
+
+
+class FakeLLMClient:
+    """Клиент с интерфейсом openai.OpenAI (responses, conversations) поверх FakeLLM"""
+
+    def __init__(self, llm=None, **options):
+        self.llm = llm or FakeLLM(**options)
+        self.responses = SimpleNamespace(create=self.create_response)
+        self.conversations = SimpleNamespace(create=self.create_conversation)
+
+    def create_response(self, **kwargs):
+        text = self.llm.respond(**kwargs)
+        return SimpleNamespace(id=self.llm.next_id('resp'), output_text=text, usage=usage(kwargs.get('input', ''), text))
+
+    def create_conversation(self, **kwargs):
+        return SimpleNamespace(id=self.llm.next_id('conv'))
+
+
+def usage(prompt_text, text):
+    """Примерный расход токенов: одно слово - один токен"""
+    input_tokens, output_tokens = len(str(prompt_text).split()), len(text.split())
+    return SimpleNamespace(
+        input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens
+    )
+
+
+def response_payload(llm, response_id, text, model, prompt_text=''):
+    """Тело ответа POST /responses в формате OpenAI Responses API"""
+    return {
+        'id': response_id,
+        'object': 'response',
+        'created_at': int(time.time()),
+        'status': 'completed',
+        'model': model or 'fake-llm',
+        'output': [{
+            'type': 'message',
+            'id': llm.next_id('msg'),
+            'status': 'completed',
+            'role': 'assistant',
+            'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+        }],
+        'usage': {
+            **vars(usage(prompt_text, text)),
+            'input_tokens_details': {'cached_tokens': 0},
+            'output_tokens_details': {'reasoning_tokens': 0},
+        },
+        'parallel_tool_calls': False,
+        'tool_choice': 'auto',
+        'tools': [],
+    }
+
+
+class FakeLLMRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        llm = self.server.llm
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': {'message': 'Некорректный JSON'}})
+
+        path = self.path.rstrip('/')
+        if path.endswith('/conversations'):
+            return self.send_json(200, {
+                'id': llm.next_id('conv'), 'object': 'conversation',
+                'created_at': int(time.time()), 'metadata': {},
+            })
+        if path.endswith('/responses'):
+            try:
+                text = llm.respond(**body)
+            except FakeLLMError as e:
+                return self.send_json(500, {'error': {'message': str(e), 'type': 'server_error'}})
+            return self.send_json(200, response_payload(
+                llm, llm.next_id('resp'), text, body.get('model'), body.get('input', '')
+            ))
+        return self.send_json(404, {'error': {'message': f'Неизвестный путь {self.path}'}})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушки; base_url для клиента - http://host:port/v1"""
+
+    daemon_threads = True
+
+    def __init__(self, address, llm, verbose=False):
+        super().__init__(address, FakeLLMRequestHandler)
+        self.llm = llm
+        self.verbose = verbose
@@ -0,0 +1,125 @@
+# lexy/llm_recording.py
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+
+# Запись и воспроизведение обращений к ИИ для воспроизводимых замеров.
+# RecordingLLMClient оборачивает любой клиент (Yandex AI, заглушку) и дописывает
+# каждый вызов responses.create / conversations.create в файл фикстуры (JSON Lines):
+#   {"method": "responses.create", "request": {...},
+#    "response": {"id": ..., "output_text": ..., "usage": {"input_tokens": ..., ...}},
+#    "error": null, "latency_ms": 812.4}
+# ReplayLLMClient отдает записанные ответы с записанной задержкой, умноженной
+# на latency_scale (0 - без задержки).
+# Запрос ищется по методу, агенту/модели и тексту; id conversation не учитывается,
+# потому что при каждом прогоне он свой. Одинаковые запросы получают записанные
+# ответы по очереди, последний повторяется.
+
+
+class FixtureMissError(LookupError):
+    """В фикстуре нет ответа на такой запрос"""
+
+
+def request_key(method, request):
+    prompt = request.get('prompt') or {}
+    return json.dumps(
+        [method, prompt.get('id'), request.get('model'), request.get('input')],
+        ensure_ascii=False, sort_keys=True
+    )
+
+
+class RecordingLLMClient:
+    """Клиент, который передает вызовы в client и записывает их в path"""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.responses = SimpleNamespace(create=self.create_response)
+        self.conversations = SimpleNamespace(create=self.create_conversation)
+
+    def create_response(self, **kwargs):
+        return self.record('responses.create', self.client.responses.create, kwargs)
+
+    def create_conversation(self, **kwargs):
+        return self.record('conversations.create', self.client.conversations.create, kwargs)
+
+    def record(self, method, func, kwargs):
+        started = time.monotonic()
+        response = error = None
+        try:
+            response = func(**kwargs)
+            return response
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            entry = {
+                'method': method,
+                'request': kwargs,
+                'response': None if response is None else {
+                    'id': getattr(response, 'id', None),
+                    'output_text': getattr(response, 'output_text', None),
+                    'usage': usage_dict(getattr(response, 'usage', None)),
+                },
+                'error': error,
+                'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            }
+            with self._lock, self.path.open('a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def usage_dict(usage):
+    if usage is None:
+        return None
+    return {name: getattr(usage, name, None) for name in ('input_tokens', 'output_tokens', 'total_tokens')}
+
+
+def load_fixture(path):
+    """Записи фикстуры, сгруппированные по ключу запроса"""
+    entries = defaultdict(list)
+    with Path(path).open(encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[request_key(entry['method'], entry['request'])].append(entry)
+    return entries
+
+
+class ReplayLLMClient:
+    """Клиент, который отвечает записями из фикстуры path"""
+
+    def __init__(self, path, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self._entries = {key: deque(items) for key, items in load_fixture(path).items()}
+        self._lock = threading.Lock()
+        self.misses = 0
+        self.responses = SimpleNamespace(create=self.create_response)
+        self.conversations = SimpleNamespace(create=self.create_conversation)
+
+    def create_response(self, **kwargs):
+        return self.replay('responses.create', kwargs)
+
+    def create_conversation(self, **kwargs):
+        return self.replay('conversations.create', kwargs)
+
+    def replay(self, method, kwargs):
+        key = request_key(method, kwargs)
+        with self._lock:
+            queue = self._entries.get(key)
+            if not queue:
+                self.misses += 1
+                raise FixtureMissError(f'Нет записи для {method}: {kwargs.get("input", "")!s:.100}')
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+
+        time.sleep(entry['latency_ms'] * self.latency_scale / 1000)
+        if entry['error']:
+            raise RuntimeError(entry['error'])
+        response = dict(entry['response'])
+        if response.get('usage'):
+            response['usage'] = SimpleNamespace(**response['usage'])
+        return SimpleNamespace(**response)
@@ -0,0 +1,18 @@
+# lexy/management/commands/analysis_reuse_stats.py
+from django.core.management.base import BaseCommand
+
+from lexy.dedup import get_reuse_stats
+
+
+class Command(BaseCommand):
+    help = "Доля заявок, получивших ответ похожей заявки без обращения к ИИ"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="За сколько последних дней считать")
+
+    def handle(self, *args, **options):
+        stats = get_reuse_stats(options['days'])
+        self.stdout.write(
+            f"Завершено заявок: {stats['total']}, с переиспользованным ответом: {stats['reused']} "
+            f"({stats['hit_rate']:.1%})"
+        )
@@ -0,0 +1,39 @@
+# lexy/management/commands/apply_retention.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from lexy.retention import apply_rule, get_retention_rules
+
+
+class Command(BaseCommand):
+    help = (
+        "Применяет сроки хранения RETENTION_POLICY: обезличивает и удаляет "
+        "просроченные заявки, чаты и сообщения короткими транзакциями. "
+        "Рассчитана на периодический запуск (cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Строк в одной транзакции")
+        parser.add_argument('--max-batches', type=int, default=None, help="Не больше N пачек на правило")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать просроченные строки")
+
+    def handle(self, *args, **options):
+        total = 0
+        started = time.monotonic()
+        for rule in get_retention_rules():
+            if options['dry_run']:
+                self.stdout.write(f"{rule.name}: {rule.queryset.count()}")
+                continue
+
+            rule_started = time.monotonic()
+            processed = apply_rule(rule, options['batch_size'], options['max_batches'])
+            elapsed = time.monotonic() - rule_started
+            total += processed
+            self.stdout.write(
+                f"{rule.name}: {processed} за {elapsed:.1f} с ({processed / max(elapsed, 0.001):.0f} строк/с)"
+            )
+
+        if not options['dry_run']:
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"Всего: {total} за {elapsed:.1f} с ({total / max(elapsed, 0.001):.0f} строк/с)")
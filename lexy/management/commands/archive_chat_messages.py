@@ -0,0 +1,72 @@
+# lexy/management/commands/archive_chat_messages.py
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from lexy.models import ArchivedChatMessage, ChatMessage, LawyerChat
+
+ARCHIVED_CHAT_STATUSES = ('closed', 'archived')
+
+
+def archive_chat_messages(days, batch_size=1000, max_batches=None):
+    """
+    Переносит сообщения чатов, закрытых больше days дней назад, в архивную таблицу.
+    Каждая пачка переносится в отдельной короткой транзакции.
+    Возвращает количество перенесенных сообщений.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    chats = LawyerChat.objects.filter(
+        status__in=ARCHIVED_CHAT_STATUSES,
+        archived_at__lt=cutoff
+    ).values('pk')
+
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            batch = list(
+                ChatMessage.objects.filter(chat__in=chats)
+                .select_related('ai_payload')
+                .order_by('pk')
+                .select_for_update(skip_locked=True, of=('self',))[:batch_size]
+            )
+            if not batch:
+                break
+
+            ArchivedChatMessage.objects.bulk_create(
+                [ArchivedChatMessage.from_message(message) for message in batch],
+                ignore_conflicts=True
+            )
+            ChatMessage.objects.filter(pk__in=[message.pk for message in batch]).delete()
+            LawyerChat.objects.filter(
+                pk__in={message.chat_id for message in batch},
+                messages_archived_at__isnull=True
+            ).update(messages_archived_at=timezone.now())
+
+        moved += len(batch)
+        batches += 1
+    return moved
+
+
+class Command(BaseCommand):
+    help = "Переносит сообщения давно закрытых чатов из рабочей таблицы в архив"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Сколько дней чат должен быть закрыт (по умолчанию CHAT_ARCHIVE_AFTER_DAYS)"
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Сообщений в одной транзакции")
+        parser.add_argument('--max-batches', type=int, default=None, help="Остановиться после N пачек")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        moved = archive_chat_messages(options['days'], options['batch_size'], options['max_batches'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Перенесено сообщений: {moved} за {elapsed:.1f} с ({moved / max(elapsed, 0.001):.0f} в секунду)"
+        )
@@ -0,0 +1,73 @@
+# lexy/management/commands/bench_compression.py
+import time
+import zlib
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lexy.compression import COMPRESSION_LEVEL, CURRENT_DICTIONARY_ID, DICTIONARIES, dumps, train_dictionary
+from lexy.fields import get_compressed_json_fields
+
+
+def measure(values, dictionary):
+    """Суммарный размер после сжатия и среднее время сжатия/распаковки (мкс на значение)"""
+    size = 0
+    compress_time = decompress_time = 0.0
+    for value in values:
+        started = time.perf_counter()
+        raw = dumps(value)
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(
+            COMPRESSION_LEVEL)
+        data = compressor.compress(raw) + compressor.flush()
+        compress_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        decompressor.decompress(data)
+        decompress_time += time.perf_counter() - started
+        size += len(data) + 1
+
+    count = max(len(values), 1)
+    return size, compress_time / count * 1e6, decompress_time / count * 1e6
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеры размера и скорости сжатия сохраненных ответов ИИ; "
+        "с --train строит новый словарь по этим ответам"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=2000, help="Сколько значений взять из каждой таблицы")
+        parser.add_argument('--train', metavar='PATH', help="Построить словарь и сохранить его в файл")
+        parser.add_argument('--dictionary-size', type=int, default=16 * 1024, help="Размер словаря в байтах")
+
+    def handle(self, *args, **options):
+        values = []
+        for model, field in get_compressed_json_fields():
+            queryset = model._base_manager.exclude(**{f'{field.name}__isnull': True})
+            values += list(queryset.order_by('-pk').values_list(field.name, flat=True)[:options['limit']])
+        if not values:
+            raise CommandError("В базе нет сохраненных ответов ИИ для замеров")
+
+        # Словарь обучается на половине выборки и проверяется на другой половине
+        train, test = values[::2], values[1::2] or values
+        rows = [
+            ('без сжатия', sum(len(dumps(value)) for value in test), 0.0, 0.0),
+            ('zlib',) + measure(test, None),
+            (f'zlib + словарь {CURRENT_DICTIONARY_ID}',) + measure(test, DICTIONARIES[CURRENT_DICTIONARY_ID]),
+        ]
+
+        if options['train']:
+            dictionary = train_dictionary(train, options['dictionary_size'])
+            Path(options['train']).write_bytes(dictionary)
+            rows.append(('zlib + новый словарь',) + measure(test, dictionary))
+            self.stdout.write(f"Словарь ({len(dictionary)} байт) сохранен в {options['train']}")
+
+        raw_size = rows[0][1]
+        self.stdout.write(f"Значений: {len(test)}")
+        self.stdout.write(f"{'вариант':<24}{'байт':>12}{'доля':>8}{'сжатие, мкс':>14}{'распаковка, мкс':>18}")
+        for name, size, compress_us, decompress_us in rows:
+            self.stdout.write(
+                f"{name:<24}{size:>12}{size / raw_size:>8.2f}{compress_us:>14.1f}{decompress_us:>18.1f}"
+            )
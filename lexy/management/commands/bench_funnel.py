@@ -0,0 +1,356 @@
+# lexy/management/commands/bench_funnel.py
+import io
+import json
+import logging
+import math
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager, redirect_stdout
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from lexy import yandex_utils
+from lexy.models import Lawyer
+from lexy.llm_fake import FakeLLMClient
+from lexy.llm_recording import RecordingLLMClient, ReplayLLMClient
+
+# Нагрузочный тест всей воронки консультации против заглушки ИИ (lexy/llm_fake.py),
+# записанной фикстуры (--replay, lexy/llm_recording.py) или настроенного бэкенда (--live):
+#   submit_request -> check_analysis_status (до завершения анализа) -> find_lawyers
+#   -> auto_start_chat -> N x send_message -> get_chat_messages
+# Для каждого шага считаются задержки p50/p95/p99 и запросы к БД на один вызов.
+# Результат можно сохранить как базовый (--save-baseline) и сравнивать с ним
+# следующие прогоны: ухудшение больше допуска завершает команду с ошибкой.
+# По умолчанию сравниваются только числа, не зависящие от машины: запросы к БД
+# на вызов и доля ошибок. Задержки и пропускная способность сравниваются с
+# --check-latency, и базовый прогон для этого записывается на той же машине.
+
+STEPS = (
+    'submit_request',
+    'check_analysis_status',
+    'find_lawyers',
+    'auto_start_chat',
+    'send_message',
+    'get_chat_messages',
+)
+
+# Обращения клиентов и юрист, с которым начинается чат
+PROBLEMS = (
+    ("Работодатель задерживает зарплату уже третий месяц и угрожает увольнением", 'labor'),
+    ("Попал в ДТП, виновник скрылся, страховая по ОСАГО отказывает в выплате", 'auto'),
+    ("Бывший муж не платит алименты на ребенка полгода, что делать?", 'family'),
+    ("Уволили без выплаты компенсации за неиспользованный отпуск", 'labor'),
+)
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'funnel_baseline.json'
+
+# Допустимый рост среднего числа запросов к БД на вызов шага и доли ошибок шага.
+# Если в базовом прогоне шаг прошел без ошибок, любая ошибка - ухудшение
+QUERY_TOLERANCE = 0.5
+ERROR_TOLERANCE = 0.2
+
+# С базовым прогоном сравнивается p95: p99 по нескольким десяткам вызовов - это
+# просто самый медленный вызов. Рост p95 меньше LATENCY_SLACK_MS не считается
+# ухудшением: у быстрых шагов он скачет на миллисекунды от прогона к прогону
+LATENCY_SLACK_MS = 25
+
+# Интервал и предельное время опроса статуса анализа
+POLL_INTERVAL = 0.05
+POLL_TIMEOUT = 60
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу; values отсортированы"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(samples, elapsed, funnels):
+    """Отчет по замерам {шаг: [(секунд, запросов к БД, успех)]}"""
+    steps = {}
+    for step in STEPS:
+        calls = samples.get(step, [])
+        latencies = sorted(seconds * 1000 for seconds, queries, ok in calls)
+        steps[step] = {
+            'calls': len(calls),
+            'errors': sum(1 for seconds, queries, ok in calls if not ok),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'queries': round(sum(queries for seconds, queries, ok in calls) / len(calls), 2) if calls else 0,
+        }
+    return {
+        'funnels': funnels,
+        'elapsed_seconds': round(elapsed, 2),
+        'funnels_per_second': round(funnels / elapsed, 2) if elapsed else 0,
+        'requests_per_second': round(sum(step['calls'] for step in steps.values()) / elapsed, 1) if elapsed else 0,
+        'steps': steps,
+    }
+
+
+def error_share(stats):
+    return stats['errors'] / stats['calls'] if stats['calls'] else 0
+
+
+def compare_with_baseline(report, baseline, tolerance, check_latency=False):
+    """Список ухудшений относительно базового отчета; задержки - только с check_latency"""
+    regressions = []
+    if check_latency and report['funnels_per_second'] < baseline['funnels_per_second'] * (1 - tolerance):
+        regressions.append(
+            f"пропускная способность {report['funnels_per_second']} < {baseline['funnels_per_second']} воронок/с"
+        )
+    for step, base in baseline['steps'].items():
+        current = report['steps'].get(step)
+        if current is None:
+            continue
+        if current['errors'] and not base['errors'] or error_share(current) > error_share(base) + ERROR_TOLERANCE:
+            regressions.append(f"{step}: ошибок {current['errors']} из {current['calls']}")
+        if current['queries'] > base['queries'] + QUERY_TOLERANCE:
+            regressions.append(f"{step}: запросов к БД {current['queries']} > {base['queries']}")
+        if not check_latency:
+            continue
+        if current['p95_ms'] > max(base['p95_ms'] * (1 + tolerance), base['p95_ms'] + LATENCY_SLACK_MS):
+            regressions.append(f"{step}: p95 {current['p95_ms']} > {base['p95_ms']} мс")
+    return regressions
+
+
+@contextmanager
+def capture_queries():
+    """Запросы текущего потока ко всем базам"""
+    with ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        yield contexts
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест воронки консультации с заглушкой ИИ: задержки p50/p95/p99 и запросы "
+        "к БД по шагам, сравнение с сохраненным базовым прогоном"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=4, help="Количество параллельных клиентов")
+        parser.add_argument('--funnels', type=int, default=10, help="Воронок на каждого клиента")
+        parser.add_argument('--messages', type=int, default=3, help="Сообщений юристу в каждой воронке")
+        parser.add_argument('--latency-ms', type=int, default=20, help="Медиана задержки ответа заглушки ИИ")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ошибок заглушки ИИ")
+        parser.add_argument('--live', action='store_true', help="Обращаться к бэкенду ИИ из LLM_BACKEND")
+        parser.add_argument('--record', metavar='PATH', help="Записать обращения к ИИ в фикстуру")
+        parser.add_argument('--replay', metavar='PATH', help="Отвечать записями из фикстуры вместо заглушки")
+        parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help="Множитель записанных задержек при --replay (0 - без задержек)")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Файл базового прогона")
+        parser.add_argument('--save-baseline', action='store_true', help="Сохранить прогон как базовый")
+        parser.add_argument('--check-latency', action='store_true',
+                            help="Сравнивать задержки и пропускную способность (базовый прогон с этой же машины)")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Допустимое ухудшение задержек и пропускной способности (доля)")
+        parser.add_argument('--allow-configured-db', action='store_true',
+                            help="Разрешить нагрузку на настроенную базу, если это не SQLite")
+        parser.add_argument('--json', action='store_true', help="Вывести отчет в JSON")
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        params = {name: options[name] for name in ('clients', 'funnels', 'messages', 'latency_ms', 'error_rate')}
+        params['llm'] = self.llm_source(options)
+
+        if connection.vendor != 'sqlite' and not options['allow_configured_db']:
+            raise CommandError(
+                f"Настроенная база ({connection.vendor}) может быть рабочей: "
+                "укажите --allow-configured-db, если это тестовый стенд"
+            )
+
+        client = self.create_llm_client(options)
+        yandex_utils.set_yandex_client(client)
+        try:
+            # print() из view и yandex_utils не смешивается с отчетом
+            with self.database(), redirect_stdout(io.StringIO()):
+                self.create_lawyers()
+                report = self.load(options['clients'], options['funnels'], options['messages'])
+        finally:
+            yandex_utils.set_yandex_client(None)
+        report['params'] = params
+        if getattr(client, 'misses', 0):
+            self.stderr.write(f"Запросов без записи в фикстуре: {client.misses}")
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self.print_report(report)
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+            self.stdout.write(f"Базовый прогон сохранен в {baseline_path}")
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(f"Базового прогона {baseline_path} нет, сравнение пропущено")
+            return
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        if baseline.get('params') != params:
+            raise CommandError(f"Параметры прогона {params} не совпадают с базовыми {baseline.get('params')}")
+        regressions = compare_with_baseline(report, baseline, options['tolerance'], options['check_latency'])
+        if regressions:
+            raise CommandError("Ухудшение относительно базового прогона:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Результаты в пределах базового прогона"))
+
+    def llm_source(self, options):
+        """Откуда берутся ответы ИИ; прогоны с разными источниками не сравниваются"""
+        if options['replay']:
+            return f"replay:{Path(options['replay']).name} x{options['latency_scale']}"
+        return 'live' if options['live'] else 'fake'
+
+    def create_llm_client(self, options):
+        if options['replay']:
+            client = ReplayLLMClient(options['replay'], options['latency_scale'])
+        elif options['live']:
+            client = yandex_utils.create_llm_client({**settings.LLM_BACKEND, 'record_to': ''})
+        else:
+            client = FakeLLMClient(latency_ms=options['latency_ms'], error_rate=options['error_rate'], seed=1)
+        if options['record']:
+            client = RecordingLLMClient(client, options['record'])
+        return client
+
+    @contextmanager
+    def database(self):
+        """SQLite - новая временная база; другие СУБД - настроенная база (только с --allow-configured-db)"""
+        # Все клиенты идут с одного IP, лимит частоты им не нужен; контроль приема
+        # и повторное использование анализа отключены, чтобы каждая заявка шла через ИИ
+        overrides = {
+            'RATE_LIMITS': {},
+            'ADMISSION': {**settings.ADMISSION, 'enabled': False},
+            'ANALYSIS_REUSE': {**settings.ANALYSIS_REUSE, 'enabled': False},
+        }
+        with override_settings(**overrides):
+            if connection.vendor != 'sqlite':
+                yield
+                return
+            with tempfile.TemporaryDirectory() as tmp:
+                db_settings = connections.settings['default']
+                original_name = db_settings['NAME']
+                connection.close()
+                db_settings['NAME'] = str(Path(tmp) / 'bench.sqlite3')
+                try:
+                    call_command('migrate', verbosity=0)
+                    yield
+                finally:
+                    connection.close()
+                    db_settings['NAME'] = original_name
+
+    def create_lawyers(self):
+        """Юристы уже есть в рабочей базе; без них параллельные auto_start_chat гонятся за их созданием"""
+        for code, lawyer in yandex_utils.get_all_lawyer_agents().items():
+            Lawyer.objects.get_or_create(
+                name=lawyer['name'],
+                defaults={'specialization': code, 'assistant_id': lawyer['id']}
+            )
+
+    def load(self, clients, funnels, messages):
+        samples = {step: [] for step in STEPS}
+        lock = threading.Lock()
+
+        def worker(index):
+            client = Client(SERVER_NAME='localhost')
+            try:
+                for i in range(funnels):
+                    text, specialization = PROBLEMS[(index + i) % len(PROBLEMS)]
+                    text = f"{text} (клиент {index}, обращение {i})"
+                    funnel = self.funnel(client, text, specialization, messages, f'{index}-{i}')
+                    for step, seconds, queries, ok in funnel:
+                        with lock:
+                            samples[step].append((seconds, queries, ok))
+                        if not ok and step in ('submit_request', 'auto_start_chat'):
+                            break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(samples, time.monotonic() - started, clients * funnels)
+
+    def call(self, step, func):
+        """Вызов шага: (шаг, секунд, запросов к БД, ответ)"""
+        with capture_queries() as contexts:
+            started = time.monotonic()
+            try:
+                response = func()
+            except Exception:
+                response = None
+            seconds = time.monotonic() - started
+        return step, seconds, sum(len(context) for context in contexts), response
+
+    def funnel(self, client, text, specialization, messages, key):
+        """Одна воронка; по мере выполнения отдает (шаг, секунд, запросов к БД, успех)"""
+        step, seconds, queries, response = self.call('submit_request', lambda: client.post(
+            '/submit-request/', json.dumps({'problem_text': text}), content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=f'bench-{key}'
+        ))
+        ok = response is not None and response.status_code == 200
+        yield step, seconds, queries, ok
+        if not ok:
+            return
+        request_id = response.json()['request_id']
+
+        deadline = time.monotonic() + POLL_TIMEOUT
+        while True:
+            step, seconds, queries, response = self.call(
+                'check_analysis_status', lambda: client.get(f'/api/check-analysis/{request_id}/')
+            )
+            ok = response is not None and response.status_code == 200
+            yield step, seconds, queries, ok
+            if not ok or response.json()['status'] != 'analyzing' or time.monotonic() > deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        step, seconds, queries, response = self.call('find_lawyers', lambda: client.get(f'/find-lawyers/{request_id}/'))
+        yield step, seconds, queries, response is not None and response.status_code == 200
+
+        step, seconds, queries, response = self.call(
+            'auto_start_chat', lambda: client.get(f'/auto-chat/{request_id}/{specialization}/')
+        )
+        location = response['Location'] if response is not None and response.status_code == 302 else ''
+        ok = location.startswith('/chat/')
+        yield step, seconds, queries, ok
+        if not ok:
+            return
+        chat_id = int(location.strip('/').split('/')[-1])
+
+        for i in range(messages):
+            step, seconds, queries, response = self.call('send_message', lambda: client.post(
+                f'/api/send-message/{chat_id}/', json.dumps({'message': f'Вопрос {i}: что мне делать дальше?'}),
+                content_type='application/json', HTTP_IDEMPOTENCY_KEY=f'bench-{key}-{i}'
+            ))
+            yield step, seconds, queries, response is not None and response.json().get('success', False)
+
+        step, seconds, queries, response = self.call(
+            'get_chat_messages', lambda: client.get(f'/api/chat-messages/{chat_id}/')
+        )
+        yield step, seconds, queries, response is not None and response.status_code == 200
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Воронок: {report['funnels']} за {report['elapsed_seconds']} с "
+            f"({report['funnels_per_second']} воронок/с, {report['requests_per_second']} запросов/с)"
+        )
+        self.stdout.write(
+            f"{'шаг':<24}{'вызовов':>9}{'ошибок':>8}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'запр. БД':>10}"
+        )
+        for step, stats in report['steps'].items():
+            self.stdout.write(
+                f"{step:<24}{stats['calls']:>9}{stats['errors']:>8}{stats['p50_ms']:>9}"
+                f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['queries']:>10}"
+            )
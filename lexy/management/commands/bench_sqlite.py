@@ -0,0 +1,128 @@
+# lexy/management/commands/bench_sqlite.py
+import json
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+
+from lexy.db import set_journal_mode
+from lexy.models import EmergencyRequest, Lawyer, LawyerChat
+
+PROBLEM_TEXT = "Работодатель задерживает зарплату уже третий месяц, что делать?"
+
+FAKE_ANALYSIS = {
+    'analysis': {'category': 'labor', 'urgency': 'medium', 'confidence': 0.9, 'summary': 'Задержка зарплаты'},
+}
+
+FAKE_LAWYER_REPLY = {'message': 'Понимаю вашу ситуацию, давайте разберемся.'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест SQLite: одновременные submit_request и send_message "
+        "во временной базе с настройками SQLite по умолчанию и с SQLITE_PRAGMAS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Количество параллельных клиентов")
+        parser.add_argument('--requests', type=int, default=50, help="Запросов на каждого клиента")
+
+    def handle(self, *args, **options):
+        # Ошибки "database is locked" считаются в отчете, их трассировки не нужны
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        results = [
+            self.run('по умолчанию', {}, options),
+            self.run('SQLITE_PRAGMAS', None, options),
+        ]
+
+        self.stdout.write(f"{'режим':<16}{'операций':>10}{'ошибок':>10}{'оп/с':>10}")
+        for name, done, errors, elapsed in results:
+            self.stdout.write(f"{name:<16}{done:>10}{errors:>10}{done / elapsed:>10.1f}")
+
+    def run(self, name, pragmas, options):
+        """
+        Один прогон на новой временной базе; pragmas=None - настройки из settings,
+        иначе заданные прагмы с журналом и транзакциями SQLite по умолчанию
+        """
+        # Все клиенты бенчмарка идут с одного IP, лимит частоты им не нужен;
+        # контроль приема отключен, чтобы каждая заявка записывалась одинаково
+        overrides = {'RATE_LIMITS': {}, 'ADMISSION': {**settings.ADMISSION, 'enabled': False}}
+        if pragmas is not None:
+            overrides['SQLITE_PRAGMAS'] = pragmas
+        with tempfile.TemporaryDirectory() as tmp, override_settings(**overrides):
+            db_settings = connections.settings['default']
+            original_name, original_options = db_settings['NAME'], db_settings['OPTIONS']
+            connection.close()
+            db_settings['NAME'] = str(Path(tmp) / 'bench.sqlite3')
+            if pragmas is not None:
+                db_settings['OPTIONS'] = {**original_options, 'transaction_mode': None}
+            try:
+                call_command('migrate', verbosity=0)
+                if pragmas is not None:
+                    set_journal_mode(connection, 'delete')
+                chat = self.create_chat()
+                with mock.patch('lexy.views.analyze_with_assistant', return_value=FAKE_ANALYSIS), \
+                        mock.patch('lexy.views.chat_with_lawyer', return_value=FAKE_LAWYER_REPLY):
+                    return (name,) + self.load(chat, options['threads'], options['requests'])
+            finally:
+                connection.close()
+                db_settings['NAME'], db_settings['OPTIONS'] = original_name, original_options
+
+    def create_chat(self):
+        lawyer = Lawyer.objects.create(name="Анна Ковалева", specialization='labor')
+        request_obj = EmergencyRequest.objects.create(problem_text=PROBLEM_TEXT, status='completed')
+        return LawyerChat.objects.create(request=request_obj, lawyer=lawyer, lawyer_agent_id='bench')
+
+    def load(self, chat, threads, requests):
+        done = [0] * threads
+        errors = [0] * threads
+
+        def worker(index):
+            client = Client(SERVER_NAME='localhost')
+            for i in range(requests):
+                # Каждый запрос новый, иначе его ответ взяли бы из кэша идемпотентности
+                headers = {'HTTP_IDEMPOTENCY_KEY': f'bench-{index}-{i}-{time.monotonic()}'}
+                try:
+                    if i % 2:
+                        response = client.post(
+                            f'/api/send-message/{chat.id}/',
+                            json.dumps({'message': f'Вопрос {i}'}),
+                            content_type='application/json',
+                            **headers
+                        )
+                        ok = response.json().get('success')
+                    else:
+                        response = client.post(
+                            '/submit-request/',
+                            json.dumps({'problem_text': PROBLEM_TEXT}),
+                            content_type='application/json',
+                            **headers
+                        )
+                        ok = response.status_code == 200
+                except Exception:
+                    ok = False
+                if ok:
+                    done[index] += 1
+                else:
+                    errors[index] += 1
+            connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.monotonic()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        # Даем фоновым потокам анализа дописать результаты
+        time.sleep(0.5)
+        return sum(done), sum(errors), elapsed
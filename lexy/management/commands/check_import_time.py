@@ -0,0 +1,89 @@
+# lexy/management/commands/check_import_time.py
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Холодный запуск: сколько занимает импорт модулей (python -X importtime) в сценариях,
+# которые выполняются при каждом деплое и старте воркера.
+STARTUP_SCENARIOS = {
+    'check': ['manage.py', 'check'],
+    'migrate': ['manage.py', 'migrate', '--plan'],
+    'worker': [
+        '-c',
+        'import lexy_core.wsgi; from django.urls import get_resolver; get_resolver().url_patterns',
+    ],
+}
+
+# Тяжелые библиотеки, которые должны загружаться только при первом обращении к ИИ
+LAZY_MODULES = ('openai',)
+
+
+def parse_importtime(output):
+    """Строки "import time: self | cumulative | module" -> {модуль: (мкс, уровень вложенности)}"""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(cumulative), depth)
+    return modules
+
+
+def measure_startup(scenario):
+    """Импортированные модули и суммарное время импорта сценария в миллисекундах"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + STARTUP_SCENARIOS[scenario],
+        cwd=settings.BASE_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise CommandError(f"Сценарий {scenario} завершился с ошибкой:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    total = sum(cumulative for cumulative, depth in modules.values() if depth == 0)
+    return modules, total / 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет, что openai не загружается при check, migrate и старте воркера, "
+        "и время импорта, если для сценария задан бюджет"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Сценарии: {', '.join(STARTUP_SCENARIOS)} (по умолчанию все)")
+        parser.add_argument('--top', type=int, default=10, help="Показать N самых долгих импортов")
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(STARTUP_SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+        failures = []
+        for scenario in options['scenarios'] or STARTUP_SCENARIOS:
+            modules, total = measure_startup(scenario)
+            # Бюджет задается под конкретную машину CI, 0 - только показать время
+            budget = settings.IMPORT_TIME_BUDGETS_MS.get(scenario, 0)
+            self.stdout.write(
+                f"{scenario}: {total:.0f} мс " + (f"(бюджет {budget} мс)" if budget else "(бюджет не задан)")
+            )
+
+            slowest = sorted(
+                ((cumulative, name) for name, (cumulative, depth) in modules.items() if depth == 0),
+                reverse=True
+            )
+            for cumulative, name in slowest[:options['top']]:
+                self.stdout.write(f"  {cumulative / 1000:8.1f} мс  {name}")
+
+            if budget and total > budget:
+                failures.append(f"{scenario}: {total:.0f} мс > {budget} мс")
+            eager = [name for name in LAZY_MODULES if name in modules]
+            if eager:
+                failures.append(f"{scenario}: при запуске импортируются {', '.join(eager)}")
+
+        if failures:
+            raise CommandError("\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Запуск в пределах ограничений"))
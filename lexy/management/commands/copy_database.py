@@ -0,0 +1,147 @@
+# lexy/management/commands/copy_database.py
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+
+# Эти таблицы заполняет migrate на новой базе; перед копированием они очищаются,
+# чтобы идентификаторы совпали с исходной базой
+REGENERATED_MODELS = ('contenttypes.ContentType', 'auth.Permission')
+
+
+def get_models_in_dependency_order():
+    """Все таблицы проекта, отсортированные так, чтобы родители шли раньше зависимых"""
+    models = [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy
+    ]
+    ordered = []
+    visited = set()
+
+    def visit(model):
+        if model in visited:
+            return
+        visited.add(model)
+        for field in model._meta.concrete_fields:
+            related = field.related_model
+            if field.is_relation and related is not None and related is not model:
+                visit(related._meta.concrete_model)
+        ordered.append(model)
+
+    for model in models:
+        visit(model)
+    return [model for model in ordered if model in models]
+
+
+@contextmanager
+def preserve_timestamps(model):
+    """bulk_create вызывает pre_save, а auto_now/auto_now_add перезаписали бы исходные даты"""
+    changed = []
+    for field in model._meta.concrete_fields:
+        for attr in ('auto_now', 'auto_now_add'):
+            if getattr(field, attr, False):
+                setattr(field, attr, False)
+                changed.append((field, attr))
+    try:
+        yield
+    finally:
+        for field, attr in changed:
+            setattr(field, attr, True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит все данные из одной базы в другую пачками "
+        "(например, из SQLite в PostgreSQL) и сверяет количество строк"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='legacy', help="Алиас исходной базы (по умолчанию legacy)")
+        parser.add_argument('--target', default='default', help="Алиас целевой базы (по умолчанию default)")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Размер пачки строк")
+        parser.add_argument('--verify-only', action='store_true', help="Только сверить количество строк")
+
+    def handle(self, *args, **options):
+        source, target = options['source'], options['target']
+        for alias in (source, target):
+            if alias not in connections.databases:
+                raise CommandError(f"База '{alias}' не настроена в DATABASES")
+        if source == target:
+            raise CommandError("Исходная и целевая базы совпадают")
+
+        models = [
+            model for model in get_models_in_dependency_order()
+            if router.allow_migrate_model(target, model)
+        ]
+
+        if not options['verify_only']:
+            self.copy(models, source, target, options['batch_size'])
+
+        if not self.verify(models, source, target):
+            raise CommandError("Количество строк в базах не совпадает")
+        self.stdout.write(self.style.SUCCESS("Данные совпадают"))
+
+    def copy(self, models, source, target, batch_size):
+        regenerated = {apps.get_model(label) for label in REGENERATED_MODELS}
+        not_empty = [
+            model._meta.label for model in models
+            if model not in regenerated and model._default_manager.using(target).exists()
+        ]
+        if not_empty:
+            raise CommandError(f"Целевая база уже содержит данные: {', '.join(not_empty)}")
+
+        started = time.monotonic()
+        total = 0
+        with transaction.atomic(using=target):
+            for model in reversed(models):
+                if model in regenerated:
+                    model._default_manager.using(target).all().delete()
+
+            for model in models:
+                copied = self.copy_model(model, source, target, batch_size)
+                total += copied
+                self.stdout.write(f"{model._meta.label}: {copied}")
+
+            self.reset_sequences(models, target)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Скопировано строк: {total} за {elapsed:.1f} с ({total / max(elapsed, 0.001):.0f} строк/с)")
+
+    def copy_model(self, model, source, target, batch_size):
+        rows = model._default_manager.using(source).order_by('pk').iterator(chunk_size=batch_size)
+        manager = model._default_manager.using(target)
+        copied = 0
+        batch = []
+        with preserve_timestamps(model):
+            for obj in rows:
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    manager.bulk_create(batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                manager.bulk_create(batch)
+                copied += len(batch)
+        return copied
+
+    def reset_sequences(self, models, target):
+        """После вставки с явными id счетчики автоинкремента нужно сдвинуть (PostgreSQL)"""
+        connection = connections[target]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def verify(self, models, source, target):
+        ok = True
+        for model in models:
+            source_count = model._default_manager.using(source).count()
+            target_count = model._default_manager.using(target).count()
+            if source_count != target_count:
+                ok = False
+                self.stderr.write(f"{model._meta.label}: {source_count} != {target_count}")
+        return ok
@@ -0,0 +1,62 @@
+# lexy/management/commands/recompress_ai_responses.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from lexy.compression import CURRENT_DICTIONARY_ID, decompress_json, get_dictionary_id
+from lexy.fields import get_compressed_json_fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Пережимает сохраненные ответы ИИ текущим словарем: несжатые строки "
+        "и строки, сжатые старыми словарями"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Строк в одной транзакции")
+
+    def handle(self, *args, **options):
+        for model, field in get_compressed_json_fields():
+            started = time.monotonic()
+            scanned, rewritten = self.recompress(model, field, options['batch_size'])
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{model._meta.label}.{field.name}: просмотрено {scanned}, пережато {rewritten} "
+                f"({scanned / max(elapsed, 0.001):.0f} строк/с)"
+            )
+
+    def recompress(self, model, field, batch_size):
+        """Проход по таблице пачками по первичному ключу; сырые байты читаются без распаковки"""
+        db = router.db_for_write(model)
+        connection = connections[db]
+        table = connection.ops.quote_name(model._meta.db_table)
+        pk_column = connection.ops.quote_name(model._meta.pk.column)
+        column = connection.ops.quote_name(field.column)
+        sql = (
+            f"SELECT {pk_column}, {column} FROM {table} "
+            f"WHERE {pk_column} > %s AND {column} IS NOT NULL ORDER BY {pk_column} LIMIT %s"
+        )
+
+        scanned = rewritten = 0
+        last_pk = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [last_pk, batch_size])
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            scanned += len(rows)
+
+            stale = [
+                model(pk=pk, **{field.attname: decompress_json(raw)})
+                for pk, raw in rows
+                if get_dictionary_id(raw) != CURRENT_DICTIONARY_ID
+            ]
+            if stale:
+                with transaction.atomic(using=db):
+                    model._base_manager.using(db).bulk_update(stale, [field.attname])
+                rewritten += len(stale)
+        return scanned, rewritten
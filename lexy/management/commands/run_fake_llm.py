@@ -0,0 +1,42 @@
+# lexy/management/commands/run_fake_llm.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lexy.llm_fake import FakeLLM, FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Локальная заглушка Yandex AI (responses, conversations) для нагрузочных прогонов без сети; "
+        "приложение подключается к ней с LLM_BASE_URL=http://host:port/v1"
+    )
+
+    def add_arguments(self, parser):
+        fake = settings.LLM_BACKEND['fake']
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=int, default=fake['latency_ms'], help="Медиана задержки ответа")
+        parser.add_argument('--latency-sigma', type=float, default=fake['latency_sigma'],
+                            help="Разброс задержки (sigma логнормального распределения)")
+        parser.add_argument('--error-rate', type=float, default=fake['error_rate'], help="Доля ответов с ошибкой 500")
+        parser.add_argument('--seed', type=int, default=fake['seed'])
+        parser.add_argument('--verbose-requests', action='store_true', help="Печатать каждый запрос")
+
+    def handle(self, *args, **options):
+        llm = FakeLLM(
+            latency_ms=options['latency_ms'],
+            latency_sigma=options['latency_sigma'],
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+        server = FakeLLMServer((options['host'], options['port']), llm, verbose=options['verbose_requests'])
+        self.stdout.write(
+            f"Заглушка ИИ на http://{options['host']}:{server.server_port}/v1 "
+            f"(задержка ~{llm.latency_ms} мс, ошибок {llm.error_rate:.0%})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,92 @@
+# lexy/management/commands/trace_report.py
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def load_traces(path):
+    """Спаны из файла OTLP/JSON, сгруппированные по traceId"""
+    traces = defaultdict(list)
+    with Path(path).open(encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    for span in scope['spans']:
+                        traces[span['traceId']].append(span)
+    return traces
+
+
+def duration_ms(span):
+    return (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e6
+
+
+def time_by_category(spans):
+    """Время в спанах БД, кэша, ИИ по первому слову имени ('db', 'cache', 'llm')"""
+    totals = defaultdict(float)
+    for span in spans:
+        category = span['name'].split(' ', 1)[0]
+        if category in ('db', 'cache', 'llm'):
+            totals[category] += duration_ms(span)
+    return dict(totals)
+
+
+class Command(BaseCommand):
+    help = "Самые долгие трассы из файла TRACING['path']: дерево спанов и время в БД, кэше и ИИ"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.TRACING['path'])
+        parser.add_argument('--trace', help="Показать одну трассу по id")
+        parser.add_argument('--slowest', type=int, default=5, help="Сколько самых долгих трасс показать")
+        parser.add_argument('--min-ms', type=float, default=0, help="Не показывать спаны короче")
+
+    def handle(self, *args, **options):
+        if not Path(options['path']).exists():
+            raise CommandError(f"Файла трасс {options['path']} нет; включите TRACING_ENABLED=True")
+        traces = load_traces(options['path'])
+
+        if options['trace']:
+            if options['trace'] not in traces:
+                raise CommandError(f"Трасса {options['trace']} не найдена")
+            selected = [options['trace']]
+        else:
+            selected = sorted(traces, key=lambda trace_id: self.trace_duration(traces[trace_id]), reverse=True)
+            selected = selected[:options['slowest']]
+
+        for trace_id in selected:
+            self.print_trace(trace_id, traces[trace_id], options['min_ms'])
+
+    def trace_duration(self, spans):
+        start = min(int(span['startTimeUnixNano']) for span in spans)
+        end = max(int(span['endTimeUnixNano']) for span in spans)
+        return (end - start) / 1e6
+
+    def print_trace(self, trace_id, spans, min_ms):
+        totals = time_by_category(spans)
+        self.stdout.write(
+            f"\nТрасса {trace_id}: {self.trace_duration(spans):.1f} мс; "
+            + ', '.join(f"{category} {totals.get(category, 0):.1f} мс" for category in ('db', 'cache', 'llm'))
+        )
+
+        ids = {span['spanId'] for span in spans}
+        children = defaultdict(list)
+        for span in spans:
+            # Родитель из другого сервиса (входящий traceparent) - корень дерева
+            parent = span.get('parentSpanId') if span.get('parentSpanId') in ids else None
+            children[parent].append(span)
+
+        trace_start = min(int(span['startTimeUnixNano']) for span in spans)
+
+        def walk(parent, depth):
+            for span in sorted(children[parent], key=lambda item: int(item['startTimeUnixNano'])):
+                if duration_ms(span) >= min_ms or depth == 0:
+                    offset = (int(span['startTimeUnixNano']) - trace_start) / 1e6
+                    error = ' ОШИБКА' if span['status']['code'] == 2 else ''
+                    self.stdout.write(f"{offset:9.1f} {duration_ms(span):9.1f} мс  {'  ' * depth}{span['name']}{error}")
+                walk(span['spanId'], depth + 1)
+
+        walk(None, 0)
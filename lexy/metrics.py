@@ -0,0 +1,200 @@
+# lexy/metrics.py
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from .tracing import start_span
+
+# Метрики обращений к ИИ в формате Prometheus (GET /metrics).
+# Счетчики хранятся в отдельном кэше METRICS['cache'] без срока хранения и без
+# вытеснения другими ключами. Только если этот кэш общий (Redis), /metrics
+# любого процесса отдает сумму по всем воркерам; локальный кэш процесса годится
+# лишь для разработки, и manage.py check --deploy считает его ошибкой.
+# Метки: call - тип вызова (CALL_TYPES), agent - id агента, модель 'yandexgpt'
+# или 'other' для неизвестных id, чтобы число рядов оставалось ограниченным.
+# Гистограмма задержек хранит по счетчику на корзину, накопленные значения
+# считаются при выдаче.
+
+CACHE_PREFIX = 'lexy_metrics'
+
+CALL_TYPES = ('analyze', 'specialization', 'chat', 'chat_fallback', 'conversation')
+
+SPECIALIZATION_MODEL = 'yandexgpt'
+
+OUTCOMES = ('success', 'error')
+
+TOKEN_KINDS = ('input', 'output')
+
+# Почему вместо ответа ИИ использован запасной путь: нет conversation, ошибка вызова,
+# пустой ответ или перегрузка очереди (быстрый локальный разбор заявки)
+FALLBACK_REASONS = ('no_conversation', 'error', 'empty_response', 'overload')
+
+# Кэши, которые у каждого процесса свои
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def get_metrics_cache():
+    return caches[settings.METRICS['cache']]
+
+
+def check_metrics_settings(app_configs, **kwargs):
+    """Проверка для manage.py check --deploy: счетчики общие, /metrics закрыт токеном"""
+    options = settings.METRICS
+    if not options['enabled']:
+        return []
+    errors = []
+    if settings.CACHES[options['cache']]['BACKEND'] in PROCESS_LOCAL_BACKENDS:
+        errors.append(checks.Error(
+            f"Кэш метрик '{options['cache']}' свой у каждого процесса: /metrics не отдаст общие счетчики",
+            hint="Задайте REDIS_URL или отключите метрики (METRICS_ENABLED=False)",
+            id='lexy.E001',
+        ))
+    if not options['token']:
+        errors.append(checks.Error(
+            "Не задан METRICS_TOKEN: без DEBUG /metrics не отвечает",
+            hint="Задайте METRICS_TOKEN и передавайте его в Authorization: Bearer",
+            id='lexy.E002',
+        ))
+    return errors
+
+
+def known_agents():
+    from .yandex_utils import AGENTS
+
+    agents = [AGENTS['general']['id']] + [lawyer['id'] for lawyer in AGENTS['lawyers'].values()]
+    return agents + [SPECIALIZATION_MODEL, 'other']
+
+
+def agent_label(agent_id):
+    return agent_id if agent_id in known_agents() else 'other'
+
+
+def metric_key(name, **labels):
+    return f"{CACHE_PREFIX}:{name}:" + ','.join(f'{key}={value}' for key, value in sorted(labels.items()))
+
+
+def incr(name, amount=1, **labels):
+    key = metric_key(name, **labels)
+    cache = get_metrics_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # Ключ вытеснен из кэша между add и incr
+        cache.set(key, amount, None)
+
+
+def record_llm_call(call, agent_id, seconds, outcome):
+    """Учесть вызов ИИ: исход и задержку в гистограмме"""
+    agent = agent_label(agent_id)
+    incr('calls', call=call, agent=agent, outcome=outcome)
+    buckets = settings.METRICS['latency_buckets']
+    bucket = next((str(bound) for bound in buckets if seconds <= bound), '+Inf')
+    incr('latency_bucket', call=call, agent=agent, le=bucket)
+    incr('latency_sum_ms', round(seconds * 1000), call=call, agent=agent)
+
+
+@contextmanager
+def track_llm_call(call, agent_id):
+    """Замер и спан вызова ИИ внутри блока; исключение считается ошибкой и пробрасывается"""
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        with start_span(f'llm {call}', kind='client', attributes={'llm.call': call, 'llm.agent': agent_label(agent_id)}):
+            yield
+        outcome = 'success'
+    finally:
+        record_llm_call(call, agent_id, time.monotonic() - started, outcome)
+
+
+def record_token_usage(call, agent_id, response):
+    """Токены из response.usage, если API их вернул"""
+    usage = getattr(response, 'usage', None)
+    for kind in TOKEN_KINDS:
+        tokens = getattr(usage, f'{kind}_tokens', None)
+        if isinstance(tokens, int) and tokens > 0:
+            incr('tokens', tokens, call=call, agent=agent_label(agent_id), kind=kind)
+
+
+def record_fallback(call, agent_id, reason):
+    incr('fallbacks', call=call, agent=agent_label(agent_id), reason=reason)
+
+
+def record_parse_failure(call, agent_id):
+    incr('parse_failures', call=call, agent=agent_label(agent_id))
+
+
+# Ключ в кэше, имя метрики, описание, дополнительная метка и ее значения
+COUNTERS = (
+    ('calls', 'lexy_llm_calls_total', "Вызовы ИИ по исходу", 'outcome', OUTCOMES),
+    ('tokens', 'lexy_llm_tokens_total', "Токены, израсходованные вызовами ИИ", 'kind', TOKEN_KINDS),
+    ('fallbacks', 'lexy_llm_fallbacks_total', "Переходы на запасной способ вызова ИИ", 'reason', FALLBACK_REASONS),
+    ('parse_failures', 'lexy_llm_parse_failures_total', "Ответы ИИ, которые не удалось разобрать как JSON", None, (None,)),
+)
+
+
+def format_labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def collect_gauges():
+    """Текущее состояние очереди анализа: (имя, описание, значение)"""
+    from .admission import get_backlog, get_llm_latency
+    from .scheduler import get_scheduler
+
+    return (
+        ('lexy_analysis_backlog', "Заявки, ожидающие анализа", get_metrics_cache().get_or_set(
+            f'{CACHE_PREFIX}:backlog', get_backlog, settings.METRICS['backlog_cache_seconds']
+        )),
+        ('lexy_llm_queue_depth', "Задачи в очереди обращений к ИИ этого процесса", get_scheduler().queue_depth()),
+        ('lexy_llm_latency_ewma_seconds', "Скользящее среднее время анализа заявки", get_llm_latency()),
+    )
+
+
+def render_metrics():
+    """Текст метрик в формате Prometheus exposition 0.0.4"""
+    buckets = [str(bound) for bound in settings.METRICS['latency_buckets']] + ['+Inf']
+    series = [(call, agent) for call in CALL_TYPES for agent in known_agents()]
+
+    keys = []
+    for call, agent in series:
+        for name, metric, help_text, label, values in COUNTERS:
+            keys += [metric_key(name, call=call, agent=agent, **({label: value} if label else {})) for value in values]
+        keys += [metric_key('latency_bucket', call=call, agent=agent, le=bucket) for bucket in buckets]
+        keys.append(metric_key('latency_sum_ms', call=call, agent=agent))
+    values = get_metrics_cache().get_many(keys)
+
+    lines = []
+    for name, metric, help_text, label, label_values in COUNTERS:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        for call, agent in series:
+            for value in label_values:
+                extra = {label: value} if label else {}
+                count = values.get(metric_key(name, call=call, agent=agent, **extra))
+                if count is not None:
+                    lines.append(f'{metric}{format_labels(call=call, agent=agent, **extra)} {count}')
+
+    metric = 'lexy_llm_call_duration_seconds'
+    lines += [f'# HELP {metric} Время вызова ИИ', f'# TYPE {metric} histogram']
+    for call, agent in series:
+        counts = [values.get(metric_key('latency_bucket', call=call, agent=agent, le=bucket), 0) for bucket in buckets]
+        if not any(counts):
+            continue
+        total = 0
+        for bucket, count in zip(buckets, counts):
+            total += count
+            lines.append(f'{metric}_bucket{format_labels(call=call, agent=agent, le=bucket)} {total}')
+        latency_sum = values.get(metric_key('latency_sum_ms', call=call, agent=agent), 0) / 1000
+        lines.append(f'{metric}_sum{format_labels(call=call, agent=agent)} {latency_sum}')
+        lines.append(f'{metric}_count{format_labels(call=call, agent=agent)} {total}')
+
+    for metric, help_text, value in collect_gauges():
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge', f'{metric} {value}']
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lexy", "0004_lawyerchat_lawyer_agent_id_lawyerchat_lawyer_name_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lawyerchat",
+            name="messages_archived_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Сообщения перенесены в архив"
+            ),
+        ),
+        migrations.CreateModel(
+            name="ArchivedChatMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "sender",
+                    models.CharField(
+                        choices=[
+                            ("client", "Клиент"),
+                            ("lawyer", "Юрист"),
+                            ("system", "Система"),
+                            ("assistant", "AI-ассистент"),
+                        ],
+                        max_length=20,
+                        verbose_name="Отправитель",
+                    ),
+                ),
+                ("message", models.TextField(verbose_name="Сообщение")),
+                (
+                    "message_type",
+                    models.CharField(
+                        choices=[
+                            ("text", "Текст"),
+                            ("document", "Документ"),
+                            ("image", "Изображение"),
+                            ("audio", "Аудио"),
+                            ("video", "Видео"),
+                        ],
+                        default="text",
+                        max_length=20,
+                        verbose_name="Тип сообщения",
+                    ),
+                ),
+                (
+                    "is_read",
+                    models.BooleanField(default=False, verbose_name="Прочитано"),
+                ),
+                (
+                    "is_edited",
+                    models.BooleanField(default=False, verbose_name="Редактировано"),
+                ),
+                (
+                    "ai_response_data",
+                    models.JSONField(
+                        blank=True, null=True, verbose_name="Данные ответа ИИ"
+                    ),
+                ),
+                (
+                    "ip_address",
+                    models.GenericIPAddressField(
+                        blank=True, null=True, verbose_name="IP адрес отправителя"
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                ("edited_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "moved_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Перенесено в архив"
+                    ),
+                ),
+                (
+                    "chat",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_messages",
+                        to="lexy.lawyerchat",
+                        verbose_name="Чат",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Архивное сообщение чата",
+                "verbose_name_plural": "Архивные сообщения чатов",
+                "ordering": ["timestamp"],
+                "indexes": [
+                    models.Index(
+                        fields=["chat", "timestamp"], name="lexy_archmsg_chat_ts_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_payloads_to_side_table(apps, schema_editor):
+    ChatMessage = apps.get_model("lexy", "ChatMessage")
+    ChatMessageAIPayload = apps.get_model("lexy", "ChatMessageAIPayload")
+
+    rows = ChatMessage.objects.filter(ai_response_data__isnull=False).values_list(
+        "pk", "ai_response_data"
+    )
+    batch = []
+    for pk, data in rows.iterator(chunk_size=2000):
+        batch.append(ChatMessageAIPayload(message_id=pk, data=data))
+        if len(batch) >= 2000:
+            ChatMessageAIPayload.objects.bulk_create(batch)
+            batch = []
+    ChatMessageAIPayload.objects.bulk_create(batch)
+
+
+def copy_payloads_back(apps, schema_editor):
+    ChatMessage = apps.get_model("lexy", "ChatMessage")
+    ChatMessageAIPayload = apps.get_model("lexy", "ChatMessageAIPayload")
+
+    for payload in ChatMessageAIPayload.objects.iterator(chunk_size=2000):
+        ChatMessage.objects.filter(pk=payload.message_id).update(
+            ai_response_data=payload.data
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lexy", "0005_archivedchatmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatMessageAIPayload",
+            fields=[
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ai_payload",
+                        serialize=False,
+                        to="lexy.chatmessage",
+                        verbose_name="Сообщение",
+                    ),
+                ),
+                ("data", models.JSONField(verbose_name="Данные ответа ИИ")),
+            ],
+            options={
+                "verbose_name": "Данные ответа ИИ",
+                "verbose_name_plural": "Данные ответов ИИ",
+            },
+        ),
+        migrations.RunPython(copy_payloads_to_side_table, copy_payloads_back),
+        migrations.RemoveField(
+            model_name="chatmessage",
+            name="ai_response_data",
+        ),
+    ]
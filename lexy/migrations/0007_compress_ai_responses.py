@@ -0,0 +1,108 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:40
+
+import lexy.fields
+from django.db import migrations, models
+
+# (модель, поле, параметры поля) - JSON-поля, которые переводятся на сжатое хранение
+COMPRESSED_FIELDS = [
+    (
+        "emergencyrequest",
+        "ai_response",
+        {"blank": True, "verbose_name": "Ответ ИИ-ассистента"},
+    ),
+    ("chatmessageaipayload", "data", {"verbose_name": "Данные ответа ИИ"}),
+    (
+        "archivedchatmessage",
+        "ai_response_data",
+        {"blank": True, "verbose_name": "Данные ответа ИИ"},
+    ),
+]
+
+BATCH_SIZE = 1000
+
+
+def copy_field(apps, model_name, source, target):
+    Model = apps.get_model("lexy", model_name)
+    batch = []
+    for obj in (
+        Model.objects.exclude(**{f"{source}__isnull": True})
+        .only("pk", source)
+        .iterator(chunk_size=BATCH_SIZE)
+    ):
+        setattr(obj, target, getattr(obj, source))
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            Model.objects.bulk_update(batch, [target])
+            batch = []
+    Model.objects.bulk_update(batch, [target])
+
+
+def compress(apps, schema_editor):
+    for model_name, field_name, _ in COMPRESSED_FIELDS:
+        copy_field(apps, model_name, field_name, f"{field_name}_compressed")
+
+
+def decompress(apps, schema_editor):
+    for model_name, field_name, _ in COMPRESSED_FIELDS:
+        copy_field(apps, model_name, f"{field_name}_compressed", field_name)
+
+
+def build_operations():
+    add, remove, rename = [], [], []
+    for model_name, field_name, options in COMPRESSED_FIELDS:
+        add.append(
+            migrations.AddField(
+                model_name=model_name,
+                name=f"{field_name}_compressed",
+                field=lexy.fields.CompressedJSONField(null=True, **options),
+            )
+        )
+        remove.append(migrations.RemoveField(model_name=model_name, name=field_name))
+        rename.append(
+            migrations.RenameField(
+                model_name=model_name,
+                old_name=f"{field_name}_compressed",
+                new_name=field_name,
+            )
+        )
+    return add + [migrations.RunPython(compress, decompress)] + remove + rename
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lexy", "0006_chatmessageaipayload"),
+    ]
+
+    operations = (
+        [
+            # Временно допускаем NULL, чтобы старую колонку можно было удалить и вернуть при откате
+            migrations.AlterField(
+                model_name="chatmessageaipayload",
+                name="data",
+                field=models.JSONField(null=True, verbose_name="Данные ответа ИИ"),
+            ),
+        ]
+        + build_operations()
+        + [
+            migrations.AlterField(
+                model_name="emergencyrequest",
+                name="ai_response",
+                field=lexy.fields.CompressedJSONField(
+                    blank=True, null=True, verbose_name="Ответ ИИ-ассистента"
+                ),
+            ),
+            migrations.AlterField(
+                model_name="chatmessageaipayload",
+                name="data",
+                field=lexy.fields.CompressedJSONField(verbose_name="Данные ответа ИИ"),
+            ),
+            migrations.AlterField(
+                model_name="archivedchatmessage",
+                name="ai_response_data",
+                field=lexy.fields.CompressedJSONField(
+                    blank=True, null=True, verbose_name="Данные ответа ИИ"
+                ),
+            ),
+        ]
+    )
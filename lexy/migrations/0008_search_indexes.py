@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from lexy.search import create_search_indexes, drop_search_indexes
+
+
+def create_indexes(apps, schema_editor):
+    create_search_indexes(schema_editor)
+
+
+def drop_indexes(apps, schema_editor):
+    drop_search_indexes(schema_editor)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("lexy", "0007_compress_ai_responses"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
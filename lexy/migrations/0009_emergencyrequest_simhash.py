@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lexy", "0008_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emergencyrequest",
+            name="reused_from",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="reused_by",
+                to="lexy.emergencyrequest",
+                verbose_name="Ответ взят из заявки",
+            ),
+        ),
+        migrations.AddField(
+            model_name="emergencyrequest",
+            name="simhash",
+            field=models.BigIntegerField(
+                blank=True, editable=False, null=True, verbose_name="SimHash текста"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lexy", "0009_emergencyrequest_simhash"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="emergencyrequest",
+            index=models.Index(
+                fields=["status", "created_at"], name="lexy_req_status_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:10
+
+from django.conf import settings
+from django.db import migrations
+
+from lexy.db import set_journal_mode
+
+
+def apply_journal_mode(apps, schema_editor):
+    set_journal_mode(schema_editor.connection, settings.SQLITE_JOURNAL_MODE)
+
+
+def restore_journal_mode(apps, schema_editor):
+    set_journal_mode(schema_editor.connection, "delete")
+
+
+class Migration(migrations.Migration):
+
+    # PRAGMA journal_mode = wal не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("lexy", "0010_emergencyrequest_status_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(apply_journal_mode, restore_journal_mode),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:40
+
+from django.db import migrations
+
+from lexy.search import SEARCH_INDEXES, SearchIndex
+
+PREVIOUS_REQUEST_INDEX = SearchIndex(
+    "lexy_request_fts", "lexy_emergencyrequest", ("problem_text", "summary")
+)
+
+
+def rebuild_index(schema_editor, old, new):
+    vendor = schema_editor.connection.vendor
+    for sql in old.drop_sql(vendor) + new.create_sql(vendor) + new.rebuild_sql(vendor):
+        schema_editor.execute(sql)
+
+
+def add_error_message(apps, schema_editor):
+    rebuild_index(schema_editor, PREVIOUS_REQUEST_INDEX, SEARCH_INDEXES["lexy.EmergencyRequest"])
+
+
+def remove_error_message(apps, schema_editor):
+    rebuild_index(schema_editor, SEARCH_INDEXES["lexy.EmergencyRequest"], PREVIOUS_REQUEST_INDEX)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("lexy", "0011_sqlite_journal_mode"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_error_message, remove_error_message),
+    ]
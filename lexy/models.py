@@ -4,6 +4,8 @@ from django.core.validators import MinLengthValidator
 import json
 from django.utils import timezone
 
+from .fields import CompressedJSONField
+
 
 class EmergencyRequest(models.Model):
     """Модель для хранения юридических запросов"""
@@ -27,8 +29,8 @@ class EmergencyRequest(models.Model):
         verbose_name="Описание проблемы"
     )
 
-    # Ответ от ИИ
-    ai_response = models.JSONField(
+    # Ответ от ИИ (хранится сжатым)
+    ai_response = CompressedJSONField(
         null=True,
         blank=True,
         verbose_name="Ответ ИИ-ассистента"
@@ -106,10 +108,31 @@ class EmergencyRequest(models.Model):
         verbose_name="Дата анализа"
     )
 
+    # Поиск почти одинаковых заявок (lexy/dedup.py)
+    simhash = models.BigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="SimHash текста"
+    )
+
+    reused_from = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reused_by',
+        verbose_name="Ответ взят из заявки"
+    )
+
     class Meta:
         verbose_name = "Юридический запрос"
         verbose_name_plural = "Юридические запросы"
         ordering = ['-created_at']
+        indexes = [
+            # Очередь анализа (lexy/admission.py)
+            models.Index(fields=['status', 'created_at'], name='lexy_req_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Запрос #{self.id}: {self.problem_text[:50]}..."
@@ -444,6 +467,11 @@ class LawyerChat(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     archived_at = models.DateTimeField(null=True, blank=True)
+    messages_archived_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Сообщения перенесены в архив"
+    )
 
     class Meta:
         verbose_name = "Чат с юристом"
@@ -453,6 +481,29 @@ class LawyerChat(models.Model):
     def __str__(self):
         return f"Чат #{self.id}: {self.lawyer.name} - {self.request.problem_text[:50]}..."
 
+    def get_messages(self, fields=('id', 'sender', 'message', 'timestamp')):
+        """
+        Сообщения чата в хронологическом порядке (словари с полями fields).
+        Для чатов, перенесенных в архив, добавляются сообщения из архивной таблицы.
+        """
+        messages = self.messages.order_by().values(*fields)
+        if self.messages_archived_at:
+            archived = self.archived_messages.order_by().values(*fields)
+            messages = messages.union(archived, all=True)
+        return messages.order_by('timestamp', 'id')
+
+    @property
+    def formatted_duration(self):
+        """Длительность чата от создания до последнего сообщения"""
+        if not self.last_message_at or not self.created_at:
+            return '-'
+        seconds = (self.last_message_at - self.created_at).total_seconds()
+        if seconds < 60:
+            return f"{max(int(seconds), 0)} сек"
+        elif seconds < 3600:
+            return f"{int(seconds / 60)} мин"
+        return f"{int(seconds / 3600)} ч"
+
     def save(self, *args, **kwargs):
         # Автоматически генерируем название чата при создании
         if not self.title:
@@ -522,12 +573,8 @@ class ChatMessage(models.Model):
         verbose_name="Редактировано"
     )
 
-    # Для ответов от ИИ-юриста
-    ai_response_data = models.JSONField(
-        null=True,
-        blank=True,
-        verbose_name="Данные ответа ИИ"
-    )
+    # Данные ответа ИИ-юриста хранятся отдельно, в ChatMessageAIPayload
+    # (см. свойство ai_response_data)
 
     # Метаданные
     ip_address = models.GenericIPAddressField(
@@ -550,14 +597,46 @@ class ChatMessage(models.Model):
 
     def save(self, *args, **kwargs):
         # При сохранении нового сообщения обновляем счетчик в чате
-        is_new = self.pk is None
+        is_new = self._state.adding
         super().save(*args, **kwargs)
 
+        if hasattr(self, '_pending_ai_response_data'):
+            self._save_ai_response_data(self.__dict__.pop('_pending_ai_response_data'), is_new)
+
         if is_new:
             self.chat.message_count += 1
             self.chat.last_message_at = self.timestamp
             self.chat.save(update_fields=['message_count', 'last_message_at'])
 
+    @property
+    def ai_response_data(self):
+        """Данные ответа ИИ; загружаются из отдельной таблицы только при обращении"""
+        if hasattr(self, '_pending_ai_response_data'):
+            return self._pending_ai_response_data
+        try:
+            return self.ai_payload.data
+        except ChatMessageAIPayload.DoesNotExist:
+            return None
+
+    @ai_response_data.setter
+    def ai_response_data(self, value):
+        # Записывается при следующем save()
+        self._pending_ai_response_data = value
+
+    def _save_ai_response_data(self, value, is_new):
+        # Без чтения перед записью: SELECT, а затем INSERT в одной транзакции
+        # SQLite при одновременной записи завершает ошибкой "database is locked"
+        payload = None
+        if value is None:
+            if not is_new:
+                ChatMessageAIPayload.objects.filter(message=self).delete()
+        elif is_new or not ChatMessageAIPayload.objects.filter(message=self).update(data=value):
+            payload = ChatMessageAIPayload.objects.create(message=self, data=value)
+        else:
+            payload = ChatMessageAIPayload(message=self, data=value)
+            payload._state.adding = False
+        ChatMessage.ai_payload.related.set_cached_value(self, payload)
+
     @property
     def formatted_time(self):
         """Форматированное время"""
@@ -585,6 +664,81 @@ class ChatMessage(models.Model):
             self.save(update_fields=['is_read'])
 
 
+class ChatMessageAIPayload(models.Model):
+    """Исходный ответ ИИ для сообщения чата (вынесен из ChatMessage, чтобы не читать его при выводе истории)"""
+
+    message = models.OneToOneField(
+        ChatMessage,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ai_payload',
+        verbose_name="Сообщение"
+    )
+    data = CompressedJSONField(verbose_name="Данные ответа ИИ")
+
+    class Meta:
+        verbose_name = "Данные ответа ИИ"
+        verbose_name_plural = "Данные ответов ИИ"
+
+    def __str__(self):
+        return f"Данные ИИ для сообщения #{self.message_id}"
+
+
+class ArchivedChatMessage(models.Model):
+    """Сообщения закрытых чатов, перенесенные из рабочей таблицы (manage.py archive_chat_messages)"""
+
+    # id совпадает с id исходного ChatMessage
+    id = models.BigIntegerField(primary_key=True)
+
+    chat = models.ForeignKey(
+        LawyerChat,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        verbose_name="Чат"
+    )
+    sender = models.CharField(
+        max_length=20,
+        choices=ChatMessage.SENDER_CHOICES,
+        verbose_name="Отправитель"
+    )
+    message = models.TextField(verbose_name="Сообщение")
+    message_type = models.CharField(
+        max_length=20,
+        choices=ChatMessage.MESSAGE_TYPES,
+        default='text',
+        verbose_name="Тип сообщения"
+    )
+    is_read = models.BooleanField(default=False, verbose_name="Прочитано")
+    is_edited = models.BooleanField(default=False, verbose_name="Редактировано")
+    ai_response_data = CompressedJSONField(null=True, blank=True, verbose_name="Данные ответа ИИ")
+    ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name="IP адрес отправителя")
+    timestamp = models.DateTimeField()
+    edited_at = models.DateTimeField(null=True, blank=True)
+    moved_at = models.DateTimeField(auto_now_add=True, verbose_name="Перенесено в архив")
+
+    # Поля, общие с ChatMessage, которые переносятся в архив
+    COPIED_FIELDS = (
+        'id', 'chat_id', 'sender', 'message', 'message_type', 'is_read', 'is_edited',
+        'ai_response_data', 'ip_address', 'timestamp', 'edited_at',
+    )
+
+    class Meta:
+        verbose_name = "Архивное сообщение чата"
+        verbose_name_plural = "Архивные сообщения чатов"
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['chat', 'timestamp'], name='lexy_archmsg_chat_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_sender_display()}: {self.message[:50]}..."
+
+    @classmethod
+    def from_message(cls, message):
+        """Архивная копия сообщения"""
+        return cls(**{field: getattr(message, field) for field in cls.COPIED_FIELDS})
+
+
 class Consultation(models.Model):
     """Модель для консультаций (расширенная информация)"""
 
@@ -0,0 +1,149 @@
+# lexy/pagination.py
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'cursor'
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по статистике планировщика, None если оценки нет"""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    unfiltered = not queryset.query.where
+
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                if unfiltered:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [connection.ops.quote_name(table)]
+                    )
+                    row = cursor.fetchone()
+                    # reltuples = -1, если таблица еще не анализировалась
+                    return row[0] if row and row[0] >= 0 else None
+                plan = json.loads(queryset.order_by().explain(format='json'))
+                return int(plan[0]['Plan']['Plan Rows'])
+
+            if connection.vendor == 'sqlite' and unfiltered:
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+                )
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+    except (DatabaseError, ValueError, LookupError, TypeError):
+        return None
+
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который на больших таблицах берет число строк из статистики БД вместо COUNT(*)"""
+
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+            return self.object_list.count()
+        return len(self.object_list)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Список админки с keyset-пагинацией: следующая страница выбирается условием
+    по (keyset_field, pk) последней строки, а не OFFSET, поэтому любая страница
+    стоит столько же, сколько первая.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    @cached_property
+    def keyset_field(self):
+        return self.model_admin.keyset_field
+
+    @cached_property
+    def keyset_direction(self):
+        """'-' или '' если список отсортирован по keyset_field, иначе None"""
+        ordering = self.queryset.query.order_by
+        if not self.keyset_field or not ordering or not isinstance(ordering[0], str):
+            return None
+        first = ordering[0]
+        prefix = '-' if first.startswith('-') else ''
+        if first.lstrip('-') != self.keyset_field:
+            return None
+        return prefix
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = cursor.rsplit(',', 1)
+            field = self.model._meta.get_field(self.keyset_field)
+            return field.to_python(value), int(pk)
+        except (ValueError, ValidationError):
+            raise IncorrectLookupParameters
+
+    def get_results(self, request):
+        prefix = self.keyset_direction
+        if prefix is not None:
+            self.queryset = self.queryset.order_by(f'{prefix}{self.keyset_field}', f'{prefix}pk')
+
+        super().get_results(request)
+
+        self.keyset_page = False
+        cursor = request.GET.get(CURSOR_VAR)
+        if prefix is None or not cursor:
+            return
+
+        value, pk = self.decode_cursor(cursor)
+        lookup = 'lt' if prefix == '-' else 'gt'
+        self.result_list = self.queryset.filter(
+            Q(**{f'{self.keyset_field}__{lookup}': value})
+            | Q(**{self.keyset_field: value, f'pk__{lookup}': pk})
+        )[:self.list_per_page]
+        self.keyset_page = True
+
+    @cached_property
+    def next_cursor(self):
+        if self.keyset_direction is None:
+            return None
+        rows = list(self.result_list)
+        if len(rows) < self.list_per_page:
+            return None
+        last = rows[-1]
+        return f"{getattr(last, self.keyset_field).isoformat()},{last.pk}"
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+
+
+class KeysetPaginationMixin:
+    """Примесь для ModelAdmin больших таблиц: оценка количества и keyset-пагинация"""
+
+    keyset_field = None
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/lexy/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,87 @@
+# lexy/ratelimit.py
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, JsonResponse
+
+# Ограничение частоты запросов к view, которые обращаются к платному API ИИ.
+# Скользящее окно считается по двум соседним фиксированным окнам: запросы прошлого
+# окна учитываются с весом, убывающим по мере того, как оно уходит назад.
+# Счетчики хранятся в общем кэше (Redis при REDIS_URL), поэтому лимит общий для
+# всех процессов. Если общий кэш недоступен, лимит считается внутри процесса.
+
+_local_cache = LocMemCache('lexy-ratelimit', {})
+
+
+def get_client_id(request):
+    """
+    Клиент определяется по IP: cookie сессии задает сам клиент и может менять
+    ее на каждый запрос. За обратным прокси REMOTE_ADDR должен выставлять прокси.
+    """
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def hit(backend, key, limit, window, now):
+    """
+    Учесть запрос в скользящем окне.
+    Возвращает 0, если запрос разрешен, иначе через сколько секунд повторить.
+    """
+    current = int(now // window)
+    current_key = f'lexy_rl_{key}_{current}'
+    position = (now % window) / window
+
+    # Сначала атомарно учесть запрос, потом сравнить с лимитом: одновременные
+    # запросы одного клиента получают разные значения счетчика и не проходят все сразу
+    backend.add(current_key, 0, window * 2)
+    current_count = backend.incr(current_key)
+    previous_count = backend.get(f'lexy_rl_{key}_{current - 1}', 0)
+    previous_weight = previous_count * (1 - position)
+
+    if previous_weight + current_count > limit:
+        # Отклоненный запрос не расходует бюджет
+        backend.decr(current_key)
+        if current_count > limit or not previous_count:
+            # Не хватает даже без прошлого окна - ждать начала следующего
+            wait = window * (1 - position)
+        else:
+            # Ждать, пока вес прошлого окна уменьшится достаточно
+            wait = window * ((1 - (limit - current_count) / previous_count) - position)
+        return max(1, math.ceil(wait))
+    return 0
+
+
+def check_rate_limit(name, request, now=None):
+    """0 - запрос разрешен, иначе Retry-After в секундах"""
+    budget = settings.RATE_LIMITS.get(name)
+    if not budget:
+        return 0
+    limit, window = budget
+    key = f'{name}_{get_client_id(request)}'
+    now = time.time() if now is None else now
+    try:
+        return hit(cache, key, limit, window, now)
+    except Exception:
+        return hit(_local_cache, key, limit, window, now)
+
+
+def rate_limited(view_func):
+    """Ограничивает частоту вызовов view по бюджету settings.RATE_LIMITS[имя view]"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        retry_after = check_rate_limit(view_func.__name__, request)
+        if not retry_after:
+            return view_func(request, *args, **kwargs)
+
+        message = 'Слишком много запросов. Попробуйте через несколько секунд'
+        if request.method == 'POST':
+            response = JsonResponse({'success': False, 'error': message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    return wrapper
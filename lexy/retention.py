@@ -0,0 +1,135 @@
+# lexy/retention.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedChatMessage, ChatMessage, EmergencyRequest, LawyerChat
+
+# Сроки хранения задаются в settings.RETENTION_POLICY (дни, 0 - правило выключено):
+#   anonymize    - через сколько дней с заявок и чатов стираются IP, User-Agent, сессия и контакты
+#   closed_chats - через сколько дней после закрытия чат удаляется вместе с сообщениями
+#   requests     - через сколько дней заявка удаляется вместе со всеми чатами
+#
+# Удаление идет снизу вверх (сообщения, затем чаты, затем заявки), чтобы каскад
+# при удалении родителя был пустым и каждая пачка оставалась короткой транзакцией.
+
+CLOSED_CHAT_STATUSES = ('closed', 'archived')
+
+
+class RetentionRule:
+    """Правило хранения: выборка просроченных строк и действие над ними"""
+
+    def __init__(self, name, queryset, update=None):
+        self.name = name
+        self.queryset = queryset
+        # update=None - строки удаляются, иначе обновляются этими значениями
+        self.update = update
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    def apply(self, pks):
+        rows = self.model._base_manager.filter(pk__in=pks)
+        if self.update is None:
+            rows.delete()
+        else:
+            rows.update(**self.update)
+
+
+def get_retention_rules(policy=None, now=None):
+    """Правила хранения в порядке применения"""
+    policy = settings.RETENTION_POLICY if policy is None else policy
+    now = now or timezone.now()
+    rules = []
+
+    def cutoff(key):
+        return now - timedelta(days=policy[key])
+
+    if policy.get('requests'):
+        before = cutoff('requests')
+        rules += [
+            RetentionRule('requests.messages', ChatMessage.objects.filter(chat__request__created_at__lt=before)),
+            RetentionRule(
+                'requests.archived_messages',
+                ArchivedChatMessage.objects.filter(chat__request__created_at__lt=before)
+            ),
+            RetentionRule('requests.chats', LawyerChat.objects.filter(request__created_at__lt=before)),
+            RetentionRule('requests', EmergencyRequest.objects.filter(created_at__lt=before)),
+        ]
+
+    if policy.get('closed_chats'):
+        before = cutoff('closed_chats')
+        rules += [
+            RetentionRule(
+                'closed_chats.messages',
+                ChatMessage.objects.filter(chat__status__in=CLOSED_CHAT_STATUSES, chat__archived_at__lt=before)
+            ),
+            RetentionRule(
+                'closed_chats.archived_messages',
+                ArchivedChatMessage.objects.filter(
+                    chat__status__in=CLOSED_CHAT_STATUSES, chat__archived_at__lt=before
+                )
+            ),
+            RetentionRule(
+                'closed_chats',
+                LawyerChat.objects.filter(status__in=CLOSED_CHAT_STATUSES, archived_at__lt=before)
+            ),
+        ]
+
+    if policy.get('anonymize'):
+        before = cutoff('anonymize')
+        # Условия исключают уже обезличенные строки, иначе проход не закончится
+        rules += [
+            RetentionRule(
+                'anonymize.requests',
+                EmergencyRequest.objects.filter(created_at__lt=before).filter(
+                    Q(ip_address__isnull=False) | ~Q(user_agent='') | ~Q(session_key='')
+                ),
+                update={'ip_address': None, 'user_agent': '', 'session_key': ''}
+            ),
+            RetentionRule(
+                'anonymize.chats',
+                LawyerChat.objects.filter(created_at__lt=before).filter(~Q(client_name='') | ~Q(client_email='')),
+                update={'client_name': '', 'client_email': ''}
+            ),
+            RetentionRule(
+                'anonymize.messages',
+                ChatMessage.objects.filter(timestamp__lt=before, ip_address__isnull=False),
+                update={'ip_address': None}
+            ),
+            RetentionRule(
+                'anonymize.archived_messages',
+                ArchivedChatMessage.objects.filter(timestamp__lt=before, ip_address__isnull=False),
+                update={'ip_address': None}
+            ),
+        ]
+
+    return rules
+
+
+def apply_rule(rule, batch_size=500, max_batches=None):
+    """
+    Применяет правило пачками по batch_size строк, каждая пачка - отдельная транзакция.
+    Строки, заблокированные другими транзакциями, пропускаются до следующего запуска.
+    Возвращает количество обработанных строк.
+    """
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            pks = list(
+                rule.queryset.order_by('pk')
+                .select_for_update(skip_locked=True, of=('self',))
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            rule.apply(pks)
+
+        processed += len(pks)
+        batches += 1
+    return processed
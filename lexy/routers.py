@@ -0,0 +1,108 @@
+# lexy/routers.py
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Cookie, закрепляющая сессию за основной базой после записи (read-your-writes)
+PRIMARY_PIN_COOKIE = 'lexy_primary_until'
+
+
+class RoutingState:
+    """Состояние маршрутизации одного HTTP-запроса"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.use_replica = False
+        self.wrote = False
+
+
+_routing_state = ContextVar('lexy_routing_state', default=None)
+
+
+def replica_read(view_func):
+    """Помечает view как только читающее: его запросы можно отправить на реплику"""
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        return view_func(*args, **kwargs)
+
+    wrapper.use_replica = True
+    return wrapper
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaRouter:
+    """
+    Чтение в помеченных view идет на реплики, все остальное - на основную базу.
+    Фоновые потоки не наследуют состояние запроса и всегда работают с основной базой.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        replicas = get_replicas()
+        if not replicas or state is None or not state.use_replica or state.pinned or state.wrote:
+            return DEFAULT_DB_ALIAS
+        # Внутри транзакции читаем оттуда же, куда пишем
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему через репликацию
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Включает чтение с реплик для view, помеченных replica_read, и после записи
+    на REPLICA_STICKY_SECONDS закрепляет клиента за основной базой.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(pinned=self.is_pinned(request))
+        token = _routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+
+        if state.wrote and get_replicas():
+            sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE,
+                str(int(time.time()) + sticky),
+                max_age=sticky,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'use_replica', False):
+            _routing_state.get().use_replica = True
+
+    def is_pinned(self, request):
+        try:
+            return int(request.COOKIES.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
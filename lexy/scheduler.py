@@ -0,0 +1,117 @@
+# lexy/scheduler.py
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .tracing import current_span, start_span
+
+# Очередь фоновых обращений к ИИ (анализ заявок и ответы юристов в чатах) с приоритетом
+# по срочности дела. Срочность новой заявки заранее оценивается локально
+# (lexy/triage.py), у чатов она уже известна из анализа.
+# Чтобы несрочные задачи не ждали бесконечно, приоритет задачи растет на один
+# уровень за каждые LLM_SCHEDULER['aging_seconds'] ожидания.
+# Задача выполняется в спане, который продолжает трассу поставившего ее view.
+
+URGENCY_RANK = {
+    'critical': 0,
+    'high': 1,
+    'medium': 2,
+    'low': 3,
+}
+
+
+class Job:
+    def __init__(self, func, args, kwargs, rank, enqueued_at, seq):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.rank = rank
+        self.enqueued_at = enqueued_at
+        self.seq = seq
+        self.future = Future()
+        self.trace_parent = current_span()
+
+
+class PriorityScheduler:
+    """Пул из workers потоков, которые берут из очереди самую приоритетную задачу"""
+
+    def __init__(self, workers, aging_seconds, clock=time.monotonic):
+        self.workers = workers
+        self.aging_seconds = aging_seconds
+        self.clock = clock
+        self._jobs = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def submit(self, func, *args, urgency='medium', **kwargs):
+        """Поставить func(*args, **kwargs) в очередь; возвращает Future с результатом"""
+        rank = URGENCY_RANK.get(urgency, URGENCY_RANK['medium'])
+        job = Job(func, args, kwargs, rank, self.clock(), next(self._seq))
+        with self._condition:
+            self._jobs.append(job)
+            self._start_workers()
+            self._condition.notify()
+        return job.future
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._jobs)
+
+    def effective_rank(self, job, now):
+        return job.rank - (now - job.enqueued_at) / self.aging_seconds
+
+    def pop_next(self):
+        """Самая приоритетная задача с учетом ожидания; при равенстве - пришедшая раньше"""
+        now = self.clock()
+        job = min(self._jobs, key=lambda item: (self.effective_rank(item, now), item.seq))
+        self._jobs.remove(job)
+        return job
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'lexy-llm-{len(self._threads)}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._jobs:
+                    self._condition.wait()
+                job = self.pop_next()
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            attributes = {
+                'lexy.urgency_rank': job.rank,
+                'lexy.queue_wait_ms': round((self.clock() - job.enqueued_at) * 1000, 1),
+            }
+            try:
+                name = getattr(job.func, '__name__', type(job.func).__name__)
+                with start_span(f'task {name}', attributes=attributes, parent=job.trace_parent, root=True):
+                    result = job.func(*job.args, **job.kwargs)
+                job.future.set_result(result)
+            except BaseException as e:
+                job.future.set_exception(e)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            options = settings.LLM_SCHEDULER
+            _scheduler = PriorityScheduler(options['workers'], options['aging_seconds'])
+        return _scheduler
+
+
+def submit(func, *args, urgency='medium', **kwargs):
+    """Поставить обращение к ИИ в общую очередь процесса"""
+    return get_scheduler().submit(func, *args, urgency=urgency, **kwargs)
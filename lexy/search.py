@@ -0,0 +1,182 @@
+# lexy/search.py
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+# Полнотекстовый поиск для админки вместо LIKE '%...%' по длинным текстам.
+#   PostgreSQL - GIN-индекс по to_tsvector('russian', ...), поддерживается самой базой
+#                (создается CONCURRENTLY, поэтому миграция не атомарная);
+#   SQLite     - таблица FTS5 с внешним содержимым, обновляется триггерами на вставку,
+#                изменение и удаление строк.
+# На других базах поиск админки остается стандартным.
+#
+# SQLite пересоздает таблицу при многих изменениях схемы и при этом теряет триггеры,
+# поэтому после каждого migrate индексы проверяются заново (repair_search_indexes).
+
+SEARCH_CONFIG = 'russian'
+
+WORD_RE = re.compile(r'\w+')
+
+# Окончания для грубого выделения основы на SQLite, где нет русского стеммера:
+# искомое слово без окончания ищется по префиксу ("зарплату" -> "зарплат*")
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ать', 'ять', 'ить', 'еть',
+    'ает', 'яет', 'ают', 'яют', 'ует', 'уют', 'ешь', 'ишь', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ую', 'юю', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ей', 'ия', 'ью', 'ет',
+    'ит', 'ут', 'ют', 'ат', 'ят', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+MIN_STEM_LENGTH = 4
+
+
+class SearchIndex:
+    """Полнотекстовый индекс по текстовым колонкам одной таблицы"""
+
+    def __init__(self, name, table, columns):
+        self.name = name
+        self.table = table
+        self.columns = columns
+
+    def tsvector_sql(self):
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in self.columns)
+        return f"to_tsvector('{SEARCH_CONFIG}', {document})"
+
+    def create_sql(self, vendor):
+        if vendor == 'postgresql':
+            return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table} USING gin ({self.tsvector_sql()})"]
+
+        if vendor == 'sqlite':
+            columns = ', '.join(self.columns)
+            new_values = ', '.join(f'new.{column}' for column in self.columns)
+            old_values = ', '.join(f'old.{column}' for column in self.columns)
+            delete_old = (
+                f"INSERT INTO {self.name}({self.name}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+            )
+            insert_new = f"INSERT INTO {self.name}(rowid, {columns}) VALUES (new.id, {new_values});"
+            return [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.name} USING fts5("
+                f"{columns}, content='{self.table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+                f"CREATE TRIGGER IF NOT EXISTS {self.name}_insert AFTER INSERT ON {self.table} BEGIN {insert_new} END",
+                f"CREATE TRIGGER IF NOT EXISTS {self.name}_delete AFTER DELETE ON {self.table} BEGIN {delete_old} END",
+                f"CREATE TRIGGER IF NOT EXISTS {self.name}_update AFTER UPDATE OF {columns} ON {self.table} "
+                f"BEGIN {delete_old} {insert_new} END",
+            ]
+        return []
+
+    def drop_sql(self, vendor):
+        if vendor == 'postgresql':
+            return [f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"]
+        if vendor == 'sqlite':
+            return [
+                f"DROP TRIGGER IF EXISTS {self.name}_{event}" for event in ('insert', 'delete', 'update')
+            ] + [f"DROP TABLE IF EXISTS {self.name}"]
+        return []
+
+    def rebuild_sql(self, vendor):
+        """Перестроить индекс по текущему содержимому таблицы (только SQLite)"""
+        if vendor == 'sqlite':
+            return [f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')"]
+        return []
+
+    def match_sql(self, vendor):
+        """Подзапрос id строк, подходящих под поисковый запрос (параметр - результат prepare_query)"""
+        if vendor == 'postgresql':
+            return (
+                f"SELECT id FROM {self.table} "
+                f"WHERE {self.tsvector_sql()} @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+            )
+        if vendor == 'sqlite':
+            return f"SELECT rowid FROM {self.name} WHERE {self.name} MATCH %s"
+        return None
+
+    def prepare_query(self, vendor, search_term):
+        if vendor == 'sqlite':
+            words = WORD_RE.findall(search_term.lower())
+            return ' '.join(f'"{stem_russian(word)}"*' for word in words) or None
+        return search_term.strip() or None
+
+
+SEARCH_INDEXES = {
+    'lexy.EmergencyRequest': SearchIndex(
+        'lexy_request_fts', 'lexy_emergencyrequest', ('problem_text', 'summary', 'error_message')
+    ),
+    'lexy.ChatMessage': SearchIndex('lexy_message_fts', 'lexy_chatmessage', ('message',)),
+}
+
+
+def stem_russian(word):
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def create_search_indexes(schema_editor):
+    """Создать индексы и заполнить их текущими данными (миграция)"""
+    vendor = schema_editor.connection.vendor
+    for index in SEARCH_INDEXES.values():
+        for sql in index.create_sql(vendor) + index.rebuild_sql(vendor):
+            schema_editor.execute(sql)
+
+
+def drop_search_indexes(schema_editor):
+    vendor = schema_editor.connection.vendor
+    for index in SEARCH_INDEXES.values():
+        for sql in index.drop_sql(vendor):
+            schema_editor.execute(sql)
+
+
+def repair_search_indexes(using='default', **kwargs):
+    """
+    После migrate на SQLite: если таблица пересоздавалась и триггеры пропали,
+    создать их заново и перестроить индекс. Обработчик сигнала post_migrate.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for index in SEARCH_INDEXES.values():
+            if index.name not in tables:
+                continue
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s AND name LIKE %s",
+                [index.table, f'{index.name}_%']
+            )
+            if cursor.fetchone()[0] == 3:
+                continue
+            for sql in index.create_sql('sqlite') + index.rebuild_sql('sqlite'):
+                cursor.execute(sql)
+
+
+def fulltext_filter(queryset, search_term):
+    """
+    Отфильтровать queryset полнотекстовым поиском.
+    None, если для модели или базы полнотекстового индекса нет.
+    """
+    index = SEARCH_INDEXES.get(queryset.model._meta.label)
+    vendor = connections[queryset.db].vendor
+    if index is None or index.match_sql(vendor) is None:
+        return None
+
+    query = index.prepare_query(vendor, search_term)
+    if query is None:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(index.match_sql(vendor), [query]))
+
+
+class FullTextSearchMixin:
+    """
+    Поиск в админке по полнотекстовому индексу вместо LIKE по search_fields.
+    search_fields таких админок должны совпадать с колонками индекса: поиск
+    LIKE по любому другому полю снова читал бы всю таблицу.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            filtered = fulltext_filter(queryset, search_term)
+            if filtered is not None:
+                return filtered, False
+        return super().get_search_results(request, queryset, search_term)
@@ -0,0 +1,71 @@
+# lexy/status.py
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
+from .metrics import PROCESS_LOCAL_BACKENDS
+from .models import EmergencyRequest
+
+# Статус заявки для опроса со страницы ожидания. Ключ пишут submit_request и
+# фоновый поток анализа при каждой смене статуса, поэтому пока идет анализ
+# опрос не обращается к базе. При промахе кэша читаются только узкие колонки,
+# и прочитанное не затирает записанное в это время воркером (cache.add).
+# Общий кэш (Redis) видит каждую смену статуса, и статус в нем хранится час.
+# Без Redis кэш свой у каждого процесса, и процесс, не выполнявший анализ, не
+# узнает о его завершении: поэтому там промежуточный статус хранится несколько
+# секунд, а окончательный, который уже не изменится, - час.
+STATUS_CACHE_KEY = 'lexy_request_status_{}'
+STATUS_CACHE_TIMEOUT = 60 * 60
+PENDING_STATUS_CACHE_TIMEOUT = 3
+
+FINAL_STATUSES = ('completed', 'failed')
+
+STATUS_FIELDS = ('status', 'category', 'urgency', 'summary')
+
+
+def get_status_cache_key(request_id):
+    return STATUS_CACHE_KEY.format(request_id)
+
+
+def get_status_timeout(status):
+    """Сколько хранить статус в кэше"""
+    if status['status'] in FINAL_STATUSES or not is_process_local_cache():
+        return STATUS_CACHE_TIMEOUT
+    return PENDING_STATUS_CACHE_TIMEOUT
+
+
+def is_process_local_cache():
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_BACKENDS
+
+
+def build_status(request_obj):
+    """Проекция статуса заявки без тяжелых полей"""
+    status = {field: getattr(request_obj, field) for field in STATUS_FIELDS}
+    status['has_response'] = bool(request_obj.ai_response)
+    return status
+
+
+def cache_request_status(request_obj):
+    """Обновить статус заявки в кэше после смены статуса"""
+    status = build_status(request_obj)
+    cache.set(get_status_cache_key(request_obj.id), status, get_status_timeout(status))
+    return status
+
+
+def get_request_status(request_id):
+    """Статус заявки из кэша, при промахе - из узкой выборки; None, если заявки нет"""
+    key = get_status_cache_key(request_id)
+    status = cache.get(key)
+    if status is not None:
+        return status
+
+    status = (
+        EmergencyRequest.objects
+        .filter(id=request_id)
+        .annotate(has_response=ExpressionWrapper(Q(ai_response__isnull=False), output_field=BooleanField()))
+        .values(*STATUS_FIELDS, 'has_response')
+        .first()
+    )
+    if status is not None:
+        cache.add(key, status, get_status_timeout(status))
+    return status
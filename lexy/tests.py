@@ -1,3 +1,1500 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
 
-# Create your tests here.
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from unittest import mock
+
+from . import views
+from .admission import FAST_PATH, estimate_chat_wait, estimate_wait, get_llm_latency, record_llm_latency
+from .admin import ChatMessageInline, get_stats_for_lawyer
+from .compression import CURRENT_DICTIONARY_ID, compress_json, decompress_json, dumps, get_dictionary_id
+from .dedup import get_reuse_stats, hamming_distance, simhash, similarity
+from .db import configure_sqlite_connection, set_journal_mode
+from .db_backend.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from .management.commands.archive_chat_messages import archive_chat_messages
+from .management.commands.bench_funnel import compare_with_baseline, percentile
+from .management.commands.recompress_ai_responses import Command as RecompressCommand
+from .exports import write_export
+from .idempotency import idempotent
+from .llm_fake import FakeLLM, FakeLLMClient, FakeLLMError, FakeLLMServer
+from .llm_recording import FixtureMissError, RecordingLLMClient, ReplayLLMClient
+from .metrics import check_metrics_settings, track_llm_call
+from .management.commands.check_import_time import measure_startup, parse_importtime
+from .management.commands.trace_report import load_traces
+from .management.commands.copy_database import get_models_in_dependency_order
+from .pagination import EstimatedCountPaginator, estimate_count
+from .search import SEARCH_INDEXES, repair_search_indexes, stem_russian
+from .ratelimit import check_rate_limit, hit
+from .retention import apply_rule, get_retention_rules
+from .scheduler import PriorityScheduler
+from .tracing import TracedCache, start_span, start_trace
+from .triage import guess_category, guess_urgency
+from .status import (
+    PENDING_STATUS_CACHE_TIMEOUT, STATUS_CACHE_TIMEOUT, cache_request_status, get_request_status,
+    get_status_cache_key,
+)
+from .routers import PRIMARY_PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, replica_read
+from .models import ArchivedChatMessage, EmergencyRequest, Lawyer, LawyerChat, ChatMessage, LawyerReview
+
+
+def make_request(text="Попал в ДТП, виновник скрылся с места аварии", **kwargs):
+    return EmergencyRequest.objects.create(problem_text=text, **kwargs)
+
+
+def make_lawyer(name="Анна Ковалева", specialization='labor', **kwargs):
+    return Lawyer.objects.create(name=name, specialization=specialization, **kwargs)
+
+
+class AdminTestCase(TestCase):
+    """Базовый класс для тестов админки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin_user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+
+class EmergencyRequestAdminQueriesTest(AdminTestCase):
+    """Бюджет запросов для списка юридических запросов"""
+
+    url = '/admin/lexy/emergencyrequest/'
+
+    def add_requests(self, count):
+        lawyer = make_lawyer()
+        for _ in range(count):
+            request_obj = make_request()
+            LawyerChat.objects.create(request=request_obj, lawyer=lawyer)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_requests(3)
+        small = self.count_queries(self.url)
+
+        self.add_requests(30)
+        large = self.count_queries(self.url)
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 10)
+
+    def test_chat_count_is_annotated(self):
+        self.add_requests(2)
+        response = self.client.get(self.url)
+        self.assertContains(response, '1 чат(ов)', count=2)
+
+
+class ChatAdminQueriesTest(AdminTestCase):
+    """Бюджет запросов для админки чатов и сообщений"""
+
+    def add_chats(self, count, messages=2):
+        lawyer = make_lawyer()
+        for _ in range(count):
+            chat = LawyerChat.objects.create(request=make_request(), lawyer=lawyer)
+            for i in range(messages):
+                ChatMessage.objects.create(chat=chat, sender='client', message=f"Сообщение {i}")
+
+    def test_lawyerchat_changelist_queries_do_not_grow_with_rows(self):
+        url = '/admin/lexy/lawyerchat/'
+        self.add_chats(3)
+        small = self.count_queries(url)
+        self.add_chats(30)
+        self.assertEqual(small, self.count_queries(url))
+
+    def test_chatmessage_changelist_queries_do_not_grow_with_rows(self):
+        url = '/admin/lexy/chatmessage/'
+        self.add_chats(2)
+        small = self.count_queries(url)
+        self.add_chats(20)
+        self.assertEqual(small, self.count_queries(url))
+
+    def test_message_inline_is_paginated(self):
+        self.add_chats(1, messages=ChatMessageInline.per_page + 5)
+        chat = LawyerChat.objects.get()
+        url = f'/admin/lexy/lawyerchat/{chat.id}/change/'
+
+        response = self.client.get(url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.forms), ChatMessageInline.per_page)
+        self.assertContains(response, 'страница 1 из 2')
+
+        response = self.client.get(url, {'messages_page': 2, '_changelist_filters': 'status=active'})
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.forms), 5)
+        self.assertContains(response, '?messages_page=1&amp;_changelist_filters=status%3Dactive')
+
+
+class LawyerAdminStatsTest(AdminTestCase):
+    """Статистика юристов в списке админки"""
+
+    url = '/admin/lexy/lawyer/'
+
+    def add_lawyer(self, name, active=0, completed=0, reviews=0):
+        lawyer = make_lawyer(name=name)
+        for status, count in (('active', active), ('completed', completed)):
+            for _ in range(count):
+                LawyerChat.objects.create(request=make_request(), lawyer=lawyer, status=status)
+        for _ in range(reviews):
+            LawyerReview.objects.create(lawyer=lawyer, client_name='Иван', rating=5, comment='Спасибо')
+        return lawyer
+
+    def test_stats_are_computed_without_per_row_queries(self):
+        self.add_lawyer('Первый', active=1)
+        small = self.count_queries(self.url)
+        cache.clear()
+        for i in range(10):
+            self.add_lawyer(f'Юрист {i}', active=2, completed=1, reviews=3)
+        self.assertEqual(small, self.count_queries(self.url))
+
+    def test_stats_are_cached(self):
+        lawyer = self.add_lawyer('Первый', active=1)
+        get_stats_for_lawyer(lawyer)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_stats_for_lawyer(lawyer)['active_chats'], 1)
+
+    def test_stats_values_and_sorting(self):
+        self.add_lawyer('Мало', active=1, completed=2, reviews=1)
+        self.add_lawyer('Много', active=3, completed=0, reviews=2)
+
+        response = self.client.get(self.url, {'o': '-6'})
+        names = [lawyer.name for lawyer in response.context['cl'].result_list]
+        self.assertEqual(names, ['Много', 'Мало'])
+
+        stats = {lawyer.name: get_stats_for_lawyer(lawyer) for lawyer in Lawyer.objects.all()}
+        self.assertEqual(stats['Мало'], {'active_chats': 1, 'completed_chats': 2, 'reviews_total': 1})
+        self.assertEqual(stats['Много'], {'active_chats': 3, 'completed_chats': 0, 'reviews_total': 2})
+
+    def test_sorting_uses_current_values(self):
+        few = self.add_lawyer('Мало', active=1)
+        self.add_lawyer('Много', active=3)
+        self.client.get(self.url)
+        for _ in range(5):
+            LawyerChat.objects.create(request=make_request(), lawyer=few, status='active')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'o': '-6'})
+        rows = [(lawyer.name, lawyer.stats_active_chats) for lawyer in response.context['cl'].result_list]
+        self.assertEqual(rows, [('Мало', 6), ('Много', 3)])
+        self.assertFalse(any('CASE WHEN' in query['sql'] for query in queries.captured_queries))
+
+
+class ChatExportTest(AdminTestCase):
+    """Выгрузка переписки из админки чатов"""
+
+    url = '/admin/lexy/lawyerchat/'
+
+    def setUp(self):
+        super().setUp()
+        lawyer = make_lawyer()
+        self.chat = LawyerChat.objects.create(request=make_request(), lawyer=lawyer)
+        ChatMessage.objects.create(chat=self.chat, sender='client', message='Здравствуйте, "помогите"')
+        ChatMessage.objects.create(chat=self.chat, sender='lawyer', message='Добрый день')
+        other = LawyerChat.objects.create(request=make_request(), lawyer=lawyer)
+        ChatMessage.objects.create(chat=other, sender='client', message='Другой чат')
+
+    def run_action(self, action):
+        response = self.client.post(self.url, {
+            'action': action,
+            '_selected_action': [self.chat.id],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_jsonl(self):
+        rows = [json.loads(line) for line in self.run_action('export_chats').splitlines()]
+        self.assertEqual([row['message'] for row in rows], ['Здравствуйте, "помогите"', 'Добрый день'])
+        self.assertEqual({row['chat_id'] for row in rows}, {self.chat.id})
+
+    def test_export_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.run_action('export_chats_csv'))))
+        self.assertEqual([row['sender'] for row in rows], ['client', 'lawyer'])
+        self.assertEqual(rows[0]['message'], 'Здравствуйте, "помогите"')
+
+    def test_background_export_file(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(EXPORTS_ROOT=Path(tmp)):
+            filename = 'chats-' + '0' * 32 + '.jsonl'
+            write_export(LawyerChat.objects.all(), 'jsonl', filename)
+            self.assertEqual(len((Path(tmp) / filename).read_text(encoding='utf-8').splitlines()), 3)
+
+            response = self.client.get(f'{self.url}exports/{filename}/')
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f'{self.url}exports/..secret/')
+        self.assertEqual(response.status_code, 404)
+
+
+class LargeTablePaginationTest(AdminTestCase):
+    """Оценка количества строк и keyset-пагинация в админке"""
+
+    url = '/admin/lexy/chatmessage/'
+
+    def setUp(self):
+        super().setUp()
+        chat = LawyerChat.objects.create(request=make_request(), lawyer=make_lawyer())
+        for i in range(12):
+            ChatMessage.objects.create(chat=chat, sender='client', message=f"Сообщение {i}")
+
+    def get_page(self, params=None):
+        with mock.patch.object(admin.site._registry[ChatMessage], 'list_per_page', 5), \
+                CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, ctx.captured_queries
+
+    def test_keyset_pages_cover_all_rows_without_offset(self):
+        seen = []
+        response, _ = self.get_page()
+        seen += [msg.id for msg in response.context['cl'].result_list]
+
+        while response.context['cl'].next_cursor:
+            cursor = response.context['cl'].next_cursor
+            response, queries = self.get_page({'cursor': cursor})
+            self.assertFalse(any('OFFSET' in q['sql'] for q in queries))
+            seen += [msg.id for msg in response.context['cl'].result_list]
+
+        expected = list(ChatMessage.objects.order_by('-timestamp', '-pk').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_paginator_uses_estimate_above_threshold(self):
+        queryset = ChatMessage.objects.all()
+        with mock.patch('lexy.pagination.estimate_count', return_value=50000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 50000)
+        with mock.patch('lexy.pagination.estimate_count', return_value=100):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 12)
+
+    def test_sqlite_estimate_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimate_count(ChatMessage.objects.all()), 12)
+        self.assertIsNone(estimate_count(ChatMessage.objects.filter(sender='client')))
+
+
+class CopyDatabaseTest(TestCase):
+    """Порядок переноса таблиц между базами"""
+
+    def test_parents_are_copied_before_children(self):
+        order = get_models_in_dependency_order()
+        for child, parent in ((LawyerChat, EmergencyRequest), (LawyerChat, Lawyer),
+                              (ChatMessage, LawyerChat), (LawyerReview, Lawyer)):
+            self.assertLess(order.index(parent), order.index(child))
+
+
+class SQLiteTuningTest(TestCase):
+    """Настройка соединений SQLite"""
+
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234})
+    def test_pragmas_are_applied(self):
+        configure_sqlite_connection(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+
+    @override_settings(SQLITE_PRAGMAS={'user_version': 1})
+    def test_unknown_pragma_is_rejected(self):
+        with self.assertRaises(ValueError):
+            configure_sqlite_connection(sender=None, connection=connection)
+
+    def file_connection(self, path, **options):
+        return SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': path, 'OPTIONS': options}, 'sqlite_file')
+
+    def test_journal_mode_is_set_once_not_per_connection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'db.sqlite3')
+            db = self.file_connection(path)
+            configure_sqlite_connection(sender=None, connection=db)
+            with db.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'delete')
+
+            set_journal_mode(db, 'wal')
+            db.close()
+            with self.file_connection(path).cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_transactions_take_write_lock_immediately(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'db.sqlite3')
+            db = self.file_connection(path, transaction_mode='IMMEDIATE')
+            db.ensure_connection()
+            db.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+            try:
+                other = sqlite3.connect(path, timeout=0)
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    other.execute('BEGIN IMMEDIATE')
+                other.close()
+            finally:
+                db.rollback()
+                db.set_autocommit(True)
+                db.close()
+
+
+@override_settings(DATABASE_REPLICAS=['replica_test'])
+class ReplicaRouterTest(SimpleTestCase):
+    """Маршрутизация чтения на реплики"""
+
+    def run_view(self, view, cookies=None):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        routed = {}
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request, routed)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return routed, response
+
+    def test_read_only_view_reads_from_replica(self):
+        @replica_read
+        def view(request, routed):
+            routed['read'] = ReplicaRouter().db_for_read(EmergencyRequest)
+            return HttpResponse()
+
+        routed, response = self.run_view(view)
+        self.assertEqual(routed['read'], 'replica_test')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_other_views_read_from_primary(self):
+        def view(request, routed):
+            routed['read'] = ReplicaRouter().db_for_read(EmergencyRequest)
+            return HttpResponse()
+
+        routed, _ = self.run_view(view)
+        self.assertEqual(routed['read'], 'default')
+
+    def test_write_pins_client_to_primary(self):
+        def write_view(request, routed):
+            ReplicaRouter().db_for_write(EmergencyRequest)
+            return HttpResponse()
+
+        _, response = self.run_view(write_view)
+        pin = response.cookies[PRIMARY_PIN_COOKIE].value
+
+        @replica_read
+        def read_view(request, routed):
+            routed['read'] = ReplicaRouter().db_for_read(EmergencyRequest)
+            return HttpResponse()
+
+        routed, _ = self.run_view(read_view, cookies={PRIMARY_PIN_COOKIE: pin})
+        self.assertEqual(routed['read'], 'default')
+
+    def test_outside_request_reads_from_primary(self):
+        self.assertEqual(ReplicaRouter().db_for_read(EmergencyRequest), 'default')
+
+
+class ChatArchiveTest(TestCase):
+    """Перенос сообщений закрытых чатов в архив"""
+
+    def setUp(self):
+        lawyer = make_lawyer()
+        self.old_chat = LawyerChat.objects.create(
+            request=make_request(), lawyer=lawyer, status='closed',
+            archived_at=timezone.now() - timedelta(days=40)
+        )
+        self.recent_chat = LawyerChat.objects.create(
+            request=make_request(), lawyer=lawyer, status='closed',
+            archived_at=timezone.now() - timedelta(days=1)
+        )
+        for chat in (self.old_chat, self.recent_chat):
+            for i in range(3):
+                ChatMessage.objects.create(chat=chat, sender='client', message=f"Сообщение {i}")
+
+    def test_old_chats_are_moved_in_batches(self):
+        self.assertEqual(archive_chat_messages(days=30, batch_size=2), 3)
+
+        self.assertFalse(self.old_chat.messages.exists())
+        self.assertEqual(self.old_chat.archived_messages.count(), 3)
+        self.assertEqual(self.recent_chat.messages.count(), 3)
+        self.old_chat.refresh_from_db()
+        self.assertIsNotNone(self.old_chat.messages_archived_at)
+
+    def test_archived_messages_are_still_readable(self):
+        archive_chat_messages(days=30)
+        self.old_chat.refresh_from_db()
+        ChatMessage.objects.create(chat=self.old_chat, sender='lawyer', message='Ответ после архивации')
+
+        response = self.client.get(f'/api/chat-messages/{self.old_chat.id}/')
+        messages = [msg['message'] for msg in response.json()['messages']]
+        self.assertEqual(messages, ['Сообщение 0', 'Сообщение 1', 'Сообщение 2', 'Ответ после архивации'])
+
+        response = self.client.get(f'/chat/{self.old_chat.id}/')
+        self.assertContains(response, 'Сообщение 2')
+
+    def test_export_includes_archived_messages(self):
+        archive_chat_messages(days=30)
+        self.assertEqual(ArchivedChatMessage.objects.filter(chat=self.old_chat).count(), 3)
+        ChatMessage.objects.create(chat=self.old_chat, sender='lawyer', message='Ответ после архивации')
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(EXPORTS_ROOT=Path(tmp)):
+            filename = 'chats-' + '0' * 32 + '.jsonl'
+            write_export(LawyerChat.objects.all(), 'jsonl', filename)
+            lines = (Path(tmp) / filename).read_text(encoding='utf-8').splitlines()
+
+        rows = [json.loads(line) for line in lines]
+        old_rows = [row['message'] for row in rows if row['chat_id'] == self.old_chat.id]
+        self.assertEqual(old_rows, ['Сообщение 0', 'Сообщение 1', 'Сообщение 2', 'Ответ после архивации'])
+        self.assertEqual(len(rows), 7)
+
+
+class ChatMessagePayloadTest(TestCase):
+    """Данные ответа ИИ хранятся отдельно от сообщений"""
+
+    def setUp(self):
+        self.chat = LawyerChat.objects.create(request=make_request(), lawyer=make_lawyer())
+
+    def test_payload_round_trip(self):
+        data = {'message': 'Ответ', 'action_plan': ['Собрать документы']}
+        message = ChatMessage.objects.create(chat=self.chat, sender='lawyer', message='Ответ', ai_response_data=data)
+
+        self.assertEqual(ChatMessage.objects.get(pk=message.pk).ai_response_data, data)
+        self.assertIsNone(ChatMessage.objects.create(chat=self.chat, sender='client', message='?').ai_response_data)
+
+        message.ai_response_data = None
+        message.save()
+        self.assertIsNone(ChatMessage.objects.get(pk=message.pk).ai_response_data)
+
+    def test_history_does_not_read_payloads(self):
+        ChatMessage.objects.create(chat=self.chat, sender='lawyer', message='Ответ', ai_response_data={'a': 1})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(f'/api/chat-messages/{self.chat.id}/')
+        self.assertFalse(any('ai_payload' in q['sql'].lower() or 'aipayload' in q['sql'].lower()
+                             for q in ctx.captured_queries))
+
+    def test_new_payload_is_written_without_reading(self):
+        with CaptureQueriesContext(connection) as ctx:
+            ChatMessage.objects.create(chat=self.chat, sender='lawyer', message='Ответ', ai_response_data={'a': 1})
+        payload_sql = [q['sql'] for q in ctx.captured_queries if 'lexy_chatmessageaipayload' in q['sql']]
+        self.assertEqual(len(payload_sql), 1)
+        self.assertTrue(payload_sql[0].startswith('INSERT'))
+
+    def test_concurrent_replies_are_not_lost(self):
+        # Одновременные send_message и submit_request в файловой базе с обычными
+        # (DEFERRED) транзакциями: запись ответа ИИ не должна падать с "database is locked"
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'bench_sqlite', '--threads', '8', '--requests', '20'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'SQLITE_TRANSACTION_MODE': 'DEFERRED'},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        row = next(line for line in result.stdout.splitlines() if line.startswith('SQLITE_PRAGMAS'))
+        self.assertEqual(row.split()[2], '0', result.stdout)
+
+
+class CompressedAIResponseTest(TestCase):
+    """Ответы ИИ хранятся сжатыми словарем"""
+
+    analysis = {
+        'analysis': {'category': 'labor', 'confidence': 0.9, 'summary': 'Задержка заработной платы', 'urgency': 'medium'},
+        'recommendations': {
+            'immediate_actions': ['Направить претензию работодателю'],
+            'documents': ['Трудовой договор', 'Расчетные листки'],
+            'next_steps': ['Обратиться в трудовую инспекцию', 'Подготовить исковое заявление в суд'],
+        },
+        'legal_references': {'laws': ['Трудовой кодекс РФ'], 'articles': ['ст. 136', 'ст. 236']},
+        'disclaimer': 'Информация носит справочный характер и не является юридической консультацией.',
+    }
+
+    def test_round_trip_and_legacy_json(self):
+        data = compress_json(self.analysis)
+        self.assertEqual(get_dictionary_id(data), CURRENT_DICTIONARY_ID)
+        self.assertEqual(decompress_json(data), self.analysis)
+        self.assertEqual(decompress_json(dumps(self.analysis)), self.analysis)
+        self.assertLess(len(data), len(compress_json(self.analysis, dictionary_id=0)))
+        self.assertLess(len(data), len(dumps(self.analysis)) / 2)
+
+    def test_field_round_trip(self):
+        request_obj = make_request(ai_response=self.analysis)
+        self.assertEqual(EmergencyRequest.objects.get(pk=request_obj.pk).ai_response, self.analysis)
+        self.assertIsNone(make_request().ai_response)
+
+    def test_serializer_round_trip(self):
+        request_obj = make_request(ai_response=self.analysis)
+        data = serializers.serialize('json', [request_obj])
+        self.assertEqual(json.loads(data)[0]['fields']['ai_response'], self.analysis)
+
+        restored = next(serializers.deserialize('json', data)).object
+        self.assertEqual(restored.ai_response, self.analysis)
+
+    def test_recompress_legacy_rows(self):
+        request_obj = make_request()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE lexy_emergencyrequest SET ai_response = %s WHERE id = %s',
+                [dumps(self.analysis), request_obj.pk]
+            )
+
+        scanned, rewritten = RecompressCommand().recompress(
+            EmergencyRequest, EmergencyRequest._meta.get_field('ai_response'), batch_size=10
+        )
+        self.assertEqual((scanned, rewritten), (1, 1))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ai_response FROM lexy_emergencyrequest WHERE id = %s', [request_obj.pk])
+            self.assertEqual(get_dictionary_id(cursor.fetchone()[0]), CURRENT_DICTIONARY_ID)
+        self.assertEqual(EmergencyRequest.objects.get(pk=request_obj.pk).ai_response, self.analysis)
+
+
+class AnalysisStatusPollingTest(TestCase):
+    """Опрос статуса анализа не читает тяжелые поля заявки"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_polling_during_analysis_uses_cache(self):
+        with mock.patch('lexy.views.scheduler.submit'):
+            response = self.client.post(
+                '/submit-request/',
+                json.dumps({'problem_text': 'Работодатель задерживает зарплату уже третий месяц'}),
+                content_type='application/json'
+            )
+        request_id = response.json()['request_id']
+
+        with self.assertNumQueries(0):
+            data = self.client.get(f'/api/check-analysis/{request_id}/').json()
+        self.assertEqual(data['status'], 'analyzing')
+        self.assertFalse(data['has_response'])
+
+    def test_worker_updates_status_and_payload_is_read_once(self):
+        request_obj = make_request(status='analyzing')
+        analysis = {'analysis': {'category': 'labor', 'urgency': 'high', 'summary': 'Задержка зарплаты'}}
+        with mock.patch('lexy.views.analyze_with_assistant', return_value=analysis):
+            views.analyze_with_yandex_assistant(request_obj.id, request_obj.problem_text)
+        self.assertEqual(cache.get(get_status_cache_key(request_obj.id))['status'], 'completed')
+
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/check-analysis/{request_obj.id}/').json()
+        self.assertEqual(data['response'], analysis)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('problem_text', ctx.captured_queries[0]['sql'])
+
+    def test_cache_miss_reads_narrow_columns(self):
+        request_obj = make_request(status='completed', category='labor', summary='Итог')
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/check-analysis/{request_obj.id}/').json()
+        self.assertEqual((data['status'], data['has_response']), ('completed', False))
+        self.assertNotIn('problem_text', ctx.captured_queries[0]['sql'])
+        self.assertEqual(self.client.get('/api/check-analysis/999999/').status_code, 404)
+
+    def test_pending_status_expires_quickly(self):
+        # Без общего кэша другой процесс должен вскоре увидеть завершение анализа
+        request_obj = make_request(status='analyzing')
+        with mock.patch('lexy.status.cache') as status_cache:
+            status_cache.get.return_value = None
+            get_request_status(request_obj.id)
+            self.assertEqual(status_cache.add.call_args.args[2], PENDING_STATUS_CACHE_TIMEOUT)
+
+            EmergencyRequest.objects.filter(pk=request_obj.pk).update(status='completed')
+            get_request_status(request_obj.id)
+            self.assertEqual(status_cache.add.call_args.args[2], STATUS_CACHE_TIMEOUT)
+
+    def test_shared_cache_keeps_pending_status(self):
+        # Общий кэш получает каждую смену статуса, короткий срок ему не нужен
+        request_obj = make_request(status='analyzing')
+        with mock.patch('lexy.status.PROCESS_LOCAL_BACKENDS', ()), mock.patch('lexy.status.cache') as status_cache:
+            status_cache.get.return_value = None
+            get_request_status(request_obj.id)
+        self.assertEqual(status_cache.add.call_args.args[2], STATUS_CACHE_TIMEOUT)
+
+    def test_cache_miss_does_not_overwrite_worker_status(self):
+        request_obj = make_request(status='analyzing')
+        key = get_status_cache_key(request_obj.id)
+        real_get = cache.get
+
+        def get_then_worker_finishes(*args, **kwargs):
+            value = real_get(*args, **kwargs)
+            request_obj.status = 'completed'
+            cache_request_status(request_obj)
+            return value
+
+        with mock.patch.object(cache, 'get', side_effect=get_then_worker_finishes):
+            get_request_status(request_obj.id)
+        self.assertEqual(cache.get(key)['status'], 'completed')
+
+
+class RetentionTest(TestCase):
+    """Сроки хранения: обезличивание и удаление просроченных данных"""
+
+    policy = {'anonymize': 30, 'closed_chats': 90, 'requests': 365}
+
+    def setUp(self):
+        self.lawyer = make_lawyer()
+        self.fresh = make_request(ip_address='10.0.0.1', user_agent='Mozilla', session_key='fresh')
+        self.stale = self.make_aged_request(days=40)
+        self.expired = self.make_aged_request(days=400)
+
+        self.closed_chat = LawyerChat.objects.create(
+            request=self.stale, lawyer=self.lawyer, status='closed',
+            archived_at=timezone.now() - timedelta(days=100)
+        )
+        ChatMessage.objects.create(chat=self.closed_chat, sender='client', message='Старый вопрос')
+        self.open_chat = LawyerChat.objects.create(
+            request=self.stale, lawyer=self.lawyer, client_name='Иван', client_email='ivan@example.com'
+        )
+        LawyerChat.objects.filter(pk=self.open_chat.pk).update(created_at=timezone.now() - timedelta(days=40))
+        expired_chat = LawyerChat.objects.create(request=self.expired, lawyer=self.lawyer)
+        ChatMessage.objects.create(chat=expired_chat, sender='client', message='Очень старый вопрос')
+
+    def make_aged_request(self, days):
+        request_obj = make_request(ip_address='10.0.0.2', user_agent='Mozilla', session_key=f'aged{days}')
+        EmergencyRequest.objects.filter(pk=request_obj.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return request_obj
+
+    def run_rules(self, batch_size=1):
+        return {rule.name: apply_rule(rule, batch_size) for rule in get_retention_rules(self.policy)}
+
+    def test_expired_data_is_deleted_and_stale_data_anonymized(self):
+        report = self.run_rules()
+
+        self.assertFalse(EmergencyRequest.objects.filter(pk=self.expired.pk).exists())
+        self.assertFalse(LawyerChat.objects.filter(pk=self.closed_chat.pk).exists())
+        self.assertEqual(ChatMessage.objects.count(), 0)
+        self.assertEqual(report['requests'], 1)
+
+        stale = EmergencyRequest.objects.get(pk=self.stale.pk)
+        self.assertEqual((stale.ip_address, stale.user_agent, stale.session_key), (None, '', ''))
+        self.assertEqual(LawyerChat.objects.get(pk=self.open_chat.pk).client_email, '')
+        fresh = EmergencyRequest.objects.get(pk=self.fresh.pk)
+        self.assertEqual(fresh.ip_address, '10.0.0.1')
+
+    def test_second_run_has_nothing_to_do(self):
+        self.run_rules()
+        self.assertEqual(sum(self.run_rules(batch_size=100).values()), 0)
+
+    def test_disabled_rules(self):
+        self.assertEqual(get_retention_rules({'anonymize': 0, 'closed_chats': 0, 'requests': 0}), [])
+
+
+class FullTextSearchTest(AdminTestCase):
+    """Поиск в админке по полнотекстовому индексу"""
+
+    def search(self, url, term):
+        response = self.client.get(url, {'q': term})
+        return {obj.pk for obj in response.context['cl'].result_list}
+
+    def test_request_search_handles_word_forms(self):
+        salary = make_request("Работодатель задерживает зарплату уже третий месяц")
+        make_request("Попал в ДТП, виновник скрылся с места аварии")
+
+        self.assertEqual(self.search('/admin/lexy/emergencyrequest/', 'зарплаты'), {salary.pk})
+        self.assertEqual(stem_russian('зарплату'), stem_russian('зарплата'))
+
+    def test_index_follows_updates_and_deletes(self):
+        request_obj = make_request("Соседи затопили квартиру, управляющая компания не отвечает")
+        url = '/admin/lexy/emergencyrequest/'
+        self.assertEqual(self.search(url, 'квартира'), {request_obj.pk})
+
+        request_obj.problem_text = "Не вернули залог за аренду жилья, хозяин не выходит на связь"
+        request_obj.save()
+        self.assertEqual(self.search(url, 'квартира'), set())
+        self.assertEqual(self.search(url, 'залог'), {request_obj.pk})
+
+        request_obj.delete()
+        self.assertEqual(self.search(url, 'залог'), set())
+
+    def test_message_search(self):
+        chat = LawyerChat.objects.create(request=make_request(), lawyer=make_lawyer())
+        message = ChatMessage.objects.create(chat=chat, sender='client', message='Нужна претензия к страховой')
+        ChatMessage.objects.create(chat=chat, sender='lawyer', message='Пришлите документы')
+
+        self.assertEqual(self.search('/admin/lexy/chatmessage/', 'претензию'), {message.pk})
+
+    def test_search_fields_are_indexed(self):
+        failed = make_request(status='failed', error_message='Превышено время ожидания ассистента')
+        self.assertEqual(self.search('/admin/lexy/emergencyrequest/', 'Превышено'), {failed.pk})
+
+        for label, index in SEARCH_INDEXES.items():
+            model_admin = admin.site._registry[apps.get_model(label)]
+            self.assertLessEqual(set(model_admin.search_fields), set(index.columns), label)
+
+    def test_search_uses_fulltext_table(self):
+        for model, index in ((EmergencyRequest, 'lexy_request_fts'), (ChatMessage, 'lexy_message_fts')):
+            model_admin = admin.site._registry[model]
+            request = RequestFactory().get('/', {'q': 'зарплата'})
+            request.user = self.admin_user
+            queryset, _ = model_admin.get_search_results(request, model_admin.get_queryset(request), 'зарплата')
+            plan = queryset.explain()
+            self.assertIn(index, plan)
+            self.assertNotIn(f'SCAN {model._meta.db_table}', plan)
+
+    def test_lost_triggers_are_restored(self):
+        index = SEARCH_INDEXES['lexy.EmergencyRequest']
+        with connection.cursor() as cursor:
+            for sql in index.drop_sql('sqlite')[:3]:
+                cursor.execute(sql)
+        request_obj = make_request("Банк списал деньги с карты без моего согласия")
+
+        repair_search_indexes()
+        self.assertEqual(self.search('/admin/lexy/emergencyrequest/', 'банк'), {request_obj.pk})
+
+
+class AnalysisReuseTest(TestCase):
+    """Ответ на почти такую же заявку берется без повторного анализа"""
+
+    text = "Работодатель задерживает зарплату уже третий месяц, на письма не отвечает. Что делать?"
+    analysis = {'analysis': {'category': 'labor', 'urgency': 'high', 'confidence': 0.9, 'summary': 'Задержка зарплаты'}}
+
+    def setUp(self):
+        cache.clear()
+        self.source = make_request(self.text)
+        self.analyze(self.source)
+
+    def analyze(self, request_obj):
+        with mock.patch('lexy.views.analyze_with_assistant', return_value=self.analysis) as analyze:
+            views.analyze_with_yandex_assistant(request_obj.id, request_obj.problem_text)
+        request_obj.refresh_from_db()
+        return analyze.called
+
+    def test_near_duplicate_reuses_analysis(self):
+        duplicate = make_request("работодатель задерживает зарплату уже третий месяц,  на письма не отвечает! что делать")
+        self.assertLessEqual(hamming_distance(simhash(duplicate.problem_text), simhash(self.text)), 12)
+        self.assertGreaterEqual(similarity(duplicate.problem_text, self.text), 0.9)
+
+        self.assertFalse(self.analyze(duplicate))
+        self.assertEqual(duplicate.reused_from, self.source)
+        self.assertEqual(duplicate.ai_response, self.analysis)
+        self.assertEqual((duplicate.status, duplicate.category), ('completed', 'labor'))
+        self.assertEqual(get_reuse_stats(), {'total': 2, 'reused': 1, 'hit_rate': 0.5})
+
+    def test_different_text_is_analyzed(self):
+        other = make_request("Попал в ДТП, виновник скрылся с места аварии, страховая отказывает в выплате")
+        self.assertTrue(self.analyze(other))
+        self.assertIsNone(other.reused_from)
+
+    def test_excluded_category_and_disabled_reuse(self):
+        options = {**settings.ANALYSIS_REUSE, 'excluded_categories': ['labor']}
+        with self.settings(ANALYSIS_REUSE=options):
+            self.assertTrue(self.analyze(make_request(self.text)))
+
+        with self.settings(ANALYSIS_REUSE={**settings.ANALYSIS_REUSE, 'enabled': False}):
+            self.assertTrue(self.analyze(make_request(self.text)))
+
+    def test_failed_analysis_is_not_reused(self):
+        EmergencyRequest.objects.filter(pk=self.source.pk).update(ai_response={'error': 'Ассистент не ответил'})
+        self.assertTrue(self.analyze(make_request(self.text)))
+
+
+class IdempotencyTest(TestCase):
+    """Повтор submit_request и send_message не создает дубликатов"""
+
+    problem = {'problem_text': 'Работодатель задерживает зарплату уже третий месяц'}
+
+    def setUp(self):
+        cache.clear()
+        self.chat = LawyerChat.objects.create(request=make_request(), lawyer=make_lawyer())
+
+    def post(self, url, data, **headers):
+        return self.client.post(url, json.dumps(data), content_type='application/json', **headers)
+
+    def test_submit_with_key_is_replayed(self):
+        with mock.patch('lexy.views.scheduler.submit') as submit:
+            first = self.post('/submit-request/', self.problem, HTTP_IDEMPOTENCY_KEY='abc')
+            with self.assertNumQueries(0):
+                second = self.post('/submit-request/', self.problem, HTTP_IDEMPOTENCY_KEY='abc')
+            third = self.post('/submit-request/', self.problem, HTTP_IDEMPOTENCY_KEY='def')
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertNotEqual(first.json()['request_id'], third.json()['request_id'])
+        self.assertEqual(submit.call_count, 2)
+
+    def test_send_message_retry_without_key(self):
+        reply = {'message': 'Понимаю, давайте разберемся'}
+        with mock.patch('lexy.views.chat_with_lawyer', return_value=reply) as chat_with_lawyer:
+            url = f'/api/send-message/{self.chat.id}/'
+            first = self.post(url, {'message': 'Что делать?'})
+            second = self.post(url, {'message': 'Что делать?'})
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(chat_with_lawyer.call_count, 1)
+        self.assertEqual(self.chat.messages.count(), 2)
+
+        with self.settings(IDEMPOTENCY={**settings.IDEMPOTENCY, 'content_ttl': 0}):
+            cache.clear()
+            with mock.patch('lexy.views.chat_with_lawyer', return_value=reply):
+                self.post(url, {'message': 'Что делать?'})
+        self.assertEqual(self.chat.messages.count(), 4)
+
+    def test_new_key_per_submit_defeats_dedup(self):
+        # Клиент, создающий новый ключ на каждую отправку, при повторе того же
+        # текста снова вызывает ИИ: с заголовком проверка по хэшу тела не работает.
+        # Поэтому страницы создают ключ один раз на сообщение
+        reply = {'message': 'Понимаю, давайте разберемся'}
+        url = f'/api/send-message/{self.chat.id}/'
+        with mock.patch('lexy.views.chat_with_lawyer', return_value=reply) as chat_with_lawyer:
+            self.post(url, {'message': 'Что делать?'}, HTTP_IDEMPOTENCY_KEY='first')
+            self.post(url, {'message': 'Что делать?'}, HTTP_IDEMPOTENCY_KEY='second')
+            self.assertEqual(chat_with_lawyer.call_count, 2)
+
+            retry = self.post(url, {'message': 'Что делать?'}, HTTP_IDEMPOTENCY_KEY='second')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(chat_with_lawyer.call_count, 2)
+
+    def test_retry_during_long_call_does_not_repeat_it(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_view(request):
+            calls.append(request)
+            started.set()
+            release.wait(5)
+            return HttpResponse('{"success": true}', content_type='application/json')
+
+        view = idempotent(slow_view)
+        factory = RequestFactory()
+        # Без заголовка ключ строится по содержимому и живет всего content_ttl секунд
+        make = lambda: factory.post('/', {'message': 'Привет'}, content_type='application/json')
+        first = threading.Thread(target=view, args=(make(),))
+        first.start()
+        started.wait(5)
+        try:
+            # Повтор приходит, когда вызов ИИ идет дольше wait_seconds
+            later = time.time() + settings.IDEMPOTENCY['wait_seconds'] + 5
+            with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later), \
+                    self.settings(IDEMPOTENCY={**settings.IDEMPOTENCY, 'wait_seconds': 0.2}):
+                self.assertEqual(view(make()).status_code, 409)
+        finally:
+            release.set()
+            first.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_request_is_not_replayed(self):
+        url = f'/api/send-message/{self.chat.id}/'
+        with mock.patch('lexy.views.chat_with_lawyer', side_effect=RuntimeError('timeout')):
+            self.assertFalse(self.post(url, {'message': 'Вопрос'}, HTTP_IDEMPOTENCY_KEY='k').json()['success'])
+        with mock.patch('lexy.views.chat_with_lawyer', return_value={'message': 'Ответ'}):
+            self.assertTrue(self.post(url, {'message': 'Вопрос'}, HTTP_IDEMPOTENCY_KEY='k').json()['success'])
+
+
+class RateLimitTest(TestCase):
+    """Лимит частоты запросов к view, вызывающим ИИ"""
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().post('/', REMOTE_ADDR='10.1.1.1')
+
+    @override_settings(RATE_LIMITS={'submit_request': (2, 60)})
+    def test_submit_request_returns_429(self):
+        with mock.patch('lexy.views.scheduler.submit'):
+            for i in range(2):
+                response = self.client.post(
+                    '/submit-request/',
+                    json.dumps({'problem_text': f'Работодатель задерживает зарплату, заявка {i}'}),
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post(
+                '/submit-request/',
+                json.dumps({'problem_text': 'Работодатель задерживает зарплату, заявка 3'}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(EmergencyRequest.objects.count(), 2)
+
+    @override_settings(RATE_LIMITS={'send_message': (10, 60)})
+    def test_sliding_window(self):
+        start = 6000.0
+        for i in range(10):
+            self.assertEqual(check_rate_limit('send_message', self.request, now=start + i), 0)
+        self.assertEqual(check_rate_limit('send_message', self.request, now=start + 30), 30)
+
+        # В середине следующего окна половина прошлых запросов еще учитывается
+        for i in range(5):
+            self.assertEqual(check_rate_limit('send_message', self.request, now=start + 90), 0)
+        self.assertGreater(check_rate_limit('send_message', self.request, now=start + 90), 0)
+
+        other = RequestFactory().post('/', REMOTE_ADDR='10.1.1.2')
+        self.assertEqual(check_rate_limit('send_message', other, now=start + 30), 0)
+
+    def test_parallel_requests_do_not_exceed_limit(self):
+        backend = LocMemCache('lexy-ratelimit-test', {})
+        barrier = threading.Barrier(20)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(hit(backend, 'send_message_10.1.1.1', 5, 60, 6000.0))
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(0), 5)
+
+    @override_settings(RATE_LIMITS={'start_chat': (1, 60)})
+    def test_falls_back_to_local_counters(self):
+        with mock.patch('lexy.ratelimit.cache') as shared:
+            shared.add.side_effect = ConnectionError('redis is down')
+            self.assertEqual(check_rate_limit('start_chat', self.request, now=6000.0), 0)
+            self.assertGreater(check_rate_limit('start_chat', self.request, now=6001.0), 0)
+
+
+@override_settings(ADMISSION={
+    'enabled': True, 'slo_seconds': 60, 'reject_after_seconds': 300, 'concurrency': 2, 'processes': 1,
+    'default_latency_seconds': 20, 'stale_after_seconds': 900,
+})
+class AdmissionControlTest(TestCase):
+    """Прием заявок в зависимости от длины очереди анализа"""
+
+    text = 'Работодатель задерживает зарплату уже третий месяц, что делать?'
+
+    def setUp(self):
+        cache.clear()
+
+    def submit(self):
+        with mock.patch('lexy.views.scheduler.submit') as submit:
+            response = self.client.post(
+                '/submit-request/', json.dumps({'problem_text': self.text}), content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY=str(EmergencyRequest.objects.count())
+            )
+        return response, submit.called
+
+    def add_backlog(self, count):
+        for _ in range(count):
+            make_request(status='analyzing')
+
+    def test_wait_estimate_follows_backlog_and_latency(self):
+        self.assertEqual(estimate_wait(), 20)
+        self.add_backlog(4)
+        self.assertEqual(estimate_wait(), 60)
+
+        record_llm_latency(10)
+        record_llm_latency(20)
+        self.assertEqual(get_llm_latency(), 12)
+        self.assertEqual(estimate_wait(), 36)
+
+    def test_wait_estimate_counts_all_processes(self):
+        self.add_backlog(4)
+        with self.settings(ADMISSION={**settings.ADMISSION, 'processes': 2}):
+            self.assertEqual(estimate_wait(), 40)
+
+    def test_normal_load_is_analyzed(self):
+        response, started = self.submit()
+        self.assertTrue(started)
+        self.assertFalse(response.json()['degraded'])
+
+    def test_long_queue_gets_fast_path(self):
+        self.add_backlog(6)
+        response, started = self.submit()
+
+        self.assertFalse(started)
+        self.assertTrue(response.json()['degraded'])
+        request_obj = EmergencyRequest.objects.get(pk=response.json()['request_id'])
+        self.assertEqual((request_obj.status, request_obj.category), ('completed', 'labor'))
+        self.assertTrue(request_obj.ai_response['fast_path'])
+
+    def test_overload_is_rejected(self):
+        self.add_backlog(30)
+        response, started = self.submit()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreater(int(response['Retry-After']), 300)
+        self.assertFalse(started)
+
+    def test_guess_category(self):
+        self.assertEqual(guess_category('Попал в ДТП, виновник скрылся'), 'dtp')
+        self.assertEqual(guess_category('Муж не платит алименты на ребенка'), 'family')
+        self.assertEqual(guess_category('Просто вопрос'), 'other')
+
+
+class LawyerBusyTest(TestCase):
+    """Чат не держит web-воркер, если ответ юриста не успеет за chat_timeout_seconds"""
+
+    def setUp(self):
+        cache.clear()
+        self.chat = LawyerChat.objects.create(request=make_request(), lawyer=make_lawyer(), lawyer_agent_id='agent')
+        self.url = f'/api/send-message/{self.chat.id}/'
+
+    def send(self):
+        return self.client.post(self.url, json.dumps({'message': 'Что делать?'}), content_type='application/json')
+
+    def test_chat_wait_estimate_follows_queue(self):
+        record_llm_latency(10)
+        workers = settings.LLM_SCHEDULER['workers']
+        self.assertEqual(estimate_chat_wait(0), 10)
+        self.assertEqual(estimate_chat_wait(workers * 3), 40)
+
+    def test_long_queue_fails_fast(self):
+        record_llm_latency(settings.LLM_SCHEDULER['chat_timeout_seconds'])
+        queue_depth = settings.LLM_SCHEDULER['workers']
+        with mock.patch.object(views.scheduler.get_scheduler(), 'queue_depth', return_value=queue_depth), \
+                mock.patch('lexy.views.scheduler.submit') as submit:
+            response = self.send()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(int(response['Retry-After']), 2 * settings.LLM_SCHEDULER['chat_timeout_seconds'])
+        self.assertFalse(submit.called)
+        self.assertFalse(self.chat.messages.exists())
+
+    def test_wait_is_capped_by_timeout(self):
+        record_llm_latency(0.01)
+        future = Future()
+        with self.settings(LLM_SCHEDULER={**settings.LLM_SCHEDULER, 'chat_timeout_seconds': 0.1}), \
+                mock.patch('lexy.views.scheduler.submit', return_value=future):
+            response = self.send()
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(future.cancelled())
+
+
+class PrioritySchedulerTest(SimpleTestCase):
+    """Очередь обращений к ИИ с приоритетом по срочности"""
+
+    def run_jobs(self, scheduler, jobs):
+        """Занять единственный поток, поставить задачи в очередь и вернуть порядок их выполнения"""
+        release = threading.Event()
+        order = []
+        blocker = scheduler.submit(release.wait)
+        futures = [scheduler.submit(order.append, name, urgency=urgency) for name, urgency in jobs]
+        release.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        return order
+
+    def test_critical_jumps_ahead(self):
+        scheduler = PriorityScheduler(workers=1, aging_seconds=60)
+        order = self.run_jobs(scheduler, [('low', 'low'), ('medium', 'medium'), ('critical', 'critical'), ('high', 'high')])
+        self.assertEqual(order, ['critical', 'high', 'medium', 'low'])
+
+    def test_waiting_jobs_are_promoted(self):
+        now = [0.0]
+        scheduler = PriorityScheduler(workers=1, aging_seconds=10, clock=lambda: now[0])
+        release = threading.Event()
+        order = []
+        blocker = scheduler.submit(release.wait)
+        old_low = scheduler.submit(order.append, 'low', urgency='low')
+        now[0] = 25.0
+        new_high = scheduler.submit(order.append, 'high', urgency='high')
+        release.set()
+        for future in (blocker, old_low, new_high):
+            future.result(timeout=5)
+        # Низкий приоритет, прождавший 25 с, поднялся выше только что пришедшего высокого
+        self.assertEqual(order, ['low', 'high'])
+
+    def test_errors_are_returned_to_caller(self):
+        scheduler = PriorityScheduler(workers=1, aging_seconds=10)
+        future = scheduler.submit(int, 'not a number')
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+
+    def test_guess_urgency(self):
+        self.assertEqual(guess_urgency('Сына задержали сотрудники полиции, что делать?'), 'critical')
+        self.assertEqual(guess_urgency('Пришла повестка в суд на следующей неделе'), 'high')
+        self.assertEqual(guess_urgency('Подскажите, как оформить наследство'), 'low')
+        self.assertEqual(guess_urgency('Работодатель задерживает зарплату'), 'medium')
+
+
+class StartupImportTest(SimpleTestCase):
+    """Клиент Yandex AI не создается при запуске Django"""
+
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   json.decoder\n"
+            "import time:       300 |        420 | json\n"
+        )
+        self.assertEqual(parse_importtime(output), {'json.decoder': (120, 1), 'json': (420, 0)})
+
+    def test_check_does_not_import_openai(self):
+        modules, total = measure_startup('check')
+        self.assertIn('lexy.views', modules)
+        self.assertNotIn('openai', modules)
+
+    def test_time_budget_is_optional(self):
+        out = io.StringIO()
+        call_command('check_import_time', 'check', stdout=out)
+        self.assertIn('бюджет не задан', out.getvalue())
+
+        with self.settings(IMPORT_TIME_BUDGETS_MS={'check': 1}), self.assertRaisesMessage(CommandError, '> 1 мс'):
+            call_command('check_import_time', 'check', stdout=io.StringIO())
+
+    def test_client_is_created_on_first_use(self):
+        from . import yandex_utils
+
+        fake = mock.Mock()
+        yandex_utils.set_yandex_client(fake)
+        try:
+            fake.responses.create.return_value.output_text = '{"analysis": {"category": "labor"}}'
+            self.assertEqual(yandex_utils.analyze_with_assistant('agent', 'текст'), {'analysis': {'category': 'labor'}})
+        finally:
+            yandex_utils.set_yandex_client(None)
+
+
+class FakeLLMBackendTest(SimpleTestCase):
+    """Локальная заглушка ИИ отвечает в форматах анализатора и юристов"""
+
+    def setUp(self):
+        from . import yandex_utils
+
+        self.yandex_utils = yandex_utils
+        yandex_utils.set_yandex_client(FakeLLMClient(seed=1))
+        self.addCleanup(yandex_utils.set_yandex_client, None)
+
+    def test_tests_use_fake_backend(self):
+        self.yandex_utils.set_yandex_client(None)
+        self.assertIsInstance(self.yandex_utils.get_yandex_client(), FakeLLMClient)
+
+    def test_real_backend_needs_key_from_environment(self):
+        self.assertEqual(settings.LLM_BACKEND['api_key'], os.environ.get('YANDEX_CLOUD_API_KEY', ''))
+        with self.assertRaises(ImproperlyConfigured):
+            self.yandex_utils.create_llm_client({**settings.LLM_BACKEND, 'backend': 'yandex', 'api_key': ''})
+
+    def test_analyzer_and_lawyer_formats(self):
+        agents = self.yandex_utils.AGENTS
+        analysis = self.yandex_utils.analyze_with_assistant(agents['general']['id'], 'Попал в ДТП, виновник скрылся')
+        self.assertEqual(analysis['analysis']['category'], 'dtp')
+        self.assertEqual(analysis['lawyer_match']['specialization'], 'auto')
+
+        lawyer = agents['lawyers']['labor']
+        reply = self.yandex_utils.chat_with_lawyer(lawyer['id'], [{'role': 'user', 'content': 'Меня уволили'}], 1)
+        self.assertEqual(reply['lawyer_name'], lawyer['name'])
+        self.assertTrue(reply['questions_to_client'])
+
+        self.assertEqual(self.yandex_utils.determine_lawyer_specialization('Муж не платит алименты'), 'family')
+
+    def test_error_rate(self):
+        llm = FakeLLM(error_rate=1.0)
+        with self.assertRaises(FakeLLMError):
+            llm.respond(prompt={'id': 'agent'}, input='текст')
+
+    def test_latency_distribution(self):
+        llm = FakeLLM(latency_ms=800, latency_sigma=0.5, seed=1)
+        delays = sorted(llm.delay() for _ in range(1001))
+        self.assertAlmostEqual(delays[500], 0.8, delta=0.1)
+
+    def test_http_server_with_openai_client(self):
+        import openai
+
+        server = FakeLLMServer(('127.0.0.1', 0), FakeLLM(seed=1))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = openai.OpenAI(api_key='test', base_url=f'http://127.0.0.1:{server.server_port}/v1', max_retries=0)
+        self.assertTrue(client.conversations.create().id.startswith('conv_'))
+        response = client.responses.create(
+            prompt={'id': self.yandex_utils.AGENTS['general']['id']}, input='Работодатель не платит зарплату'
+        )
+        self.assertEqual(json.loads(response.output_text)['analysis']['category'], 'labor')
+
+        server.llm.error_rate = 1.0
+        with self.assertRaises(openai.InternalServerError):
+            client.responses.create(prompt={'id': 'agent'}, input='текст')
+
+
+class FunnelBenchmarkTest(SimpleTestCase):
+    """Нагрузочный тест воронки: перцентили и сравнение с базовым прогоном"""
+
+    def report(self, p95_ms=10.0, queries=5.0, errors=0, funnels_per_second=10.0):
+        step = {'calls': 20, 'errors': errors, 'p50_ms': 5.0, 'p95_ms': p95_ms, 'p99_ms': p95_ms, 'queries': queries}
+        return {'funnels_per_second': funnels_per_second, 'steps': {'send_message': step}}
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_compare_with_baseline(self):
+        baseline = self.report()
+        self.assertEqual(compare_with_baseline(self.report(p95_ms=30.0, queries=5.4), baseline, 0.25), [])
+        slower = self.report(p95_ms=100.0, queries=7.0, errors=10, funnels_per_second=5.0)
+        # Задержки зависят от машины и по умолчанию не сравниваются
+        self.assertEqual(len(compare_with_baseline(slower, baseline, 0.25)), 2)
+        self.assertEqual(len(compare_with_baseline(slower, baseline, 0.25, check_latency=True)), 4)
+        self.assertEqual(compare_with_baseline(self.report(p95_ms=100.0), baseline, 0.25), [])
+        # Без ошибок в базовом прогоне недопустима даже одна
+        self.assertEqual(len(compare_with_baseline(self.report(errors=1), baseline, 0.25)), 1)
+
+    def bench(self, *args):
+        """Прогон в отдельном процессе: команда подменяет базу на временную"""
+        return subprocess.run(
+            [sys.executable, 'manage.py', 'bench_funnel', '--clients', '1', '--funnels', '2', '--latency-ms', '0', *args],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = Path(tmp) / 'baseline.json'
+            result = self.bench('--messages', '1', '--baseline', str(baseline), '--save-baseline')
+            self.assertEqual(result.returncode, 0, result.stderr)
+            report = json.loads(baseline.read_text(encoding='utf-8'))
+
+            self.assertEqual(report['funnels'], 2)
+            self.assertEqual(report['steps']['submit_request']['calls'], 2)
+            self.assertEqual(report['steps']['send_message']['calls'], 2)
+            self.assertGreater(report['steps']['auto_start_chat']['queries'], 0)
+
+            # С другими параметрами сравнивать с базовым прогоном нельзя
+            result = self.bench('--messages', '2', '--baseline', str(baseline))
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn('не совпадают', result.stderr)
+
+
+class LLMRecordReplayTest(SimpleTestCase):
+    """Записанные обращения к ИИ воспроизводятся без сети"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / 'llm' / 'fixture.jsonl'
+
+    def test_record_and_replay(self):
+        recorder = RecordingLLMClient(FakeLLMClient(seed=1), self.path)
+        conversation = recorder.conversations.create()
+        first = recorder.responses.create(prompt={'id': 'agent'}, conversation=conversation.id, input='Вопрос')
+        second = recorder.responses.create(prompt={'id': 'agent'}, conversation=conversation.id, input='Вопрос')
+        entries = [json.loads(line) for line in self.path.read_text(encoding='utf-8').splitlines()]
+        self.assertEqual([entry['method'] for entry in entries], ['conversations.create', 'responses.create', 'responses.create'])
+        self.assertEqual(entries[1]['response']['output_text'], first.output_text)
+
+        replay = ReplayLLMClient(self.path, latency_scale=0)
+        self.assertEqual(replay.conversations.create().id, conversation.id)
+        # id conversation в новом прогоне другой, одинаковые запросы получают ответы по очереди
+        self.assertEqual(replay.responses.create(prompt={'id': 'agent'}, conversation='other', input='Вопрос').id, first.id)
+        self.assertEqual(replay.responses.create(prompt={'id': 'agent'}, input='Вопрос').id, second.id)
+        self.assertEqual(replay.responses.create(prompt={'id': 'agent'}, input='Вопрос').id, second.id)
+
+        with self.assertRaises(FixtureMissError):
+            replay.responses.create(prompt={'id': 'agent'}, input='Другой вопрос')
+        self.assertEqual(replay.misses, 1)
+
+    def test_errors_are_replayed(self):
+        recorder = RecordingLLMClient(FakeLLMClient(error_rate=1.0), self.path)
+        with self.assertRaises(FakeLLMError):
+            recorder.responses.create(prompt={'id': 'agent'}, input='Вопрос')
+
+        replay = ReplayLLMClient(self.path, latency_scale=0)
+        with self.assertRaisesMessage(RuntimeError, 'FakeLLMError'):
+            replay.responses.create(prompt={'id': 'agent'}, input='Вопрос')
+
+    def test_backend_settings(self):
+        from .yandex_utils import create_llm_client
+
+        options = {**settings.LLM_BACKEND, 'backend': 'fake', 'record_to': str(self.path)}
+        client = create_llm_client(options)
+        self.assertIsInstance(client, RecordingLLMClient)
+        client.conversations.create()
+
+        replay = create_llm_client({**options, 'backend': 'replay', 'replay_from': str(self.path), 'record_to': ''})
+        self.assertIsInstance(replay, ReplayLLMClient)
+        self.assertTrue(replay.conversations.create().id.startswith('conv_'))
+
+
+@override_settings(METRICS={**settings.METRICS, 'token': 'secret'})
+class LLMMetricsTest(TestCase):
+    """Метрики обращений к ИИ и их выдача для Prometheus"""
+
+    def setUp(self):
+        from . import yandex_utils
+
+        cache.clear()
+        caches['metrics'].clear()
+        self.yandex_utils = yandex_utils
+        yandex_utils.set_yandex_client(FakeLLMClient(seed=1))
+        self.addCleanup(yandex_utils.set_yandex_client, None)
+
+    def scrape(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer secret')
+        return self.client.get('/metrics', SERVER_NAME='localhost', **headers)
+
+    def test_calls_tokens_and_latency(self):
+        general = self.yandex_utils.AGENTS['general']['id']
+        self.yandex_utils.analyze_with_assistant(general, 'Работодатель не платит зарплату третий месяц')
+        self.yandex_utils.analyze_with_assistant(general, 'Попал в ДТП, виновник скрылся')
+
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        labels = f'call="analyze",agent="{general}"'
+        self.assertIn(f'lexy_llm_calls_total{{{labels},outcome="success"}} 2', body)
+        self.assertIn(f'lexy_llm_call_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'lexy_llm_call_duration_seconds_count{{{labels}}} 2', body)
+        self.assertRegex(body, rf'lexy_llm_tokens_total\{{{labels},kind="output"\}} \d+')
+        self.assertIn('lexy_analysis_backlog 0', body)
+        self.assertIn('# TYPE lexy_llm_call_duration_seconds histogram', body)
+
+    def test_errors_fallbacks_and_parse_failures(self):
+        lawyer = self.yandex_utils.AGENTS['lawyers']['labor']['id']
+        client = mock.Mock()
+        client.conversations.create.side_effect = RuntimeError('нет сети')
+        client.responses.create.return_value = mock.Mock(output_text='Просто текст', usage=None)
+        self.yandex_utils.set_yandex_client(client)
+
+        reply = self.yandex_utils.chat_with_lawyer(lawyer, [{'role': 'user', 'content': 'Меня уволили'}], 7)
+        self.assertEqual(reply['message'], 'Просто текст')
+
+        body = self.scrape().content.decode()
+        self.assertIn('lexy_llm_calls_total{call="conversation",agent="other",outcome="error"} 1', body)
+        self.assertIn(f'lexy_llm_fallbacks_total{{call="chat",agent="{lawyer}",reason="no_conversation"}} 1', body)
+        self.assertIn(f'lexy_llm_parse_failures_total{{call="chat_fallback",agent="{lawyer}"}} 1', body)
+        self.assertIn(f'lexy_llm_calls_total{{call="chat_fallback",agent="{lawyer}",outcome="success"}} 1', body)
+
+    def test_analysis_and_specialization_fallbacks(self):
+        general = self.yandex_utils.AGENTS['general']['id']
+        client = mock.Mock()
+        client.responses.create.side_effect = RuntimeError('нет сети')
+        self.yandex_utils.set_yandex_client(client)
+        self.assertIn('error', self.yandex_utils.analyze_with_assistant(general, 'Работодатель не платит зарплату'))
+
+        client.responses.create.side_effect = None
+        client.responses.create.return_value = mock.Mock(output_text='', usage=None)
+        self.assertEqual(self.yandex_utils.determine_lawyer_specialization('Меня уволили'), 'civil')
+
+        body = self.scrape().content.decode()
+        self.assertIn(f'lexy_llm_fallbacks_total{{call="analyze",agent="{general}",reason="error"}} 1', body)
+        self.assertIn(
+            'lexy_llm_fallbacks_total{call="specialization",agent="yandexgpt",reason="empty_response"} 1', body
+        )
+
+    def test_overloaded_submit_counts_fallback(self):
+        general = self.yandex_utils.AGENTS['general']['id']
+        with mock.patch('lexy.views.admit', return_value=(FAST_PATH, 120)):
+            response = self.client.post(
+                '/submit-request/', json.dumps({'problem_text': 'Работодатель задерживает зарплату третий месяц'}),
+                content_type='application/json'
+            )
+        self.assertTrue(response.json()['degraded'])
+        body = self.scrape().content.decode()
+        self.assertIn(f'lexy_llm_fallbacks_total{{call="analyze",agent="{general}",reason="overload"}} 1', body)
+
+    def test_unknown_agents_share_one_label(self):
+        self.yandex_utils.analyze_with_assistant('agent-1', 'текст')
+        self.yandex_utils.analyze_with_assistant('agent-2', 'текст')
+        self.assertIn('lexy_llm_calls_total{call="analyze",agent="other",outcome="success"} 2', self.scrape().content.decode())
+
+    def test_token(self):
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='').status_code, 403)
+        self.assertEqual(self.scrape().status_code, 200)
+
+        with override_settings(METRICS={**settings.METRICS, 'token': ''}):
+            self.assertEqual(self.scrape().status_code, 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.scrape().status_code, 200)
+
+    def test_counters_survive_default_cache_clear(self):
+        self.yandex_utils.analyze_with_assistant('agent-1', 'текст')
+        cache.clear()
+        self.assertIn('lexy_llm_calls_total{call="analyze",agent="other",outcome="success"} 1', self.scrape().content.decode())
+
+    def test_deploy_check_requires_shared_cache_and_token(self):
+        with override_settings(METRICS={**settings.METRICS, 'token': ''}):
+            errors = check_metrics_settings(None)
+        self.assertEqual({error.id for error in errors}, {'lexy.E001', 'lexy.E002'})
+
+        redis = {**settings.CACHES, 'metrics': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_metrics_settings(None), [])
+
+
+class TracingTest(TestCase):
+    """Спаны view, БД, кэша, ИИ и фоновых задач в локальном файле OTLP/JSON"""
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / 'spans.jsonl'
+        tracing_settings = self.settings(TRACING={**settings.TRACING, 'enabled': True, 'path': str(self.path)})
+        tracing_settings.enable()
+        self.addCleanup(tracing_settings.disable)
+
+    def spans(self):
+        if not self.path.exists():
+            return []
+        return [span for spans in load_traces(self.path).values() for span in spans]
+
+    def test_view_span_with_queries(self):
+        request_obj = make_request()
+        response = Client(SERVER_NAME='localhost').get(
+            f'/api/check-analysis/{request_obj.id}/',
+            HTTP_TRACEPARENT='00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        )
+        self.assertEqual(response['X-Trace-Id'], '0af7651916cd43dd8448eb211c80319c')
+
+        spans = {span['name']: span for span in self.spans()}
+        view = spans['GET /api/check-analysis/<int:request_id>/']
+        self.assertEqual(view['parentSpanId'], 'b7ad6b7169203331')
+        self.assertIn({'key': 'http.status_code', 'value': {'intValue': '200'}}, view['attributes'])
+        self.assertEqual(spans['db SELECT']['parentSpanId'], view['spanId'])
+
+    def test_not_sampled_and_outside_trace(self):
+        request_obj = make_request()
+        response = Client(SERVER_NAME='localhost').get(
+            f'/api/check-analysis/{request_obj.id}/',
+            HTTP_TRACEPARENT='00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00'
+        )
+        self.assertNotIn('X-Trace-Id', response)
+        self.assertEqual(self.spans(), [])
+
+    def test_cache_llm_and_background_task(self):
+        traced_cache = TracedCache('', {'TRACED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        scheduler = PriorityScheduler(workers=1, aging_seconds=10)
+
+        def task():
+            with track_llm_call('analyze', 'agent'):
+                return traced_cache.get('missing')
+
+        with start_trace('POST /submit-request/') as root:
+            traced_cache.set('key', 1)
+            self.assertIsNone(scheduler.submit(task).result(timeout=5))
+        traced_cache.get('key')
+
+        spans = {span['name']: span for span in self.spans()}
+        self.assertEqual(set(spans), {'POST /submit-request/', 'cache set', 'task task', 'llm analyze', 'cache get'})
+        self.assertEqual({span['traceId'] for span in spans.values()}, {root.trace_id})
+        self.assertEqual(spans['task task']['parentSpanId'], root.span_id)
+        self.assertEqual(spans['llm analyze']['parentSpanId'], spans['task task']['spanId'])
+        self.assertIn({'key': 'cache.hit', 'value': {'boolValue': False}}, spans['cache get']['attributes'])
+
+    def test_errors_and_report(self):
+        with self.assertRaises(RuntimeError), start_trace('GET /chat/<int:chat_id>/'):
+            with start_span('llm chat', kind='client'):
+                raise RuntimeError('timeout')
+
+        self.assertEqual({span['status']['code'] for span in self.spans()}, {2})
+        out = io.StringIO()
+        call_command('trace_report', '--path', str(self.path), stdout=out)
+        self.assertIn('llm chat ОШИБКА', out.getvalue())
@@ -0,0 +1,267 @@
+# lexy/tracing.py
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.module_loading import import_string
+
+# Трассировка запросов без внешних сервисов (TRACING в settings).
+# Спаны: view (TracingMiddleware), запросы к БД (trace_queries, execute_wrapper
+# каждого соединения), операции кэша (TracedCache), вызовы ИИ (metrics.track_llm_call)
+# и фоновые задачи очереди ИИ (scheduler), которые продолжают трассу view.
+# Спаны создаются только внутри трассы; выборка решается один раз в ее начале.
+# Законченные спаны пишутся в TRACING['path'] строками JSON в формате
+# OTLP/JSON (ExportTraceServiceRequest) - его читают OpenTelemetry Collector
+# (приемник otlpjsonfile) и manage.py trace_report.
+# Спаны одного процесса и потока копятся у локального корня (view или задача)
+# и выгружаются одной строкой, когда корень заканчивается.
+
+SPAN_KINDS = {
+    'internal': 1,
+    'server': 2,
+    'client': 3,
+}
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = ContextVar('lexy_current_span', default=None)
+_export_lock = threading.Lock()
+
+# Значение по умолчанию для start_span(parent=...): взять текущий спан
+CURRENT = object()
+
+
+class Span:
+    def __init__(self, name, kind, trace_id, parent_id, root, attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        # Локальный корень копит законченные спаны своей части трассы
+        self.root = root or self
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.status_message = ''
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        if self.root is self:
+            self.finished = []
+            self._lock = threading.Lock()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = f'{type(error).__name__}: {error}'
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+        with self.root._lock:
+            self.root.finished.append(self)
+        if self.root is self:
+            export_spans(self.finished)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS[self.kind],
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.status_message},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def current_span():
+    return _current_span.get()
+
+
+def export_spans(spans):
+    """Строка OTLP/JSON со спанами в файл TRACING['path']"""
+    path = Path(settings.TRACING['path'])
+    payload = {
+        'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': settings.TRACING['service_name']}},
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'lexy.tracing'},
+                'spans': [span.to_otlp() for span in spans],
+            }],
+        }],
+    }
+    line = json.dumps(payload, ensure_ascii=False) + '\n'
+    with _export_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('a', encoding='utf-8') as f:
+            f.write(line)
+
+
+@contextmanager
+def activate(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        if span is not None:
+            span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        if span is not None:
+            span.finish()
+
+
+@contextmanager
+def start_span(name, kind='internal', attributes=None, parent=CURRENT, root=False):
+    """
+    Спан внутри текущей трассы; вне трассы ничего не записывается (yield None).
+    root=True - спан продолжает трассу parent, но выгружается отдельно (фоновая задача).
+    """
+    if parent is CURRENT:
+        parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, kind, parent.trace_id, parent.span_id, None if root else parent.root, attributes)
+    with activate(span):
+        yield span
+
+
+@contextmanager
+def start_trace(name, kind='server', attributes=None, traceparent=None):
+    """Начало трассы (или продолжение входящей по заголовку traceparent) с учетом выборки"""
+    match = TRACEPARENT_RE.match(traceparent or '')
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        sampled = int(flags, 16) & 1
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = random.random() < settings.TRACING['sample_rate']
+    if not sampled:
+        yield None
+        return
+    with activate(Span(name, kind, trace_id, parent_id, None, attributes)) as span:
+        yield span
+
+
+class TracingMiddleware:
+    """Спан на каждый запрос к view; id трассы возвращается в заголовке X-Trace-Id"""
+
+    def __init__(self, get_response):
+        if not settings.TRACING['enabled']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        attributes = {'http.method': request.method, 'http.target': request.path}
+        with start_trace(request.method, attributes=attributes, traceparent=request.headers.get('traceparent')) as span:
+            response = self.get_response(request)
+            if span is not None:
+                match = request.resolver_match
+                if match is not None:
+                    span.name = f'{request.method} /{match.route}'
+                    span.set_attribute('http.route', f'/{match.route}')
+                    span.set_attribute('lexy.view', match.view_name or '')
+                span.set_attribute('http.status_code', response.status_code)
+                if response.status_code >= 500:
+                    span.status = STATUS_ERROR
+                response['X-Trace-Id'] = span.trace_id
+        return response
+
+
+def trace_queries(execute, sql, params, many, context):
+    """execute_wrapper: спан на каждый запрос или пакет запросов (executemany) к БД"""
+    if _current_span.get() is None:
+        return execute(sql, params, many, context)
+
+    connection = context['connection']
+    attributes = {'db.system': connection.vendor, 'db.alias': connection.alias}
+    if settings.TRACING['db_statements']:
+        attributes['db.statement'] = sql[:1000]
+    if many and hasattr(params, '__len__'):
+        attributes['db.batch_size'] = len(params)
+    operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'QUERY'
+    with start_span(f'db {operation}', kind='client', attributes=attributes):
+        return execute(sql, params, many, context)
+
+
+def install_query_tracing(sender, connection, **kwargs):
+    """Сигнал connection_created: вне трассы обертка сразу передает запрос дальше"""
+    if trace_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_queries)
+
+
+# Операции кэша, для которых пишутся спаны
+CACHE_OPERATIONS = (
+    'add', 'get', 'set', 'touch', 'delete', 'get_many', 'get_or_set', 'has_key',
+    'incr', 'decr', 'set_many', 'delete_many', 'clear',
+)
+
+
+class TracedCache:
+    """
+    Кэш-обертка со спанами операций; настоящий backend задается в TRACED_BACKEND.
+    Остальные атрибуты и методы передаются backend без изменений.
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        self._cache = import_string(params.pop('TRACED_BACKEND'))(location, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+    def __contains__(self, key):
+        return self.has_key(key)
+
+
+def _traced_operation(operation):
+    def method(self, *args, **kwargs):
+        if _current_span.get() is None:
+            return getattr(self._cache, operation)(*args, **kwargs)
+        attributes = {'cache.operation': operation}
+        if args and isinstance(args[0], str):
+            attributes['cache.key'] = args[0]
+        elif args and isinstance(args[0], (list, tuple, dict)):
+            attributes['cache.keys'] = len(args[0])
+        with start_span(f'cache {operation}', kind='client', attributes=attributes) as span:
+            result = getattr(self._cache, operation)(*args, **kwargs)
+            if operation == 'get':
+                span.set_attribute('cache.hit', result is not None)
+            return result
+
+    method.__name__ = operation
+    return method
+
+
+for _operation in CACHE_OPERATIONS:
+    setattr(TracedCache, _operation, _traced_operation(_operation))
@@ -0,0 +1,72 @@
+# lexy/triage.py
+from .dedup import normalize_words
+
+# Быстрый локальный разбор заявки по ключевым словам, без обращения к ИИ.
+# Используется, когда очередь анализа слишком длинная (lexy/admission.py),
+# и для оценки срочности заявки до анализа (lexy/scheduler.py).
+# Ключевые слова - основы после normalize_words, совпадение ищется по началу слова.
+
+CATEGORY_KEYWORDS = {
+    'dtp': ('дтп', 'авари', 'осаго', 'каско', 'гибдд', 'машин', 'автомоб', 'водител', 'виновник'),
+    'labor': ('работодател', 'зарплат', 'уволь', 'увольнен', 'трудов', 'отпуск', 'больничн', 'начальник'),
+    'family': ('развод', 'алимент', 'супруг', 'муж', 'жена', 'ребен', 'детск', 'опек'),
+    'housing': ('квартир', 'жиль', 'аренд', 'управляющ', 'затопил', 'сосед', 'ипотек'),
+    'consumer': ('магазин', 'товар', 'возврат', 'гаранти', 'продав', 'покупк'),
+    'criminal': ('полиц', 'уголовн', 'задержа', 'кража', 'мошенни', 'следовател'),
+}
+
+# Признаки срочности от самой срочной к наименее срочной; по умолчанию 'medium'
+URGENCY_KEYWORDS = (
+    ('critical', ('задержал', 'арест', 'обыск', 'избил', 'избива', 'угрожа', 'похитил', 'насили', 'немедлен')),
+    ('high', ('срочн', 'повестк', 'выселя', 'уволил', 'завтра', 'сегодня', 'суд', 'приста')),
+    ('low', ('консультац', 'интересу', 'подскажит', 'планиру', 'заранее', 'теоретическ')),
+)
+
+GENERIC_RECOMMENDATIONS = {
+    'immediate_actions': [
+        'Сохраните все документы, переписку и чеки, связанные с ситуацией',
+        'Запишите хронологию событий с датами',
+    ],
+    'documents': ['Паспорт', 'Договоры и другие документы по делу'],
+    'next_steps': ['Обсудите ситуацию с AI-юристом подходящей специализации'],
+}
+
+FAST_PATH_DISCLAIMER = (
+    'Сейчас сервис перегружен, поэтому это предварительный автоматический разбор. '
+    'Информация носит справочный характер и не является юридической консультацией.'
+)
+
+
+def guess_category(problem_text):
+    """Категория с наибольшим числом совпавших ключевых слов, 'other' если совпадений нет"""
+    words = normalize_words(problem_text)
+    scores = {
+        category: sum(1 for word in words if word.startswith(keywords))
+        for category, keywords in CATEGORY_KEYWORDS.items()
+    }
+    category, score = max(scores.items(), key=lambda item: item[1])
+    return category if score else 'other'
+
+
+def guess_urgency(problem_text):
+    """Предварительная срочность заявки до анализа ИИ"""
+    words = normalize_words(problem_text)
+    for urgency, keywords in URGENCY_KEYWORDS:
+        if any(word.startswith(keywords) for word in words):
+            return urgency
+    return 'medium'
+
+
+def fast_analysis(problem_text):
+    """Ответ в формате анализатора, собранный без ИИ"""
+    return {
+        'analysis': {
+            'category': guess_category(problem_text),
+            'confidence': 0.3,
+            'summary': problem_text[:200] + '...' if len(problem_text) > 200 else problem_text,
+            'urgency': guess_urgency(problem_text),
+        },
+        'recommendations': GENERIC_RECOMMENDATIONS,
+        'disclaimer': FAST_PATH_DISCLAIMER,
+        'fast_path': True,
+    }
@@ -26,4 +26,7 @@ urlpatterns = [
     path('api/close-chat/<int:chat_id>/', views.close_chat, name='close_chat'),
     path('api/reset-context/<int:chat_id>/', views.reset_chat_context, name='reset_chat_context'),
     path('api/debug-context/<int:chat_id>/', views.debug_chat_context, name='debug_chat_context'),
+
+    # Мониторинг
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
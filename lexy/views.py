@@ -1,15 +1,27 @@
 # lexy/views.py
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 import json
 from django.utils import timezone
-import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from django.conf import settings
 from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection
 
 from .models import EmergencyRequest, LawyerChat, ChatMessage, Lawyer
 from .forms import EmergencyRequestForm
+from .admission import ACCEPT, FAST_PATH, REJECT, admit, estimate_chat_wait, record_llm_latency
+from .dedup import find_duplicate, reuse_analysis, simhash
+from .idempotency import idempotent
+from .metrics import record_fallback, render_metrics
+from .ratelimit import rate_limited
+from .routers import replica_read
+from .triage import fast_analysis, guess_urgency
+from . import scheduler
+from .status import cache_request_status, get_request_status
 from .yandex_utils import (
     get_lawyer_agent_by_specialization,
     get_all_lawyer_agents,
@@ -27,6 +39,8 @@ def home(request):
 
 @csrf_exempt
 @require_POST
+@idempotent
+@rate_limited
 def submit_request(request):
     """Обработка AJAX запроса на создание заявки"""
     if request.content_type == 'application/json':
@@ -47,31 +61,58 @@ def submit_request(request):
             'error': 'Опишите проблему подробнее (минимум 20 символов)'
         }, status=400)
 
+    # Очередь анализа слишком длинная - быстрый разбор без ИИ или отказ
+    decision, wait = admit()
+    if decision == REJECT:
+        response = JsonResponse({
+            'success': False,
+            'error': 'Сейчас очень много обращений. Пожалуйста, повторите через несколько минут'
+        }, status=503)
+        response['Retry-After'] = str(int(wait))
+        return response
+
     try:
+        if decision == FAST_PATH:
+            record_fallback('analyze', AGENTS['general']['id'], 'overload')
+            ai_response = fast_analysis(problem_text.strip())
+            analysis = ai_response['analysis']
+            fields = {
+                'status': 'completed',
+                'ai_response': ai_response,
+                'category': analysis['category'],
+                'urgency': analysis['urgency'],
+                'confidence': analysis['confidence'],
+                'summary': analysis['summary'],
+                'analyzed_at': timezone.now(),
+            }
+        else:
+            fields = {'status': 'analyzing'}
+
         # Создаем запрос
         request_obj = EmergencyRequest.objects.create(
             problem_text=problem_text.strip(),
             ip_address=request.META.get('REMOTE_ADDR'),
             user_agent=request.META.get('HTTP_USER_AGENT', ''),
             session_key=request.session.session_key or '',
-            status='analyzing'
+            **fields
         )
 
         # Сохраняем ID запроса в сессии
         request.session['current_request_id'] = request_obj.id
+        cache_request_status(request_obj)
 
-        # Запускаем анализ в отдельном потоке
-        thread = threading.Thread(
-            target=analyze_with_yandex_assistant,
-            args=(request_obj.id, problem_text.strip())
-        )
-        thread.daemon = True
-        thread.start()
+        if decision == ACCEPT:
+            # Ставим анализ в очередь обращений к ИИ; срочность до анализа оценивается локально
+            scheduler.submit(
+                run_analysis_thread, request_obj.id, problem_text.strip(),
+                urgency=guess_urgency(problem_text)
+            )
 
         return JsonResponse({
             'success': True,
             'request_id': request_obj.id,
-            'redirect_url': f'/request/{request_obj.id}/'
+            'redirect_url': f'/request/{request_obj.id}/',
+            'degraded': decision == FAST_PATH
         })
 
     except Exception as e:
@@ -81,15 +122,35 @@ def submit_request(request):
         }, status=500)
 
 
+def run_analysis_thread(request_id, problem_text):
+    """Фоновый анализ заявки; по окончании закрывает соединение потока с БД"""
+    try:
+        analyze_with_yandex_assistant(request_id, problem_text)
+    finally:
+        connection.close()
+
+
 def analyze_with_yandex_assistant(request_id, problem_text):
     """Анализ ситуации через Yandex Assistant API"""
     from .models import EmergencyRequest
 
     try:
         request_obj = EmergencyRequest.objects.get(id=request_id)
+        request_obj.simhash = simhash(problem_text)
+
+        # Почти такой же текст уже анализировался - берем готовый ответ
+        source, score = find_duplicate(problem_text, request_obj.simhash, exclude_id=request_id)
+        if source is not None:
+            reuse_analysis(request_obj, source)
+            request_obj.save()
+            cache_request_status(request_obj)
+            return
+
         assistant_id = AGENTS['general']['id']
 
+        started = time.monotonic()
         ai_response = analyze_with_assistant(assistant_id, problem_text)
+        record_llm_latency(time.monotonic() - started)
 
         if 'error' not in ai_response:
             request_obj.ai_response = ai_response
@@ -114,6 +175,7 @@ def analyze_with_yandex_assistant(request_id, problem_text):
             request_obj.summary = "Ассистент не смог проанализировать ситуацию"
 
         request_obj.save()
+        cache_request_status(request_obj)
 
     except Exception as e:
         try:
@@ -121,10 +183,48 @@ def analyze_with_yandex_assistant(request_id, problem_text):
             request_obj.status = 'failed'
             request_obj.error_message = str(e)
             request_obj.save()
+            cache_request_status(request_obj)
         except:
             pass
 
 
+class LawyerBusy(Exception):
+    """Ответ юриста не успеет за chat_timeout_seconds; retry_after - через сколько секунд повторить"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Очередь обращений к ИИ занята на {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def lawyer_busy_response(error):
+    response = JsonResponse({
+        'success': False,
+        'error': 'Юрист сейчас отвечает другим клиентам. Пожалуйста, повторите через минуту'
+    }, status=503)
+    response['Retry-After'] = str(int(error.retry_after))
+    return response
+
+
+def check_lawyer_wait():
+    """Отказать сразу, если по оценке ответ юриста не успеет за chat_timeout_seconds"""
+    wait = estimate_chat_wait(scheduler.get_scheduler().queue_depth())
+    if wait > settings.LLM_SCHEDULER['chat_timeout_seconds']:
+        raise LawyerBusy(wait)
+
+
+def ask_lawyer(agent_id, messages_history, chat_id, urgency):
+    """Ответ AI-юриста через общую очередь обращений к ИИ с приоритетом по срочности дела"""
+    check_lawyer_wait()
+    timeout = settings.LLM_SCHEDULER['chat_timeout_seconds']
+    future = scheduler.submit(chat_with_lawyer, agent_id, messages_history, chat_id, urgency=urgency or 'medium')
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeoutError:
+        future.cancel()
+        raise LawyerBusy(timeout)
+
+
+@replica_read
 def request_status(request, request_id):
     """Страница статуса запроса с результатом анализа"""
     try:
@@ -187,26 +287,32 @@ def format_text_response(text):
     }
 
 
+@replica_read
 def check_analysis_status(request, request_id):
     """API endpoint для проверки статуса анализа"""
-    try:
-        request_obj = EmergencyRequest.objects.get(id=request_id)
-
-        response_data = {
-            'status': request_obj.status,
-            'has_response': bool(request_obj.ai_response),
-            'category': request_obj.category,
-            'urgency': request_obj.urgency
-        }
+    status = get_request_status(request_id)
+    if status is None:
+        return JsonResponse({'error': 'Запрос не найден'}, status=404)
 
-        if request_obj.status == 'completed' and request_obj.ai_response:
-            response_data['response'] = request_obj.ai_response
-            response_data['summary'] = request_obj.summary
+    response_data = {
+        'status': status['status'],
+        'has_response': status['has_response'],
+        'category': status['category'],
+        'urgency': status['urgency']
+    }
 
-        return JsonResponse(response_data)
+    if status['status'] == 'completed' and status['has_response']:
+        # Ответ ИИ читается один раз, когда анализ уже завершен. Статус мог прийти
+        # из кэша раньше, чем реплика получила ответ, поэтому читаем основную базу
+        response_data['response'] = (
+            EmergencyRequest.objects.using(DEFAULT_DB_ALIAS)
+            .filter(id=request_id)
+            .values_list('ai_response', flat=True)
+            .first()
+        )
+        response_data['summary'] = status['summary']
 
-    except EmergencyRequest.DoesNotExist:
-        return JsonResponse({'error': 'Запрос не найден'}, status=404)
+    return JsonResponse(response_data)
 
 
 def how_it_works(request):
@@ -267,6 +373,7 @@ def find_lawyers(request, request_id):
     return render(request, 'lexy/find_lawyers.html', context)
 
 
+@rate_limited
 def auto_start_chat(request, request_id, specialization_code):
     """Автоматически начать чат с подходящим AI-юристом"""
     emergency_request = get_object_or_404(EmergencyRequest, id=request_id)
@@ -306,6 +413,9 @@ def auto_start_chat(request, request_id, specialization_code):
         if existing_chat:
             return redirect('chat_view', chat_id=existing_chat.id)
 
+        # Новый чат не создается, если юрист все равно не успеет ответить
+        check_lawyer_wait()
+
         # Создаем чат с ОБЯЗАТЕЛЬНЫМ полем lawyer
         chat = LawyerChat.objects.create(
             request=emergency_request,
@@ -338,7 +448,7 @@ def auto_start_chat(request, request_id, specialization_code):
         }]
 
         # Передаем chat.id для создания conversation в Yandex AI
-        ai_response = chat_with_lawyer(lawyer_data['id'], messages_history, chat.id)
+        ai_response = ask_lawyer(lawyer_data['id'], messages_history, chat.id, emergency_request.urgency)
 
         # Формируем ответ юриста
         if isinstance(ai_response, dict):
@@ -374,6 +484,7 @@ def auto_start_chat(request, request_id, specialization_code):
 
 @csrf_exempt
 @require_POST
+@rate_limited
 def start_chat(request, specialization_code):
     """Начать чат с AI-юристом по специализации"""
     # Получаем данные юриста
@@ -391,6 +502,9 @@ def start_chat(request, specialization_code):
     emergency_request = get_object_or_404(EmergencyRequest, id=request_id)
 
     try:
+        # Чат не создается, если юрист все равно не успеет ответить
+        check_lawyer_wait()
+
         # Создаем или получаем юриста
         lawyer_obj, created = Lawyer.objects.get_or_create(
             name=lawyer_data['name'],
@@ -441,7 +555,7 @@ def start_chat(request, specialization_code):
             'content': emergency_request.problem_text[:500]
         }]
 
-        ai_response = chat_with_lawyer(lawyer_data['id'], messages_history, chat.id)
+        ai_response = ask_lawyer(lawyer_data['id'], messages_history, chat.id, emergency_request.urgency)
 
         # Формируем ответ юриста
         if isinstance(ai_response, dict):
@@ -467,6 +581,8 @@ def start_chat(request, specialization_code):
             'redirect_url': f'/chat/{chat.id}/'
         })
 
+    except LawyerBusy as e:
+        return lawyer_busy_response(e)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -474,7 +590,7 @@ def start_chat(request, specialization_code):
 def chat_view(request, chat_id):
     """Страница чата с AI-юристом"""
     chat = get_object_or_404(LawyerChat, id=chat_id)
-    messages = chat.messages.all().order_by('timestamp')
+    messages = chat.get_messages()
 
     # Получаем объект юриста из базы
     lawyer_obj = chat.lawyer if hasattr(chat, 'lawyer') and chat.lawyer else None
@@ -503,6 +619,8 @@ def chat_view(request, chat_id):
 
 @csrf_exempt
 @require_POST
+@idempotent
+@rate_limited
 def send_message(request, chat_id):
     """Отправить сообщение в чат с использованием Conversations API"""
     chat = get_object_or_404(LawyerChat, id=chat_id)
@@ -514,6 +632,10 @@ def send_message(request, chat_id):
         return JsonResponse({'success': False, 'error': 'Сообщение не может быть пустым'})
 
     try:
+        # Сообщение клиента не сохраняется, если юрист все равно не успеет ответить:
+        # повтор после 503 не создаст его дубликат
+        check_lawyer_wait()
+
         # Сохраняем сообщение клиента
         ChatMessage.objects.create(
             chat=chat,
@@ -539,7 +661,8 @@ def send_message(request, chat_id):
                 })
 
         # Ключевое изменение: передаем chat.id для использования Conversations API
-        ai_response = chat_with_lawyer(chat.lawyer_agent_id, messages_history, chat.id)
+        urgency = EmergencyRequest.objects.filter(pk=chat.request_id).values_list('urgency', flat=True).first()
+        ai_response = ask_lawyer(chat.lawyer_agent_id, messages_history, chat.id, urgency)
 
         # Сохраняем ответ
         if isinstance(ai_response, dict):
@@ -584,6 +707,8 @@ def send_message(request, chat_id):
             'sender': 'lawyer'
         })
 
+    except LawyerBusy as e:
+        return lawyer_busy_response(e)
     except Exception as e:
         print(f"Ошибка отправки сообщения: {e}")
         import traceback
@@ -591,6 +716,7 @@ def send_message(request, chat_id):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+@replica_read
 def all_lawyers(request):
     """Страница со всеми AI-юристами"""
     # Получаем всех доступных AI-юристов
@@ -636,17 +762,18 @@ def lawyer_detail(request, specialization_code):
     return render(request, 'lexy/lawyer_detail.html', context)
 
 
+@replica_read
 def get_chat_messages(request, chat_id):
     """Получить сообщения чата"""
     chat = get_object_or_404(LawyerChat, id=chat_id)
-    messages = chat.messages.all().order_by('timestamp')
+    messages = chat.get_messages()
 
     messages_list = []
     for msg in messages:
         messages_list.append({
-            'sender': msg.sender,
-            'message': msg.message,
-            'timestamp': msg.timestamp.isoformat(),
+            'sender': msg['sender'],
+            'message': msg['message'],
+            'timestamp': msg['timestamp'].isoformat(),
         })
 
     return JsonResponse({
@@ -729,4 +856,18 @@ def debug_chat_context(request, chat_id):
         'status': chat.status
     }
 
-    return JsonResponse({'success': True, 'debug_info': debug_info})
\ No newline at end of file
+    return JsonResponse({'success': True, 'debug_info': debug_info})
+
+
+def metrics(request):
+    """Метрики обращений к ИИ в формате Prometheus"""
+    options = settings.METRICS
+    if not options['enabled']:
+        return HttpResponseNotFound()
+    if not options['token']:
+        # Без токена метрики открыты только при разработке
+        if not settings.DEBUG:
+            return HttpResponseNotFound()
+    elif request.headers.get('Authorization') != f"Bearer {options['token']}":
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,22 +1,71 @@
 # lexy/yandex_utils.py
 import json
-import openai
 import re
+import threading
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.core.cache import cache
 import time
 
-# Конфигурация Yandex Cloud
-YANDEX_CLOUD_API_KEY = 'AQVNz0007Rz_GVsUFteCbJQ34he2dhsdGDC7_sFr'
-PROJECT_ID = 'b1ggvnsm70rqgii9kmc6'
-
-# Инициализация клиента OpenAI с Yandex endpoint
-yandex_client = openai.OpenAI(
-    api_key=YANDEX_CLOUD_API_KEY,
-    base_url="https://ai.api.cloud.yandex.net/v1",
-    project=PROJECT_ID
+from .metrics import (
+    SPECIALIZATION_MODEL, record_fallback, record_parse_failure, record_token_usage, track_llm_call
 )
 
+# Конфигурация Yandex Cloud
+YANDEX_CLOUD_API_KEY = settings.LLM_BACKEND['api_key']
+PROJECT_ID = settings.LLM_BACKEND['project']
+
+# Клиент создается при первом обращении к ИИ: импорт openai/httpx заметно
+# замедляет запуск manage.py, миграций и воркеров.
+# Бэкенд выбирается настройкой LLM_BACKEND: Yandex AI (или совместимый с ним
+# сервер, например локальная заглушка) либо заглушка внутри процесса.
+_yandex_client = None
+_yandex_client_lock = threading.Lock()
+
+
+def create_llm_client(options):
+    """Клиент с API responses/conversations для бэкенда из LLM_BACKEND"""
+    if options['backend'] == 'fake':
+        from .llm_fake import FakeLLMClient
+        client = FakeLLMClient(**options['fake'])
+    elif options['backend'] == 'replay':
+        from .llm_recording import ReplayLLMClient
+        client = ReplayLLMClient(options['replay_from'], options['replay_latency_scale'])
+    elif options['backend'] == 'yandex':
+        if not options['api_key']:
+            raise ImproperlyConfigured(
+                "Не задан YANDEX_CLOUD_API_KEY (для локальной заглушки подойдет любое значение)"
+            )
+        import openai
+        client = openai.OpenAI(
+            api_key=options['api_key'],
+            base_url=options['base_url'],
+            project=options['project']
+        )
+    else:
+        raise ValueError(f"Неизвестный бэкенд ИИ: {options['backend']}")
+
+    if options.get('record_to'):
+        from .llm_recording import RecordingLLMClient
+        client = RecordingLLMClient(client, options['record_to'])
+    return client
+
+
+def get_yandex_client():
+    """Клиент ИИ, создается один раз на процесс"""
+    global _yandex_client
+    if _yandex_client is None:
+        with _yandex_client_lock:
+            if _yandex_client is None:
+                _yandex_client = create_llm_client(settings.LLM_BACKEND)
+    return _yandex_client
+
+
+def set_yandex_client(client):
+    """Подменить клиент (тесты, нагрузочные прогоны); None - вернуть клиент по умолчанию"""
+    global _yandex_client
+    _yandex_client = client
+
 
 # Ключ для хранения conversation_id в кэше (можно хранить в базе)
 def get_conversation_cache_key(chat_id):
@@ -32,7 +81,8 @@ def get_or_create_conversation(chat_id):
     if not conversation_id:
         # Создаем новый conversation
         try:
-            conversation = yandex_client.conversations.create()
+            with track_llm_call('conversation', None):
+                conversation = get_yandex_client().conversations.create()
             conversation_id = conversation.id
             cache.set(cache_key, conversation_id, timeout=86400)  # 24 часа
             print(f"Создан новый conversation для чата {chat_id}: {conversation_id}")
@@ -99,10 +149,12 @@ def determine_lawyer_specialization(problem_text):
         """
 
         # Используем общую модель YandexGPT для анализа
-        response = yandex_client.responses.create(
-            model=f"gpt://{PROJECT_ID}/yandexgpt",
-            input=prompt
-        )
+        with track_llm_call('specialization', SPECIALIZATION_MODEL):
+            response = get_yandex_client().responses.create(
+                model=f"gpt://{PROJECT_ID}/{SPECIALIZATION_MODEL}",
+                input=prompt
+            )
+        record_token_usage('specialization', SPECIALIZATION_MODEL, response)
 
         if hasattr(response, 'output_text') and response.output_text:
             result = response.output_text.strip().lower()
@@ -117,6 +169,7 @@ def determine_lawyer_specialization(problem_text):
                     return code
 
             # Если не нашли явно, анализируем содержание
+            record_parse_failure('specialization', SPECIALIZATION_MODEL)
             if 'авто' in result or 'дтп' in result or 'машин' in result:
                 return 'auto'
             elif 'труд' in result or 'работа' in result or 'зарплат' in result:
@@ -126,10 +179,12 @@ def determine_lawyer_specialization(problem_text):
             else:
                 return 'civil'
 
+        record_fallback('specialization', SPECIALIZATION_MODEL, 'empty_response')
         return 'civil'  # По умолчанию
 
     except Exception as e:
         print(f"Ошибка определения специализации: {e}")
+        record_fallback('specialization', SPECIALIZATION_MODEL, 'error')
         return 'civil'  # По умолчанию при ошибке
 
 
@@ -146,10 +201,12 @@ def get_all_lawyer_agents():
 def analyze_with_assistant(assistant_id, problem_text):
     """Анализ ситуации через ассистента (оставляем старую логику)"""
     try:
-        response = yandex_client.responses.create(
-            prompt={"id": assistant_id},
-            input=problem_text
-        )
+        with track_llm_call('analyze', assistant_id):
+            response = get_yandex_client().responses.create(
+                prompt={"id": assistant_id},
+                input=problem_text
+            )
+        record_token_usage('analyze', assistant_id, response)
 
         if hasattr(response, 'output_text') and response.output_text:
             output_text = response.output_text.strip()
@@ -168,6 +225,7 @@ def analyze_with_assistant(assistant_id, problem_text):
                 return parsed_response
             except json.JSONDecodeError:
                 # ... существующий обработчик ошибок ...
+                record_parse_failure('analyze', assistant_id)
                 return {
                     "analysis": {
                         "category": "other",
@@ -180,10 +238,12 @@ def analyze_with_assistant(assistant_id, problem_text):
                 }
         else:
             print("Агент не вернул output_text")
+            record_fallback('analyze', assistant_id, 'empty_response')
             return {"error": "Ассистент не ответил"}
 
     except Exception as e:
         print(f"Ошибка при вызове API: {str(e)}")
+        record_fallback('analyze', assistant_id, 'error')
         return {"error": str(e)}
 
 
@@ -202,6 +262,7 @@ def chat_with_lawyer(assistant_id, messages_history, chat_id=None):
 
         if not conversation_id:
             print(f"⚠ Не удалось создать conversation для чата {chat_id}, пробуем старый метод")
+            record_fallback('chat', assistant_id, 'no_conversation')
             return chat_with_lawyer_fallback(assistant_id, messages_history)
 
         # Получаем последнее сообщение пользователя
@@ -215,11 +276,13 @@ def chat_with_lawyer(assistant_id, messages_history, chat_id=None):
             last_user_message = "Здравствуйте, нужна ваша помощь."
 
         # Ключевое изменение: используем prompt с ID агента, а не просто model!
-        response = yandex_client.responses.create(
-            prompt={"id": assistant_id},  # ← ID твоего агента Анны
-            conversation=conversation_id,  # Для сохранения контекста
-            input=last_user_message
-        )
+        with track_llm_call('chat', assistant_id):
+            response = get_yandex_client().responses.create(
+                prompt={"id": assistant_id},  # ← ID твоего агента Анны
+                conversation=conversation_id,  # Для сохранения контекста
+                input=last_user_message
+            )
+        record_token_usage('chat', assistant_id, response)
 
         if hasattr(response, 'output_text') and response.output_text:
             output_text = response.output_text.strip()
@@ -243,6 +306,7 @@ def chat_with_lawyer(assistant_id, messages_history, chat_id=None):
 
             except json.JSONDecodeError:
                 print(f"Юрист не вернул JSON, возвращаем текстом")
+                record_parse_failure('chat', assistant_id)
 
             # Если не JSON, создаем структурированный ответ
             return {
@@ -256,11 +320,13 @@ def chat_with_lawyer(assistant_id, messages_history, chat_id=None):
             }
         else:
             print("Юрист не вернул ответ")
+            record_fallback('chat', assistant_id, 'empty_response')
             return {"error": "Юрист не ответил"}
 
     except Exception as e:
         print(f"Ошибка при вызове Conversations API: {str(e)}")
         # Пробуем fallback метод
+        record_fallback('chat', assistant_id, 'error')
         return chat_with_lawyer_fallback(assistant_id, messages_history)
 
 
@@ -279,10 +345,12 @@ def chat_with_lawyer_fallback(assistant_id, messages_history):
         if not last_user_message:
             last_user_message = "Здравствуйте, нужна ваша помощь."
 
-        response = yandex_client.responses.create(
-            prompt={"id": assistant_id},
-            input=last_user_message
-        )
+        with track_llm_call('chat_fallback', assistant_id):
+            response = get_yandex_client().responses.create(
+                prompt={"id": assistant_id},
+                input=last_user_message
+            )
+        record_token_usage('chat_fallback', assistant_id, response)
 
         if hasattr(response, 'output_text') and response.output_text:
             output_text = response.output_text.strip()
@@ -298,6 +366,7 @@ def chat_with_lawyer_fallback(assistant_id, messages_history):
                 parsed_response = json.loads(output_text)
                 return parsed_response
             except json.JSONDecodeError:
+                record_parse_failure('chat_fallback', assistant_id)
                 return {
                     "lawyer_name": "Юрист",
                     "specialization": "Правовая помощь",
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -36,8 +37,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lexy.tracing.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'lexy.routers.ReplicaRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -66,14 +69,84 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'lexy_core.wsgi.application'
 
-# Временная база данных SQLite для разработки
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# База данных выбирается переменной DB_ENGINE: sqlite (по умолчанию, для разработки)
+# или postgresql (продакшен)
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'lexy'),
+            'USER': os.getenv('DB_USER', 'lexy'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Постоянные соединения: не открывать новое на каждый запрос
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            # Проверять соединение перед повторным использованием
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                'application_name': os.getenv('DB_APPLICATION_NAME', 'lexy'),
+            },
+        }
+    }
+
+    # Режим для пулера (PgBouncer в transaction pooling): серверные курсоры
+    # не переживают смену соединения внутри пулера
+    if os.getenv('DB_POOLER', 'False') == 'True':
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    DATABASES = {
+        'default': {
+            # SQLite с BEGIN IMMEDIATE для транзакций (lexy/db_backend)
+            'ENGINE': 'lexy.db_backend',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+            },
+        }
     }
+
+# Реплики для чтения (DB_REPLICA_HOSTS=host1,host2): на них идут запросы
+# view, помеченных lexy.routers.replica_read
+DATABASE_REPLICAS = []
+if DB_ENGINE == 'postgresql':
+    for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+        alias = f'replica_{index}'
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['lexy.routers.ReplicaRouter']
+
+# Сколько секунд после записи клиент читает только с основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '10'))
+
+# Прагмы SQLite, применяемые к каждому новому соединению (lexy/db.py).
+# busy_timeout заставляет писателя ждать блокировку вместо "database is locked";
+# ожидание работает, потому что транзакции начинаются с BEGIN IMMEDIATE.
+# Режим журнала хранится в самом файле базы и задается один раз миграцией
+# lexy 0011 (manage.py migrate) из SQLITE_JOURNAL_MODE
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '10000')),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'normal'),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
 }
 
+# Старая база SQLite как источник для переноса данных (manage.py copy_database)
+if os.getenv('DB_LEGACY_SQLITE'):
+    DATABASES['legacy'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_LEGACY_SQLITE'),
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -96,4 +169,180 @@ MEDIA_ROOT = BASE_DIR / 'media'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Файлы фоновых выгрузок чатов (не публикуются как media)
+EXPORTS_ROOT = BASE_DIR / 'exports'
+
+# Через сколько дней после закрытия чата его сообщения переносятся
+# в архивную таблицу (manage.py archive_chat_messages)
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '30'))
+
+# Общий кэш для нескольких процессов (ключи идемпотентности, статусы заявок).
+# Без REDIS_URL используется локальный кэш процесса.
+# Счетчики метрик (lexy/metrics.py) хранятся отдельно: их не должны вытеснять
+# другие ключи. В Redis для этого нужна политика maxmemory-policy volatile-*
+# или noeviction: счетчики записываются без срока хранения
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+        'metrics': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'metrics',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'metrics': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'lexy-metrics',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Повторы submit_request и send_message (lexy/idempotency.py)
+IDEMPOTENCY = {
+    # Сколько хранится ответ на запрос с заголовком Idempotency-Key
+    'key_ttl': int(os.getenv('IDEMPOTENCY_KEY_TTL', '3600')),
+    # Сколько одинаковый запрос без заголовка считается повтором
+    'content_ttl': int(os.getenv('IDEMPOTENCY_CONTENT_TTL', '10')),
+    # Сколько повтор ждет окончания первого запроса
+    'wait_seconds': 30,
+}
+
+# Прием заявок при длинной очереди анализа (lexy/admission.py)
+ADMISSION = {
+    'enabled': os.getenv('ADMISSION_ENABLED', 'True') == 'True',
+    # До какого ожидания заявка идет на обычный анализ через ИИ
+    'slo_seconds': int(os.getenv('ADMISSION_SLO_SECONDS', '60')),
+    # До какого ожидания дается быстрый локальный разбор, дальше - отказ
+    'reject_after_seconds': int(os.getenv('ADMISSION_REJECT_AFTER_SECONDS', '300')),
+    # Сколько запросов анализа ИИ обслуживает одновременно один процесс приложения
+    'concurrency': int(os.getenv('ADMISSION_CONCURRENCY', '4')),
+    # Сколько процессов приложения запущено (воркеры gunicorn/uwsgi на всех узлах)
+    'processes': int(os.getenv('ADMISSION_PROCESSES', '1')),
+    # Время ответа ИИ, пока нет ни одного замера
+    'default_latency_seconds': 15,
+    # Заявки, анализ которых идет дольше, считаются зависшими
+    'stale_after_seconds': 900,
+}
+
+# Очередь обращений к ИИ с приоритетом по срочности (lexy/scheduler.py)
+LLM_SCHEDULER = {
+    'workers': ADMISSION['concurrency'],
+    # Через сколько секунд ожидания задача поднимается на один уровень срочности
+    'aging_seconds': int(os.getenv('LLM_SCHEDULER_AGING_SECONDS', '10')),
+    # Сколько view ждет ответа юриста из очереди; если по оценке ответ не успеет,
+    # чат сразу получает 503 с Retry-After
+    'chat_timeout_seconds': int(os.getenv('LLM_CHAT_TIMEOUT_SECONDS', '60')),
+}
+
+# Бэкенд ИИ (lexy/yandex_utils.py):
+#   'yandex' - OpenAI-совместимый API по адресу base_url (Yandex AI или локальная заглушка
+#              manage.py run_fake_llm, тогда base_url = http://127.0.0.1:8765/v1);
+#   'fake'   - заглушка внутри процесса (lexy/llm_fake.py), по умолчанию в тестах;
+#   'replay' - ответы из фикстуры replay_from (lexy/llm_recording.py) с записанной
+#              задержкой, умноженной на replay_latency_scale.
+# Если задан record_to, все обращения к выбранному бэкенду записываются в эту фикстуру.
+# Параметры 'fake' задают медиану задержки ответа, разброс (sigma логнормального
+# распределения), долю ошибок и seed генератора.
+RUNNING_TESTS = sys.argv[1:2] == ['test']
+
+LLM_BACKEND = {
+    'backend': os.getenv('LLM_BACKEND', 'fake' if RUNNING_TESTS else 'yandex'),
+    'base_url': os.getenv('LLM_BASE_URL', 'https://ai.api.cloud.yandex.net/v1'),
+    # Ключ задается только переменной окружения
+    'api_key': os.getenv('YANDEX_CLOUD_API_KEY', ''),
+    'project': os.getenv('YANDEX_CLOUD_PROJECT_ID', 'b1ggvnsm70rqgii9kmc6'),
+    'record_to': os.getenv('LLM_RECORD_TO', ''),
+    'replay_from': os.getenv('LLM_REPLAY_FROM', ''),
+    'replay_latency_scale': float(os.getenv('LLM_REPLAY_LATENCY_SCALE', '1')),
+    'fake': {
+        'latency_ms': int(os.getenv('LLM_FAKE_LATENCY_MS', '0' if RUNNING_TESTS else '800')),
+        'latency_sigma': float(os.getenv('LLM_FAKE_LATENCY_SIGMA', '0.5')),
+        'error_rate': float(os.getenv('LLM_FAKE_ERROR_RATE', '0')),
+        'seed': None,
+    },
+}
+
+# Метрики обращений к ИИ для Prometheus (GET /metrics, lexy/metrics.py).
+# Запрос передает токен в заголовке Authorization: Bearer; без токена
+# метрики отдаются только при DEBUG. Без Redis у каждого процесса свои
+# счетчики: manage.py check --deploy сообщает об этом ошибкой
+METRICS = {
+    'enabled': os.getenv('METRICS_ENABLED', 'True') == 'True',
+    'token': os.getenv('METRICS_TOKEN', ''),
+    'cache': 'metrics',
+    # Сколько секунд переиспользуется число заявок в очереди анализа между опросами
+    'backlog_cache_seconds': 15,
+    # Границы корзин гистограммы времени вызова ИИ, секунды
+    'latency_buckets': (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+}
+
+# Трассировка запросов (lexy/tracing.py): спаны view, запросов к БД, операций кэша,
+# вызовов ИИ и фоновых задач пишутся в path в формате OTLP/JSON (manage.py trace_report)
+TRACING = {
+    'enabled': os.getenv('TRACING_ENABLED', 'False') == 'True',
+    'path': os.getenv('TRACING_PATH', str(BASE_DIR / 'traces' / 'spans.jsonl')),
+    'service_name': 'lexy',
+    # Доля трассируемых запросов
+    'sample_rate': float(os.getenv('TRACING_SAMPLE_RATE', '1')),
+    # Записывать текст SQL-запросов
+    'db_statements': os.getenv('TRACING_DB_STATEMENTS', 'True') == 'True',
+}
+
+# Операции кэша пишутся в трассу через обертку над настоящим backend
+if TRACING['enabled']:
+    CACHES['default'] = {
+        **CACHES['default'],
+        'BACKEND': 'lexy.tracing.TracedCache',
+        'TRACED_BACKEND': CACHES['default']['BACKEND'],
+    }
+
+# Бюджеты запросов к view, вызывающим ИИ: (запросов, за секунд) на один IP (lexy/ratelimit.py)
+RATE_LIMITS = {
+    'submit_request': (5, 60),
+    'send_message': (20, 60),
+    'start_chat': (10, 60),
+    'auto_start_chat': (10, 60),
+}
+
+# Повторное использование анализа для почти одинаковых заявок (lexy/dedup.py)
+ANALYSIS_REUSE = {
+    'enabled': os.getenv('ANALYSIS_REUSE_ENABLED', 'True') == 'True',
+    # Минимальная похожесть текстов (мера Жаккара по парам слов)
+    'min_similarity': float(os.getenv('ANALYSIS_REUSE_MIN_SIMILARITY', '0.9')),
+    # Среди заявок за сколько последних дней искать и сколько из них просматривать
+    'window_days': int(os.getenv('ANALYSIS_REUSE_WINDOW_DAYS', '30')),
+    'max_candidates': 2000,
+    # Категории, ответы по которым всегда готовятся заново
+    'excluded_categories': [
+        category for category in os.getenv('ANALYSIS_REUSE_EXCLUDED_CATEGORIES', '').split(',') if category
+    ],
+}
+
+# Сроки хранения персональных данных в днях, 0 - не применять (manage.py apply_retention)
+RETENTION_POLICY = {
+    # IP, User-Agent, ключ сессии и контакты клиента стираются
+    'anonymize': int(os.getenv('RETENTION_ANONYMIZE_DAYS', '90')),
+    # Закрытые чаты удаляются вместе с сообщениями
+    'closed_chats': int(os.getenv('RETENTION_CLOSED_CHATS_DAYS', '365')),
+    # Заявки удаляются вместе со всеми чатами
+    'requests': int(os.getenv('RETENTION_REQUESTS_DAYS', '730')),
+}
+
+# Бюджет времени импорта при запуске в миллисекундах (manage.py check_import_time).
+# Абсолютное время зависит от машины, поэтому по умолчанию 0 - не проверять;
+# задается под конкретный раннер CI с запасом к замеру на нем
+IMPORT_TIME_BUDGETS_MS = {
+    'check': int(os.getenv('IMPORT_TIME_BUDGET_CHECK_MS', '0')),
+    'migrate': int(os.getenv('IMPORT_TIME_BUDGET_MIGRATE_MS', '0')),
+    'worker': int(os.getenv('IMPORT_TIME_BUDGET_WORKER_MS', '0')),
+}